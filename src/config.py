@@ -8,7 +8,8 @@ import logging
 class SSHConfig:
     def __init__(self, connection_name='Default', host=None, port=22, user=None, dynamic_port=1080,
                  auth_method='password', password=None, key_path=None, keepalive_interval=60, keepalive_count_max=120,
-                 http_proxy_port=8080, test_url=None, user_agent=None, home_page=None, selected_language='en'):
+                 http_proxy_port=8080, test_url=None, user_agent=None, home_page=None, selected_language='en',
+                 metrics_port=0):
         self.connection_name = connection_name
         self.host = host
         self.port = port
@@ -24,6 +25,7 @@ class SSHConfig:
         self.user_agent = user_agent
         self.home_page = home_page
         self.selected_language = selected_language
+        self.metrics_port = metrics_port
 
 
 class ConfigManager:
@@ -52,6 +54,9 @@ class ConfigManager:
 
         # Language
         LANGUAGE=en
+
+        # Prometheus metrics of the HTTP proxy and SSH tunnel (0 disables)
+        METRICS_PORT=0
         """
             with open('.env', 'w') as f:
                 f.write(default_content.strip())
@@ -78,7 +83,8 @@ class ConfigManager:
             http_proxy_port=int(os.getenv('HTTP_PROXY_PORT', '8080')),
             user_agent=os.getenv('USER_AGENT', ''),
             home_page=os.getenv('HOME_PAGE', ''),
-            selected_language=os.getenv('LANGUAGE', 'en')
+            selected_language=os.getenv('LANGUAGE', 'en'),
+            metrics_port=int(os.getenv('METRICS_PORT', '0'))
         )
 
     @staticmethod
@@ -12,7 +12,7 @@ import time
 from concurrent.futures import ThreadPoolExecutor
 from config import ConfigManager, SSHConfig
 from ssh_client import SSHClient, SSHConnectionError
-from socks_to_http_proxy import SOCKStoHTTPProxy
+from socks_to_http_proxy import ProxySettings, SOCKStoHTTPProxy
 from password_encryption_decryption import encrypt_password, salt
 from logging_handler import ColoredFormatter
 
@@ -195,7 +195,13 @@ class ConsoleSSHProxy:
             try:
                 self.http_proxy = SOCKStoHTTPProxy(
                     http_port=http_port,
-                    socks_port=socks_port
+                    socks_port=socks_port,
+                    # Hold new requests through an SSH reconnect instead of failing them
+                    settings=ProxySettings(tunnel_hold_timeout=30.0),
+                    # Open SSH channels directly instead of going through the local SOCKS listener
+                    open_channel=self.ssh_client.open_channel if self.ssh_client else None,
+                    # Lets requests held through a reconnect resume as soon as SSH is back
+                    channel_ready=self.ssh_client.channel_ready if self.ssh_client else None
                 )
                 logging.info("[HTTP Proxy] Starting server...")
                 await asyncio.to_thread(self.http_proxy.start)
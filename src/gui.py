@@ -11,7 +11,7 @@ from typing import Optional, Dict, Any
 from config import ConfigManager, SSHConfig
 from ssh_client import SSHClient, SSHConnectionError
 from chrome import chrome_browser
-from socks_to_http_proxy import SOCKStoHTTPProxy
+from socks_to_http_proxy import ProxySettings, SOCKStoHTTPProxy
 from languages_dictionary import TRANSLATIONS
 from logging_handler import ColoredLogQueue, ColoredLogHandler, ColorMapping
 from protocol_baner import run_check_banner
@@ -47,7 +47,15 @@ class ConnectionManager:
 
     def start_http_proxy(self, socks_port: int, http_port: int) -> None:
         """Starts HTTP proxy."""
-        self.proxy = SOCKStoHTTPProxy(http_port=http_port, socks_port=socks_port)
+        # Hold new requests through an SSH reconnect instead of failing them
+        settings = ProxySettings(metrics_port=getattr(self.config, 'metrics_port', 0), tunnel_hold_timeout=30.0)
+        # Tunnel through channels of the SSH connection in this process; the SOCKS port stays for other clients
+        open_channel = self.ssh_client.open_channel if self.ssh_client else None
+        channel_ready = self.ssh_client.channel_ready if self.ssh_client else None
+        self.proxy = SOCKStoHTTPProxy(http_port=http_port, socks_port=socks_port, settings=settings,
+                                      open_channel=open_channel, channel_ready=channel_ready)
+        if self.proxy.metrics is not None and self.ssh_client:
+            self.ssh_client.register_metrics(self.proxy.metrics)
         self.proxy_thread = threading.Thread(target=self.proxy.start, daemon=True)
         self.proxy_thread.start()
         logging.info(f"HTTP Proxy started on port {http_port} with SOCKS on {socks_port}")
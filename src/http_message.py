@@ -0,0 +1,200 @@
+from dataclasses import dataclass
+from enum import Enum
+from typing import List, Optional, Set, Tuple
+from urllib.parse import urlsplit
+
+# Headers that only apply to a single transport-level connection (RFC 7230, section 6.1)
+HOP_BY_HOP_HEADERS = frozenset({
+    'connection',
+    'proxy-connection',
+    'keep-alive',
+    'proxy-authorization',
+    'te',
+    'trailer',
+    'upgrade',
+})
+
+
+class BodyFraming(Enum):
+    """How the end of an HTTP message body is determined"""
+    NONE = 'none'
+    LENGTH = 'length'
+    CHUNKED = 'chunked'
+    CLOSE = 'close'
+
+
+def parse_header_lines(lines: List[bytes]) -> List[Tuple[str, str]]:
+    """Parse raw 'Name: value' header lines into (name, value) pairs"""
+    headers = []
+    for line in lines:
+        if not line:
+            continue
+        name, separator, value = line.partition(b':')
+        if not separator or not name.strip():
+            raise ValueError(f"Malformed header line: {line[:64]!r}")
+        headers.append((name.strip().decode('latin-1'), value.strip().decode('latin-1')))
+    return headers
+
+
+class HTTPMessageHead:
+    """Header accessors shared by request and response heads"""
+    version: str
+    headers: List[Tuple[str, str]]
+
+    def get_header(self, name: str) -> Optional[str]:
+        """Return the first value of a header, case-insensitively"""
+        name = name.lower()
+        for header_name, value in self.headers:
+            if header_name.lower() == name:
+                return value
+        return None
+
+    def connection_tokens(self) -> Set[str]:
+        """Return the lower-cased tokens of the Connection and Proxy-Connection headers"""
+        tokens = set()
+        for header_name, value in self.headers:
+            if header_name.lower() in ('connection', 'proxy-connection'):
+                tokens.update(token.strip().lower() for token in value.split(',') if token.strip())
+        return tokens
+
+    def wants_keep_alive(self) -> bool:
+        """Whether the sender allows the connection to persist after this message"""
+        tokens = self.connection_tokens()
+        if self.version == 'HTTP/1.1':
+            return 'close' not in tokens
+        return 'keep-alive' in tokens
+
+    def header_values(self, name: str) -> List[str]:
+        """Return the comma-separated values of every header line with this name, in order"""
+        name = name.lower()
+        return [part.strip() for header_name, value in self.headers if header_name.lower() == name
+                for part in value.split(',')]
+
+    def content_length(self) -> Optional[int]:
+        """Return the Content-Length value, or None if absent, invalid or conflicting"""
+        values = set(self.header_values('content-length'))
+        if len(values) != 1:
+            return None
+        value = values.pop()
+        return int(value) if value.isascii() and value.isdigit() else None
+
+    def is_chunked(self) -> bool:
+        """Whether chunked is the final transfer coding"""
+        codings = self.header_values('transfer-encoding')
+        return bool(codings) and codings[-1].lower() == 'chunked'
+
+    def end_to_end_headers(self) -> List[Tuple[str, str]]:
+        """Return the headers with hop-by-hop fields removed"""
+        excluded = HOP_BY_HOP_HEADERS | self.connection_tokens()
+        return [(name, value) for name, value in self.headers if name.lower() not in excluded]
+
+    @staticmethod
+    def _serialize(start_line: str, headers: List[Tuple[str, str]]) -> bytes:
+        lines = [start_line] + [f"{name}: {value}" for name, value in headers]
+        return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+
+@dataclass
+class HTTPRequestHead(HTTPMessageHead):
+    """Parsed HTTP request line and headers"""
+    method: str
+    target: str
+    version: str
+    headers: List[Tuple[str, str]]
+
+    @classmethod
+    def parse(cls, data: bytes) -> 'HTTPRequestHead':
+        """Parse a request head terminated by an empty line"""
+        lines = data.split(b'\r\n')
+        parts = lines[0].split()
+        if len(parts) != 3 or not parts[2].startswith(b'HTTP/'):
+            raise ValueError(f"Malformed request line: {lines[0][:64]!r}")
+        method, target, version = (part.decode('latin-1') for part in parts)
+        return cls(method=method.upper(), target=target, version=version,
+                   headers=parse_header_lines(lines[1:]))
+
+    def expects_continue(self) -> bool:
+        """Whether the client waits for 100 Continue before sending the body (RFC 7231, section 5.1.1)"""
+        return '100-continue' in (value.lower() for value in self.header_values('expect'))
+
+    def framing_error(self) -> Optional[str]:
+        """Why the body could be delimited differently by another server, None if it cannot
+
+        Such requests must be refused (RFC 7230, section 3.3.3): an origin
+        connection shared between clients would read the rest of one body as
+        the next client's request.
+        """
+        if self.get_header('transfer-encoding') is not None and not self.is_chunked():
+            return "Transfer-Encoding does not end with chunked"
+        if self.get_header('content-length') is not None and self.content_length() is None:
+            return "invalid or conflicting Content-Length"
+        return None
+
+    def body_framing(self) -> BodyFraming:
+        """Determine how the request body is delimited"""
+        if self.get_header('transfer-encoding') is not None:
+            return BodyFraming.CHUNKED if self.is_chunked() else BodyFraming.CLOSE
+        if self.content_length():
+            return BodyFraming.LENGTH
+        return BodyFraming.NONE
+
+    def origin_form(self) -> str:
+        """Return the request target in origin-form (path and query only)"""
+        if self.target.startswith('/') or self.target == '*':
+            return self.target
+        parts = urlsplit(self.target)
+        path = parts.path or '/'
+        return f"{path}?{parts.query}" if parts.query else path
+
+    def to_upstream(self) -> bytes:
+        """Serialize the request for an origin server, keeping the upstream connection open"""
+        headers = self.end_to_end_headers()
+        if self.get_header('transfer-encoding') is not None:
+            # Transfer-Encoding overrides Content-Length, so the origin must not see both
+            headers = [(name, value) for name, value in headers if name.lower() != 'content-length']
+        if self.get_header('host') is None and not self.target.startswith('/'):
+            headers.insert(0, ('Host', urlsplit(self.target).netloc))
+        if self.version != 'HTTP/1.1':
+            headers.append(('Connection', 'keep-alive'))
+        return self._serialize(f"{self.method} {self.origin_form()} {self.version}", headers)
+
+
+@dataclass
+class HTTPResponseHead(HTTPMessageHead):
+    """Parsed HTTP status line and headers"""
+    version: str
+    status: int
+    reason: str
+    headers: List[Tuple[str, str]]
+
+    @classmethod
+    def parse(cls, data: bytes) -> 'HTTPResponseHead':
+        """Parse a response head terminated by an empty line"""
+        lines = data.split(b'\r\n')
+        parts = lines[0].split(None, 2)
+        if len(parts) < 2 or not parts[0].startswith(b'HTTP/') or not parts[1].isdigit():
+            raise ValueError(f"Malformed status line: {lines[0][:64]!r}")
+        reason = parts[2].decode('latin-1') if len(parts) > 2 else ''
+        return cls(version=parts[0].decode('latin-1'), status=int(parts[1]), reason=reason,
+                   headers=parse_header_lines(lines[1:]))
+
+    def is_interim(self) -> bool:
+        """Whether this is a 1xx informational response"""
+        return 100 <= self.status < 200
+
+    def body_framing(self, request_method: str) -> BodyFraming:
+        """Determine how the response body is delimited (RFC 7230, section 3.3.3)"""
+        if request_method == 'HEAD' or self.is_interim() or self.status in (204, 304):
+            return BodyFraming.NONE
+        if self.get_header('transfer-encoding') is not None:
+            return BodyFraming.CHUNKED if self.is_chunked() else BodyFraming.CLOSE
+        length = self.content_length()
+        if length is None:
+            return BodyFraming.CLOSE
+        return BodyFraming.LENGTH if length else BodyFraming.NONE
+
+    def to_client(self, keep_alive: bool) -> bytes:
+        """Serialize the response for the client with our own connection semantics"""
+        headers = self.end_to_end_headers()
+        headers.append(('Connection', 'keep-alive' if keep_alive else 'close'))
+        return self._serialize(f"{self.version} {self.status} {self.reason}".rstrip(), headers)
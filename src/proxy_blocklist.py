@@ -0,0 +1,208 @@
+import json
+import logging
+import os
+import re
+import threading
+from typing import Iterable, List, Optional, Sequence, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Compiled file layout; files of another version are recompiled from the lists
+FORMAT_VERSION = 1
+
+_DOMAIN = re.compile(r'[a-z0-9_-]+(?:\.[a-z0-9_-]+)*')
+
+# Names hosts files map to themselves rather than block
+LOCAL_NAMES = frozenset({'localhost', 'localhost.localdomain', 'local', 'broadcasthost',
+                         'ip6-localhost', 'ip6-loopback', 'ip6-localnet', 'ip6-mcastprefix',
+                         'ip6-allnodes', 'ip6-allrouters', 'ip6-allhosts', '0.0.0.0'})
+
+# Adblock options that do not narrow a rule below its domain; the proxy only sees the
+# destination, so rules limited to some pages or resource types are skipped
+WHOLE_DOMAIN_OPTIONS = frozenset({'important', 'third-party', '3p', 'all', 'document', 'doc', 'popup'})
+
+Source = Tuple[str, int, int]  # (path, size, modification time in ns)
+
+
+def _normalize_host(host: str) -> str:
+    return host.strip().strip('[]').rstrip('.').lower()
+
+
+def _domain(name: str) -> Optional[str]:
+    name = name.rstrip('.').lower()
+    if not _DOMAIN.fullmatch(name) or name.rpartition('.')[2].isdigit():
+        # No top-level domain is numeric, so such entries are addresses or their fragments
+        return None
+    return name
+
+
+def _is_address(token: str) -> bool:
+    return ':' in token or token.replace('.', '').isdigit()
+
+
+def _fingerprint(path: str) -> Source:
+    info = os.stat(path)
+    return (os.path.abspath(path), info.st_size, info.st_mtime_ns)
+
+
+class Blocklist:
+    """Compiled domain blocklist
+
+    Hosts-file entries block exactly the listed name; Adblock '||domain^' rules
+    and bare domain lines block the domain and all its subdomains, and
+    '@@||domain^' exceptions unblock them again. Each kind is a set of names,
+    so a lookup costs one hash probe per label of the host whatever the size
+    of the lists, and half a million names take less memory than a trie of
+    per-label dicts would.
+    """
+
+    def __init__(self, exact: Iterable[str] = (), suffixes: Iterable[str] = (),
+                 allowed: Iterable[str] = (), sources: Sequence[Source] = ()):
+        self.exact: Set[str] = set(exact)
+        self.suffixes: Set[str] = set(suffixes)
+        self.allowed: Set[str] = set(allowed)
+        self.sources: List[Source] = [tuple(source) for source in sources]
+        self.hits = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.exact) + len(self.suffixes)
+
+    def _add_line(self, line: str) -> bool:
+        """Compile one list line, False for lines in a syntax the proxy cannot apply"""
+        line = line.strip()
+        if not line or line[0] in '!#[':
+            return True
+
+        if line.startswith('||') or line.startswith('@@||'):
+            allow = line.startswith('@@')
+            pattern, _, options = line[4 if allow else 2:].partition('$')
+            if options and not set(options.lower().split(',')) <= WHOLE_DOMAIN_OPTIONS:
+                return False
+            if pattern.endswith('^|'):
+                pattern = pattern[:-2]
+            elif pattern.endswith('^') or pattern.endswith('|'):
+                pattern = pattern[:-1]
+            domain = _domain(pattern)
+            if domain is None:
+                return False
+            (self.allowed if allow else self.suffixes).add(domain)
+            return True
+
+        comment = line.find('#')
+        if comment > 0 and not line[comment - 1].isspace():
+            # Cosmetic rules such as 'example.com##.banner' hide page elements, not destinations
+            return False
+        tokens = line[:comment].split() if comment > 0 else line.split()
+        if not tokens:
+            return True
+        if len(tokens) == 1:
+            domain = _domain(tokens[0])
+            if domain is None:
+                return False
+            self.suffixes.add(domain)
+            return True
+        if not _is_address(tokens[0]):
+            return False
+        for name in tokens[1:]:
+            domain = _domain(name)
+            if domain is not None and domain not in LOCAL_NAMES:
+                self.exact.add(domain)
+        return True
+
+    def _add_text(self, text: str) -> int:
+        """Compile every line of a list and return the number of lines skipped"""
+        skipped = 0
+        for line in text.splitlines():
+            if not self._add_line(line):
+                skipped += 1
+        return skipped
+
+    @classmethod
+    def parse(cls, text: str) -> 'Blocklist':
+        """Compile a hosts file, an Adblock filter list or a list of domains, one entry per line"""
+        blocklist = cls()
+        blocklist._add_text(text)
+        return blocklist
+
+    @classmethod
+    def from_files(cls, paths: Sequence[str], cache_path: Optional[str] = None) -> 'Blocklist':
+        """Compile the lists in paths, reusing the compiled copy at cache_path while they are unchanged"""
+        sources = [_fingerprint(path) for path in paths]
+        if cache_path:
+            cached = cls.load(cache_path)
+            if cached is not None and cached.sources == sources:
+                logger.info(f"Loaded {len(cached)} blocked domains from {cache_path}")
+                return cached
+
+        blocklist = cls(sources=sources)
+        for path in paths:
+            with open(path, encoding='utf-8', errors='replace') as f:
+                skipped = blocklist._add_text(f.read())
+            if skipped:
+                logger.info(f"Skipped {skipped} unsupported entries in {path}")
+        logger.info(f"Compiled {len(blocklist)} blocked domains from {len(paths)} lists")
+        if cache_path:
+            blocklist.save(cache_path)
+        return blocklist
+
+    def save(self, path: str):
+        """Write the compiled lists to path, replacing it atomically"""
+        record = {'version': FORMAT_VERSION, 'sources': self.sources,
+                  'exact': sorted(self.exact), 'suffixes': sorted(self.suffixes),
+                  'allowed': sorted(self.allowed)}
+        # Worker processes may compile at the same time, so each writes its own temporary file
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(temp_path, 'w') as f:
+                json.dump(record, f, separators=(',', ':'))
+            os.replace(temp_path, path)
+        except OSError as e:
+            logger.warning(f"Cannot save compiled blocklist: {e}")
+
+    @classmethod
+    def load(cls, path: str) -> Optional['Blocklist']:
+        """The compiled lists saved at path, None if there are none usable"""
+        try:
+            with open(path) as f:
+                record = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable compiled blocklist: {e}")
+            return None
+        if not isinstance(record, dict) or record.get('version') != FORMAT_VERSION:
+            return None
+        try:
+            names = [record[kind] for kind in ('exact', 'suffixes', 'allowed')]
+            if not all(isinstance(entries, list) and all(isinstance(name, str) for name in entries)
+                       for entries in names):
+                raise ValueError("domain lists must hold names")
+            sources = [(str(path), int(size), int(mtime)) for path, size, mtime in record['sources']]
+        except (KeyError, TypeError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable compiled blocklist: {e}")
+            return None
+        return cls(*names, sources)
+
+    def match(self, host: str) -> Optional[str]:
+        """The listed name blocking host, None if host is not blocked"""
+        host = _normalize_host(host)
+        blocked = host if host in self.exact else None
+        name = host
+        while True:
+            if name in self.allowed:
+                return None
+            if blocked is None and name in self.suffixes:
+                blocked = name
+            dot = name.find('.')
+            if dot < 0:
+                return blocked
+            name = name[dot + 1:]
+
+    def blocks(self, host: str) -> bool:
+        """Whether host is blocked, counting the hit if it is"""
+        if self.match(host) is None:
+            return False
+        with self._lock:
+            self.hits += 1
+        return True
@@ -0,0 +1,634 @@
+import json
+import logging
+import mmap
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from email.utils import parsedate_to_datetime
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+from http_message import BodyFraming, HTTPRequestHead, HTTPResponseHead
+
+logger = logging.getLogger(__name__)
+
+# Status codes that may be cached without explicit freshness (RFC 7231, section 6.1)
+HEURISTIC_STATUSES = frozenset({200, 203, 204, 300, 301, 404, 405, 410, 414, 501})
+
+# Status codes this cache stores at all
+CACHEABLE_STATUSES = HEURISTIC_STATUSES | frozenset({302, 307, 308})
+
+# Methods that do not change the resource and so never invalidate it (RFC 7231, section 4.2.1)
+SAFE_METHODS = frozenset({'GET', 'HEAD', 'OPTIONS', 'TRACE'})
+
+# Headers describing the stored message rather than the cached representation
+UNSTORED_HEADERS = frozenset({'age', 'content-length', 'transfer-encoding'})
+
+INDEX_FILE = 'index.json'
+
+# Names of the files the cache writes; nothing else in its directory is ever deleted
+CACHE_FILE = re.compile(r'\d+-\d+-\d+\.(?:body|tmp)|' + re.escape(INDEX_FILE) + r'\.tmp')
+
+
+def parse_cache_control(value: Optional[str]) -> Dict[str, Optional[str]]:
+    """Parse Cache-Control into a dict of lower-cased directives and their arguments"""
+    directives = {}
+    for part in (value or '').split(','):
+        name, _, argument = part.strip().partition('=')
+        if name:
+            directives[name.lower()] = argument.strip('"') if argument else None
+    return directives
+
+
+def parse_http_date(value: Optional[str]) -> Optional[float]:
+    """Parse an HTTP-date into a timestamp, None if absent or invalid"""
+    if not value:
+        return None
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+def _seconds(value: Optional[str]) -> Optional[int]:
+    try:
+        return max(0, int(value))
+    except (TypeError, ValueError):
+        return None
+
+
+@dataclass
+class CacheEntry:
+    """Stored response and the metadata needed to judge its freshness (RFC 7234, section 4.2)"""
+    key: str
+    status: int
+    reason: str
+    version: str
+    headers: List[Tuple[str, str]]
+    size: int
+    response_time: float  # When the response was received
+    date_value: float  # Date header, or response_time if absent
+    age_value: int  # Age header on the stored response
+    freshness_lifetime: float
+    must_revalidate: bool = False  # no-cache: never served without revalidation
+    vary: Dict[str, Optional[str]] = field(default_factory=dict)
+    path: Optional[str] = None  # Body file name inside the cache directory
+    body: Optional[bytes] = field(default=None, repr=False)  # In-memory copy of the body
+
+    def current_age(self, now: Optional[float] = None) -> float:
+        """Age of the response as defined by RFC 7234, section 4.2.3"""
+        now = time.time() if now is None else now
+        apparent_age = max(0.0, self.response_time - self.date_value)
+        return max(apparent_age, self.age_value) + (now - self.response_time)
+
+    def is_fresh(self, now: Optional[float] = None) -> bool:
+        return not self.must_revalidate and self.current_age(now) < self.freshness_lifetime
+
+    def header(self, name: str) -> Optional[str]:
+        name = name.lower()
+        for header_name, value in self.headers:
+            if header_name.lower() == name:
+                return value
+        return None
+
+    def has_validators(self) -> bool:
+        return self.header('etag') is not None or self.header('last-modified') is not None
+
+    def conditional_headers(self) -> List[Tuple[str, str]]:
+        """Headers turning a request for this entry into a conditional one"""
+        headers = []
+        if self.header('etag') is not None:
+            headers.append(('If-None-Match', self.header('etag')))
+        if self.header('last-modified') is not None:
+            headers.append(('If-Modified-Since', self.header('last-modified')))
+        return headers
+
+    def matches(self, request: HTTPRequestHead) -> bool:
+        """Whether the request selects this variant (RFC 7234, section 4.1)"""
+        return all(request.get_header(name) == value for name, value in self.vary.items())
+
+    def to_response(self, now: Optional[float] = None) -> HTTPResponseHead:
+        """Build the response head served for this entry"""
+        headers = list(self.headers)
+        headers.append(('Content-Length', str(self.size)))
+        headers.append(('Age', str(int(self.current_age(now)))))
+        return HTTPResponseHead(version=self.version, status=self.status, reason=self.reason,
+                                headers=headers)
+
+
+def freshness_lifetime(response: HTTPResponseHead, response_time: float) -> Optional[float]:
+    """Freshness lifetime for a shared cache, None if there is no basis for one"""
+    directives = parse_cache_control(response.get_header('cache-control'))
+    for directive in ('s-maxage', 'max-age'):
+        if directive in directives:
+            lifetime = _seconds(directives[directive])
+            if lifetime is not None:
+                return lifetime
+
+    date = parse_http_date(response.get_header('date')) or response_time
+    if response.get_header('expires') is not None:
+        expires = parse_http_date(response.get_header('expires'))
+        return max(0.0, expires - date) if expires is not None else 0.0
+
+    # Heuristic freshness: 10% of the time since the last modification (section 4.2.2)
+    last_modified = parse_http_date(response.get_header('last-modified'))
+    if last_modified is not None and response.status in HEURISTIC_STATUSES:
+        return min(max(0.0, date - last_modified) / 10, 86400.0)
+    return None
+
+
+def vary_headers(response: HTTPResponseHead) -> List[str]:
+    """Lower-cased names of the request headers listed in Vary"""
+    return [name.strip().lower() for name in (response.get_header('vary') or '').split(',') if name.strip()]
+
+
+def is_shareable(request: HTTPRequestHead, response: HTTPResponseHead) -> bool:
+    """Whether a shared cache may reuse the response for other clients (RFC 7234, section 3)"""
+    if not ResponseCache.is_storable_request(request) or response.status not in CACHEABLE_STATUSES:
+        return False
+    directives = parse_cache_control(response.get_header('cache-control'))
+    if 'no-store' in directives or 'private' in directives:
+        return False
+    # Cookies set for one client must never be replayed to another
+    if response.get_header('set-cookie') is not None:
+        return False
+    if request.get_header('authorization') is not None and not (
+            {'public', 's-maxage', 'must-revalidate'} & directives.keys()):
+        return False
+    return '*' not in vary_headers(response)
+
+
+class CacheWriter:
+    """Collects one response body and stores it once it is complete"""
+
+    def __init__(self, cache: 'ResponseCache', entry: CacheEntry):
+        self.cache = cache
+        self.entry = entry
+        self.buffer = bytearray()
+        self.file = None
+        self.temp_path = None
+        self.failed = False
+
+    def write(self, data: Union[bytes, memoryview]):
+        """Append body bytes, spilling to disk once the body is too big to keep in memory"""
+        if self.failed:
+            return
+        self.entry.size += len(data)
+        if self.entry.size > self.cache.max_object_size:
+            self.abort()
+            return
+        try:
+            if self.file is None and self.cache.directory and self.entry.size > self.cache.mmap_threshold:
+                self.temp_path = self.cache.new_body_path('.tmp')
+                self.file = open(os.path.join(self.cache.directory, self.temp_path), 'wb')
+                self.file.write(self.buffer)
+                self.buffer = bytearray()
+            if self.file is not None:
+                self.file.write(data)
+            else:
+                self.buffer += data
+        except OSError as e:
+            logger.warning(f"Cache write failed: {e}")
+            self.abort()
+
+    def commit(self):
+        """Store the collected response"""
+        if self.failed:
+            return
+        try:
+            if self.file is not None:
+                self.file.close()
+                self.entry.path = self.cache.new_body_path('.body')
+                os.replace(os.path.join(self.cache.directory, self.temp_path),
+                           os.path.join(self.cache.directory, self.entry.path))
+            elif self.cache.directory:
+                self.entry.path = self.cache.new_body_path('.body')
+                with open(os.path.join(self.cache.directory, self.entry.path), 'wb') as body_file:
+                    body_file.write(self.buffer)
+        except OSError as e:
+            logger.warning(f"Cache write failed: {e}")
+            self.abort()
+            return
+
+        if self.file is None:
+            self.entry.body = bytes(self.buffer)
+        self.cache.store(self.entry)
+
+    def abort(self):
+        """Drop the partial response"""
+        self.failed = True
+        self.buffer = bytearray()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        if self.temp_path:
+            self.cache.remove_file(self.temp_path)
+            self.temp_path = None
+
+
+class ResponseCache:
+    """Shared HTTP cache (RFC 7234) with an LRU over in-memory and on-disk bodies
+
+    Bodies up to mmap_threshold are kept in memory while memory_size allows.
+    With a directory, every body is also written to disk and the index is
+    saved there, so the cache survives restarts; large bodies are served
+    straight from a memory map of their file.
+    """
+
+    def __init__(self, memory_size: int = 64 * 1024 * 1024, directory: Optional[str] = None,
+                 disk_size: int = 1024 * 1024 * 1024, max_object_size: int = 64 * 1024 * 1024,
+                 mmap_threshold: int = 1024 * 1024):
+        self.memory_size = memory_size
+        self.directory = directory
+        self.disk_size = disk_size
+        self.max_object_size = max_object_size if directory else min(max_object_size, memory_size)
+        self.mmap_threshold = mmap_threshold
+        self.entries: 'OrderedDict[str, CacheEntry]' = OrderedDict()
+        self.lock = threading.Lock()
+        self.memory_used = 0
+        self.disk_used = 0
+        self._sequence = 0
+        self._dirty = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.stores = 0
+        self.evictions = 0
+
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self._load_index()
+
+    @staticmethod
+    def is_storable_request(request: HTTPRequestHead) -> bool:
+        """Whether a response to this request may be looked up in or stored by the cache"""
+        if request.method != 'GET' or request.get_header('range') is not None:
+            return False
+        directives = parse_cache_control(request.get_header('cache-control'))
+        return 'no-store' not in directives
+
+    def lookup(self, key: str, request: HTTPRequestHead) -> Tuple[Optional[CacheEntry], bool]:
+        """Return the stored variant for a request and whether it can be served without revalidation"""
+        directives = parse_cache_control(request.get_header('cache-control'))
+        no_cache = 'no-cache' in directives or (
+            not directives and 'no-cache' in (request.get_header('pragma') or '').lower())
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or not entry.matches(request):
+                self.misses += 1
+                return None, False
+            self.entries.move_to_end(key)
+
+            fresh = entry.is_fresh() and not no_cache
+            max_age = _seconds(directives.get('max-age')) if 'max-age' in directives else None
+            if fresh and max_age is not None and entry.current_age() > max_age:
+                fresh = False
+            if fresh:
+                self.hits += 1
+            elif not entry.has_validators():
+                self.misses += 1
+                return None, False
+            return entry, fresh
+
+    def begin(self, key: str, request: HTTPRequestHead,
+              response: HTTPResponseHead) -> Optional[CacheWriter]:
+        """Start storing a response if RFC 7234, section 3 allows it"""
+        if not is_shareable(request, response):
+            return None
+        directives = parse_cache_control(response.get_header('cache-control'))
+        response_time = time.time()
+        lifetime = freshness_lifetime(response, response_time)
+        if lifetime is None and 'no-cache' not in directives and not (
+                response.get_header('etag') or response.get_header('last-modified')):
+            return None
+
+        entry = CacheEntry(
+            key=key,
+            status=response.status,
+            reason=response.reason,
+            version=response.version,
+            headers=[(name, value) for name, value in response.end_to_end_headers()
+                     if name.lower() not in UNSTORED_HEADERS],
+            size=0,
+            response_time=response_time,
+            date_value=parse_http_date(response.get_header('date')) or response_time,
+            age_value=_seconds(response.get_header('age')) or 0,
+            freshness_lifetime=lifetime or 0.0,
+            must_revalidate='no-cache' in directives,
+            vary={name: request.get_header(name) for name in vary_headers(response)},
+        )
+        return CacheWriter(self, entry)
+
+    def refresh(self, entry: CacheEntry, response: HTTPResponseHead):
+        """Update a stored entry from a 304 Not Modified response (RFC 7234, section 4.3.4)"""
+        with self.lock:
+            updated = {name.lower(): (name, value) for name, value in response.end_to_end_headers()
+                       if name.lower() not in UNSTORED_HEADERS}
+            headers = [updated.pop(name.lower(), (name, value)) for name, value in entry.headers]
+            entry.headers = headers + list(updated.values())
+
+            now = time.time()
+            merged = HTTPResponseHead(entry.version, entry.status, entry.reason, entry.headers)
+            entry.response_time = now
+            entry.date_value = parse_http_date(merged.get_header('date')) or now
+            entry.age_value = _seconds(response.get_header('age')) or 0
+            entry.freshness_lifetime = freshness_lifetime(merged, now) or 0.0
+            entry.must_revalidate = 'no-cache' in parse_cache_control(merged.get_header('cache-control'))
+            self.revalidations += 1
+            self._mark_dirty()
+
+    def store(self, entry: CacheEntry):
+        """Insert a complete entry, replacing any previous variant and evicting LRU entries"""
+        with self.lock:
+            previous = self.entries.pop(entry.key, None)
+            if previous is not None:
+                self._forget(previous)
+            self.entries[entry.key] = entry
+            if entry.path:
+                self.disk_used += entry.size
+            if entry.body is not None:
+                if entry.path and (entry.size > self.mmap_threshold or entry.size > self.memory_size):
+                    entry.body = None
+                else:
+                    self.memory_used += entry.size
+            self.stores += 1
+            self._enforce_limits()
+            self._mark_dirty()
+
+    def invalidate(self, key: str):
+        """Drop the entry for a URI changed by an unsafe request (RFC 7234, section 4.4)"""
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                self._forget(entry)
+                self._mark_dirty()
+
+    @contextmanager
+    def open_body(self, entry: CacheEntry) -> Iterator[Union[bytes, mmap.mmap]]:
+        """Yield the stored body, memory-mapping large files instead of reading them"""
+        body = entry.body
+        if body is not None or entry.size == 0:
+            yield body or b''
+            return
+        with open(os.path.join(self.directory, entry.path), 'rb') as body_file:
+            if entry.size < self.mmap_threshold:
+                yield body_file.read()
+                return
+            mapped = mmap.mmap(body_file.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                yield mapped
+            finally:
+                try:
+                    mapped.close()
+                except BufferError:
+                    pass  # A view is still alive; the map goes away with it
+
+    def new_body_path(self, suffix: str) -> str:
+        """Return a fresh body file name, so readers of a replaced body keep their file"""
+        with self.lock:
+            self._sequence += 1
+            sequence = self._sequence
+        return f"{os.getpid()}-{int(time.time() * 1000)}-{sequence}{suffix}"
+
+    def remove_file(self, name: str):
+        try:
+            os.remove(os.path.join(self.directory, name))
+        except OSError:
+            pass
+
+    def _forget(self, entry: CacheEntry):
+        """Release the storage of an entry already removed from the index (caller holds the lock)"""
+        if entry.body is not None:
+            self.memory_used -= entry.size
+            entry.body = None
+        if entry.path:
+            self.disk_used -= entry.size
+            self.remove_file(entry.path)
+
+    def _enforce_limits(self):
+        """Evict least recently used bodies until both budgets fit (caller holds the lock)"""
+        for key in list(self.entries):
+            over_memory = self.memory_used > self.memory_size
+            over_disk = self.disk_used > self.disk_size
+            if not over_memory and not over_disk:
+                return
+            entry = self.entries[key]
+            if not over_disk and entry.path:
+                # Only memory is short and the body is also on disk: drop the memory copy
+                if entry.body is not None:
+                    self.memory_used -= entry.size
+                    entry.body = None
+                continue
+            if not over_memory and not entry.path:
+                continue  # Memory-only entries do not use the disk budget
+            del self.entries[key]
+            self._forget(entry)
+            self.evictions += 1
+
+    def _mark_dirty(self):
+        """Save the index every few changes (caller holds the lock)"""
+        self._dirty += 1
+        if self.directory and self._dirty >= 32:
+            self._save_index()
+
+    def _save_index(self):
+        """Write the index atomically (caller holds the lock)"""
+        records = []
+        for entry in self.entries.values():
+            if entry.path:
+                record = asdict(entry)
+                del record['body']
+                records.append(record)
+        index_path = os.path.join(self.directory, INDEX_FILE)
+        try:
+            with open(index_path + '.tmp', 'w') as index_file:
+                json.dump(records, index_file, separators=(',', ':'))
+            os.replace(index_path + '.tmp', index_path)
+            self._dirty = 0
+        except OSError as e:
+            logger.warning(f"Cannot save cache index: {e}")
+
+    def _load_index(self):
+        """Restore entries whose body files survived, and delete orphaned cache files"""
+        index_path = os.path.join(self.directory, INDEX_FILE)
+        try:
+            with open(index_path) as index_file:
+                records = json.load(index_file)
+        except FileNotFoundError:
+            records = []
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable cache index: {e}")
+            records = []
+
+        for record in records:
+            try:
+                record['headers'] = [tuple(header) for header in record['headers']]
+                entry = CacheEntry(**record)
+            except (TypeError, KeyError):
+                continue
+            path = os.path.join(self.directory, entry.path or '')
+            if entry.path and os.path.isfile(path) and os.path.getsize(path) == entry.size:
+                self.entries[entry.key] = entry
+                self.disk_used += entry.size
+
+        known = {entry.path for entry in self.entries.values()} | {INDEX_FILE}
+        for name in os.listdir(self.directory):
+            if name not in known and CACHE_FILE.fullmatch(name):
+                self.remove_file(name)
+        self._enforce_limits()
+
+    def close(self):
+        """Persist the index"""
+        with self.lock:
+            if self.directory:
+                self._save_index()
+
+    def stats(self) -> Dict[str, int]:
+        """Return cache counters"""
+        with self.lock:
+            return {
+                'cache_hits': self.hits,
+                'cache_misses': self.misses,
+                'cache_revalidations': self.revalidations,
+                'cache_stores': self.stores,
+                'cache_evictions': self.evictions,
+                'cache_entries': len(self.entries),
+                'cache_memory_bytes': self.memory_used,
+                'cache_disk_bytes': self.disk_used,
+            }
+
+
+class SharedFetch:
+    """One upstream response streamed to every client that asked for it at the same time
+
+    The leader publishes the response head and appends the body bytes;
+    followers read the append-only buffer from the start at their own pace.
+    Only bodies of a known length that fits the buffer are shared, so a
+    follower that was sent the head is never cut off part way through.
+    """
+
+    def __init__(self, key: str, request: HTTPRequestHead, max_size: int):
+        self.key = key
+        self.request = request
+        self.max_size = max_size
+        self.response: Optional[HTTPResponseHead] = None
+        self.buffer = bytearray()
+        self.complete = False
+        self.failed = False
+        self.followers = 0  # Clients reading the fetch right now
+        self.condition = threading.Condition()
+
+    def publish(self, response: HTTPResponseHead) -> bool:
+        """Offer the response head to followers; False if it must not be shared"""
+        framing = response.body_framing(self.request.method)
+        shareable = (is_shareable(self.request, response) and
+                     framing in (BodyFraming.NONE, BodyFraming.LENGTH) and
+                     (response.content_length() or 0) <= self.max_size)
+        with self.condition:
+            if shareable:
+                self.response = response
+            else:
+                self.failed = True
+            self.condition.notify_all()
+        return shareable
+
+    def append(self, data: bytes):
+        """Add body bytes received by the leader"""
+        with self.condition:
+            if self.failed:
+                return
+            if len(self.buffer) + len(data) > self.max_size:
+                # Followers cannot be served a body we stopped buffering
+                self.failed = True
+                self.buffer = bytearray()
+            else:
+                self.buffer += data
+            self.condition.notify_all()
+
+    def finish(self, success: bool):
+        """Mark the body complete, or the fetch failed"""
+        with self.condition:
+            if not self.complete:
+                self.complete = True
+                self.failed = self.failed or not success or self.response is None
+            self.condition.notify_all()
+
+    def leave(self):
+        """A follower stopped reading, whether or not it got the whole body"""
+        with self.condition:
+            self.followers -= 1
+
+    def wait_response(self, request: HTTPRequestHead, timeout: float) -> Optional[HTTPResponseHead]:
+        """Wait for a response head this follower may use, None to fetch on its own"""
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            while self.response is None and not self.failed and not self.complete:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self.condition.wait(remaining)
+            if self.response is None or self.failed:
+                return None
+            if any(request.get_header(name) != self.request.get_header(name)
+                   for name in vary_headers(self.response)):
+                return None
+            return self.response
+
+    def read(self, offset: int, size: int, timeout: float) -> Tuple[Optional[bytes], bool]:
+        """Return body bytes after offset and whether the body ends there; None if the fetch failed"""
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            while len(self.buffer) <= offset and not self.complete and not self.failed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None, False
+                self.condition.wait(remaining)
+            if self.failed:
+                return None, False
+            data = bytes(self.buffer[offset:offset + size])
+            return data, self.complete and offset + len(data) >= len(self.buffer)
+
+
+class FetchCoalescer:
+    """Registry of upstream fetches in progress, keyed like the response cache"""
+
+    def __init__(self, max_size: int = 64 * 1024 * 1024):
+        self.max_size = max_size
+        self.fetches: Dict[str, SharedFetch] = {}
+        self.lock = threading.Lock()
+        self.leaders = 0
+        self.followers = 0
+
+    def join(self, key: str, request: HTTPRequestHead) -> Tuple[SharedFetch, bool]:
+        """Return the fetch for key and whether the caller leads it"""
+        with self.lock:
+            fetch = self.fetches.get(key)
+            if fetch is not None and not fetch.complete:
+                with fetch.condition:
+                    fetch.followers += 1
+                self.followers += 1
+                return fetch, False
+            fetch = SharedFetch(key, request, self.max_size)
+            self.fetches[key] = fetch
+            self.leaders += 1
+            return fetch, True
+
+    def release(self, fetch: SharedFetch, success: bool = False):
+        """End a fetch led by the caller; later requests start a new one"""
+        fetch.finish(success)
+        with self.lock:
+            if self.fetches.get(fetch.key) is fetch:
+                del self.fetches[fetch.key]
+
+    def stats(self) -> Dict[str, int]:
+        """Return coalescing counters"""
+        with self.lock:
+            return {
+                'collapsed_leaders': self.leaders,
+                'collapsed_followers': self.followers,
+                'collapsed_in_progress': len(self.fetches),
+            }
@@ -0,0 +1,176 @@
+import ipaddress
+import logging
+import threading
+from dataclasses import dataclass
+from enum import Enum
+from typing import Dict, List, Optional, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+# Key of the rule index stored in a domain trie node; never a valid label
+RULE_KEY = ''
+
+
+class RuleAction(Enum):
+    """Where the proxy sends a destination"""
+    TUNNEL = 'tunnel'  # Through the SSH SOCKS tunnel
+    DIRECT = 'direct'  # Straight from the proxy host
+    REJECT = 'reject'  # Refused with 403
+
+
+@dataclass
+class Rule:
+    """One routing rule and the number of destinations it decided"""
+    action: RuleAction
+    pattern: str
+    hits: int = 0
+
+
+def _normalize_host(host: str) -> str:
+    return host.strip().rstrip('.').lower()
+
+
+def _parse_address(host: str) -> Optional[Union[ipaddress.IPv4Address, ipaddress.IPv6Address]]:
+    """The host as an IP address, None for domain names"""
+    if not host or not (host[-1].isdigit() or ':' in host):
+        return None
+    try:
+        return ipaddress.ip_address(host)
+    except ValueError:
+        return None
+
+
+class RuleSet:
+    """Compiled routing rules where the first matching rule wins
+
+    Domain patterns match the domain and all its subdomains and are stored in
+    a trie keyed by labels from the top level down, so a lookup costs one dict
+    access per label of the host. Networks are grouped by prefix length, so an
+    address costs one dict access per distinct prefix length. Destinations no
+    rule matches get the default action.
+    """
+
+    def __init__(self, rules: List[Rule], default: RuleAction = RuleAction.TUNNEL):
+        self.rules = rules
+        self.default = default
+        self.default_hits = 0
+        self._domains: Dict[str, dict] = {}
+        # IP version -> [(prefix length, {network >> host bits: rule index})]
+        self._networks: Dict[int, List[Tuple[int, Dict[int, int]]]] = {4: [], 6: []}
+        self._catch_all: Optional[int] = None
+        for index, rule in enumerate(rules):
+            self._compile(index, rule)
+
+    def _compile(self, index: int, rule: Rule):
+        pattern = rule.pattern
+        if pattern == '*':
+            if self._catch_all is None:
+                self._catch_all = index
+            return
+
+        try:
+            network = ipaddress.ip_network(pattern, strict=False)
+        except ValueError:
+            network = None
+        if network is not None:
+            host_bits = network.max_prefixlen - network.prefixlen
+            groups = self._networks[network.version]
+            for prefixlen, networks in groups:
+                if prefixlen == network.prefixlen:
+                    break
+            else:
+                networks = {}
+                groups.append((network.prefixlen, networks))
+            networks.setdefault(int(network.network_address) >> host_bits, index)
+            return
+
+        labels = _normalize_host(pattern.lstrip('*').lstrip('.')).split('.')
+        if not all(labels):
+            raise ValueError(f"Invalid domain pattern: {pattern!r}")
+        node = self._domains
+        for label in reversed(labels):
+            node = node.setdefault(label, {})
+        node.setdefault(RULE_KEY, index)
+
+    @classmethod
+    def parse(cls, text: str, default: RuleAction = RuleAction.TUNNEL) -> 'RuleSet':
+        """Compile rules written one per line as '<action> <pattern>'; '#' starts a comment"""
+        rules = []
+        for number, line in enumerate(text.splitlines(), 1):
+            line = line.partition('#')[0].strip()
+            if not line:
+                continue
+            parts = line.split()
+            if len(parts) != 2:
+                raise ValueError(f"Line {number}: expected '<action> <pattern>'")
+            try:
+                action = RuleAction(parts[0].lower())
+            except ValueError:
+                raise ValueError(f"Line {number}: unknown action {parts[0]!r}") from None
+            rules.append(Rule(action, parts[1]))
+        return cls(rules, default)
+
+    @classmethod
+    def from_file(cls, path: str, default: RuleAction = RuleAction.TUNNEL) -> 'RuleSet':
+        with open(path, encoding='utf-8') as f:
+            return cls.parse(f.read(), default)
+
+    def match(self, host: str) -> Optional[Rule]:
+        """The first rule matching host, None if no rule does"""
+        best = self._catch_all
+        address = _parse_address(host.strip('[]'))
+        if address is not None:
+            value = int(address)
+            for prefixlen, networks in self._networks[address.version]:
+                index = networks.get(value >> (address.max_prefixlen - prefixlen))
+                if index is not None and (best is None or index < best):
+                    best = index
+        else:
+            node = self._domains
+            for label in reversed(_normalize_host(host).split('.')):
+                node = node.get(label)
+                if node is None:
+                    break
+                index = node.get(RULE_KEY)
+                if index is not None and (best is None or index < best):
+                    best = index
+        return self.rules[best] if best is not None else None
+
+
+class RuleEngine:
+    """Routing decisions from a rule set that can be replaced while in use"""
+
+    def __init__(self, rules: Optional[RuleSet] = None):
+        self.rules = rules or RuleSet([])
+        self._lock = threading.Lock()
+
+    def swap(self, rules: RuleSet) -> RuleSet:
+        """Install a new rule set and return the previous one"""
+        previous, self.rules = self.rules, rules
+        logger.info(f"Installed {len(rules.rules)} routing rules")
+        return previous
+
+    def load(self, path: str) -> RuleSet:
+        """Compile the rules in path and install them; the current set stays on error"""
+        return self.swap(RuleSet.from_file(path))
+
+    def decide(self, host: str) -> RuleAction:
+        """Action for a destination host, counting the hit on the deciding rule"""
+        # One read of the reference, so a concurrent swap never mixes two sets
+        rules = self.rules
+        rule = rules.match(host)
+        with self._lock:
+            if rule is None:
+                rules.default_hits += 1
+                return rules.default
+            rule.hits += 1
+        return rule.action
+
+    def report(self) -> List[dict]:
+        """Every rule of the current set with its hit count"""
+        rules = self.rules
+        with self._lock:
+            report = [{'action': rule.action.value, 'pattern': rule.pattern, 'hits': rule.hits}
+                      for rule in rules.rules]
+            report.append({'action': rules.default.value, 'pattern': None, 'hits': rules.default_hits})
+        return report
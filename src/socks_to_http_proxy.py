@@ -1,14 +1,41 @@
+import os
 import socket
 import threading
 import logging
 import select
 import time
-from typing import Optional
-from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+from dataclasses import asdict, dataclass, field, replace
 from enum import Enum
+from collections import OrderedDict, deque
 import asyncio
 import signal
 import sys
+import argparse
+import heapq
+import ipaddress
+import multiprocessing
+import queue
+import random
+import struct
+
+from http_message import BodyFraming, HTTPRequestHead, HTTPResponseHead
+from proxy_cache import SAFE_METHODS, CacheEntry, FetchCoalescer, ResponseCache, SharedFetch
+from proxy_metrics import Counter, Gauge, Histogram, Metric, MetricsRegistry, MetricsServer, collected
+from proxy_blocklist import Blocklist
+from proxy_rules import RuleAction, RuleEngine, RuleSet
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+try:
+    import fcntl
+    import termios
+except ImportError:  # Not available on Windows
+    fcntl = termios = None
 
 # Configure logging
 logging.basicConfig(
@@ -17,6 +44,38 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Methods that may be pipelined and safely resent if the upstream closes early
+PIPELINE_METHODS = frozenset({'GET', 'HEAD', 'OPTIONS'})
+
+# Methods whose requests may wait for a reconnecting tunnel, since repeating them is harmless
+IDEMPOTENT_METHODS = frozenset({'GET', 'HEAD', 'OPTIONS', 'TRACE', 'PUT', 'DELETE'})
+
+# Zero-copy relaying through a kernel pipe is only available on Linux
+SPLICE_SUPPORTED = sys.platform.startswith('linux') and hasattr(os, 'splice')
+
+# Several processes can only share one listening port where the kernel balances SO_REUSEPORT
+REUSEPORT_SUPPORTED = hasattr(socket, 'SO_REUSEPORT')
+
+# The kernel send queue of a socket can be measured with SIOCOUTQ, which shares TIOCOUTQ's number, on Linux
+SEND_QUEUE_SUPPORTED = sys.platform.startswith('linux') and termios is not None and hasattr(termios, 'TIOCOUTQ')
+
+# How often a relay paused at its high watermark checks whether the destination drained
+DRAIN_POLL_INTERVAL = 0.01
+
+# Netfilter reports the destination of a REDIRECTed connection through this option on Linux
+TRANSPARENT_SUPPORTED = sys.platform.startswith('linux')
+SO_ORIGINAL_DST = 80  # Same value for SOL_IP and, as IP6T_SO_ORIGINAL_DST, for SOL_IPV6
+
+# Values of SOCKStoHTTPProxy.stats() that are point-in-time readings rather than running totals
+GAUGE_STATS = frozenset({'connections_active', 'connections_waiting', 'buffers_in_use', 'buffers_idle',
+                         'relay_bytes_in_flight', 'relay_bytes_peak', 'tunnel_waiting',
+                         'cache_entries', 'cache_memory_bytes', 'cache_disk_bytes', 'negative_cache_entries',
+                         'blocklist_entries', 'collapsed_in_progress', 'workers_alive'})
+
+# Prefix of the stats() keys 'rule_hits:<action>:<pattern>' counting the destinations each rule decided;
+# keys rather than a nested report, so worker totals add up like every other counter
+RULE_HITS_STAT = 'rule_hits:'
+
 
 class ProxyError(Exception):
     """Base exception for proxy-related errors"""
@@ -28,6 +87,11 @@ class ConnectionError(ProxyError):
     pass
 
 
+class TunnelUnavailableError(ConnectionError):
+    """The tunnel itself is down, e.g. the SOCKS listener while SSH reconnects"""
+    pass
+
+
 class ProtocolError(ProxyError):
     """Exception for protocol-related errors"""
     pass
@@ -45,13 +109,102 @@ class SOCKSCommand(Enum):
 
 class AddressType(Enum):
     """SOCKS address types"""
+    IPV4 = 1
     DOMAIN = 3
+    IPV6 = 4
+
+
+def socks_address(host: str) -> bytes:
+    """Encode a target as ATYP and DST.ADDR, sending literal IPs as binary addresses"""
+    try:
+        address = ipaddress.ip_address(host.strip('[]'))
+    except ValueError:
+        try:
+            encoded = host.encode('idna')
+        except UnicodeError:
+            raise ProtocolError(f"Invalid SOCKS5 domain name: {host!r}")
+        if not 0 < len(encoded) <= 255:
+            raise ProtocolError(f"Invalid SOCKS5 domain name length: {len(encoded)}")
+        return bytes([AddressType.DOMAIN.value, len(encoded)]) + encoded
+    if address.version == 4:
+        return bytes([AddressType.IPV4.value]) + address.packed
+    return bytes([AddressType.IPV6.value]) + address.packed
+
+
+def original_destination(sock: socket.socket) -> Optional['HostInfo']:
+    """Destination a netfilter-redirected connection was addressed to, None if unknown"""
+    try:
+        if sock.family == socket.AF_INET6:
+            # struct sockaddr_in6: family, port, flow info, address, scope id
+            raw = sock.getsockopt(socket.IPPROTO_IPV6, SO_ORIGINAL_DST, 28)
+            port, packed = struct.unpack_from('!2xH4x16s', raw)
+        else:
+            # struct sockaddr_in: family, port, address, padding
+            raw = sock.getsockopt(socket.SOL_IP, SO_ORIGINAL_DST, 16)
+            port, packed = struct.unpack_from('!2xH4s', raw)
+    except (OSError, struct.error) as e:
+        logger.debug(f"No original destination: {e}")
+        return None
+    return HostInfo(str(ipaddress.ip_address(packed)), port)
+
+
+def send_queue_size(sock: socket.socket) -> int:
+    """Bytes held in the kernel send queue of sock, 0 where it cannot be measured"""
+    if not SEND_QUEUE_SUPPORTED:
+        return 0
+    try:
+        raw = fcntl.ioctl(sock.fileno(), termios.TIOCOUTQ, b'\0\0\0\0')
+    except OSError:
+        return 0
+    return struct.unpack('i', raw)[0]
+
+
+class ConnectionState(Enum):
+    """Lifecycle of a client connection"""
+    READING = 'reading'  # Waiting for a request head
+    FORWARDING = 'forwarding'  # Relaying an HTTP exchange
+    TUNNEL = 'tunnel'  # Relaying raw bytes after CONNECT or Upgrade
+    CLOSED = 'closed'
 
 
 class SOCKSResponse(Enum):
     """SOCKS response codes"""
     SUCCESS = 0
     FAILURE = 1
+    NOT_ALLOWED = 2
+    NETWORK_UNREACHABLE = 3
+    HOST_UNREACHABLE = 4
+    CONNECTION_REFUSED = 5
+    TTL_EXPIRED = 6
+    COMMAND_NOT_SUPPORTED = 7
+    ADDRESS_TYPE_NOT_SUPPORTED = 8
+
+    @classmethod
+    def from_code(cls, code: int) -> 'SOCKSResponse':
+        try:
+            return cls(code)
+        except ValueError:
+            return cls.FAILURE
+
+
+# Replies saying the destination itself is down, worth remembering for a few seconds
+UNREACHABLE_REPLIES = frozenset({SOCKSResponse.NETWORK_UNREACHABLE, SOCKSResponse.HOST_UNREACHABLE,
+                                 SOCKSResponse.CONNECTION_REFUSED, SOCKSResponse.TTL_EXPIRED})
+
+
+class SOCKSReplyError(ProxyError):
+    """The SOCKS server refused a CONNECT with a failure reply"""
+
+    def __init__(self, reply: SOCKSResponse, cached: bool = False):
+        super().__init__(f"{reply.name.lower().replace('_', ' ')}{' (cached)' if cached else ''}")
+        self.reply = reply
+        self.cached = cached
+
+    def http_status(self) -> Tuple[int, str]:
+        """Status the proxy answers the client with"""
+        if self.reply == SOCKSResponse.TTL_EXPIRED:
+            return 504, 'Gateway Timeout'
+        return 502, 'Bad Gateway'
 
 
 @dataclass
@@ -66,23 +219,146 @@ class HostInfo:
         try:
             # Remove 'Host:' prefix and strip whitespace
             _, host_value = host_line.split(':', 1)
-            host_value = host_value.strip()
-
-            # Check if port is specified
-            if ':' in host_value:
-                host, port_str = host_value.rsplit(':', 1)
-                try:
-                    port = int(port_str)
-                except ValueError:
-                    logger.warning(f"Invalid port number: {port_str}, using default 80")
-                    port = 80
-                return cls(host=host, port=port)
-            else:
-                return cls(host=host_value)
+            return cls.parse_authority(host_value.strip())
         except Exception as e:
             logger.error(f"Error parsing host and port: {e}")
             return cls(host='localhost')
 
+    @classmethod
+    def parse_authority(cls, authority: str, default_port: int = 80) -> 'HostInfo':
+        """Parse a host[:port] authority, including bracketed IPv6 literals"""
+        if authority.startswith('['):
+            host, bracket, rest = authority[1:].partition(']')
+            if not bracket:
+                raise ValueError(f"Unterminated IPv6 literal: {authority}")
+            port_str = rest[1:] if rest.startswith(':') else ''
+        elif authority.count(':') > 1:
+            # Bare IPv6 literal, which cannot carry a port
+            host, port_str = authority, ''
+        elif ':' in authority:
+            host, port_str = authority.rsplit(':', 1)
+        else:
+            host, port_str = authority, ''
+
+        if not port_str:
+            return cls(host=host, port=default_port)
+        try:
+            port = int(port_str)
+        except ValueError:
+            logger.warning(f"Invalid port number: {port_str}, using default {default_port}")
+            port = default_port
+        return cls(host=host, port=port)
+
+    @classmethod
+    def from_request(cls, head: HTTPRequestHead) -> Optional['HostInfo']:
+        """Take the target from the request line, falling back to the Host header"""
+        if head.method == 'CONNECT':
+            return cls.parse_authority(head.target, 443)
+
+        if not head.target.startswith('/'):
+            parts = urlsplit(head.target)
+            if parts.netloc:
+                authority = parts.netloc.rpartition('@')[2]
+                return cls.parse_authority(authority, 443 if parts.scheme == 'https' else 80)
+
+        host = head.get_header('host')
+        return cls.parse_authority(host) if host else None
+
+
+@dataclass
+class ProxySettings:
+    """Tunable settings shared by the proxy engines"""
+    buffer_size: int = 65536
+    backlog: int = 1024
+    connect_timeout: float = 5.0
+    header_timeout: float = 5.0  # Deadline for the whole first request head
+    max_header_size: int = 65536
+    relay_mode: str = 'auto'  # 'auto', 'splice' or 'copy'
+    response_timeout: float = 120.0
+    upstream_pool_size: int = 8  # Idle upstream connections kept per (host, port); 0 disables
+    upstream_pool_total: int = 128
+    upstream_idle_timeout: float = 30.0
+    max_requests_per_connection: int = 100
+    keepalive_timeout: float = 15.0  # Deadline for the whole next request head on a kept-alive connection
+    max_pipeline_depth: int = 8  # Requests in flight per client connection
+    socks_pool_size: int = 0  # Pre-negotiated SOCKS sockets kept ready; 0 disables
+    socks_pool_max_age: float = 30.0
+    socks_optimistic: bool = True  # Send greeting and CONNECT in a single write
+    negative_cache_ttl: float = 5.0  # Answer destinations reported unreachable locally this long; 0 disables
+    negative_cache_size: int = 1024
+    buffer_pool_size: int = 64  # Idle relay buffers kept for reuse
+    cache_memory_size: int = 0  # Response cache bodies kept in memory; 0 without cache_dir disables
+    cache_dir: Optional[str] = None  # Persist the response cache here
+    cache_disk_size: int = 1024 * 1024 * 1024
+    cache_max_object_size: int = 64 * 1024 * 1024
+    cache_mmap_threshold: int = 1024 * 1024  # Disk bodies this large are served from a memory map
+    collapsed_forwarding: bool = False  # Share one upstream fetch between identical concurrent GETs
+    collapsed_max_size: int = 64 * 1024 * 1024  # Largest body buffered for followers
+    listener_rate: int = 0  # Bytes per second relayed through the listener; 0 means unlimited
+    client_rate: int = 0  # Bytes per second relayed for each client address; 0 means unlimited
+    shaping_quantum: int = 16384  # Bytes granted per weighted fair scheduling turn
+    relay_high_watermark: int = 4 * 1024 * 1024  # Stop reading a tunnel direction once its destination queues this much; 0 disables
+    relay_low_watermark: int = 1024 * 1024  # Resume reading once the destination queue drains to this
+    relay_budget: int = 256 * 1024 * 1024  # Bytes read and not yet sent across all tunnels; 0 means unlimited
+    tunnel_hold_timeout: float = 0.0  # Hold new tunnels this long while the tunnel is down; 0 fails them at once
+    tunnel_hold_queue: int = 256  # Requests held at once before new ones fail
+    tunnel_probe_interval: float = 0.25  # How often held requests check whether the tunnel is back
+    metrics_port: int = 0  # Serve Prometheus metrics on this port; 0 disables
+    metrics_host: str = 'localhost'
+    rules_file: Optional[str] = None  # Routing rules choosing tunnel, direct or reject per destination
+    blocklist_files: Tuple[str, ...] = ()  # Hosts-file or Adblock domain lists answered locally
+    blocklist_cache: Optional[str] = None  # Compiled copy of the blocklists, reused while they are unchanged
+    tunnel_idle_timeout: float = 600.0  # Close tunnels without traffic for this long; 0 disables
+    max_connections: int = 0  # Connections served at once; 0 means unlimited
+    admission_queue_size: int = 256  # Connections waiting for a slot before new ones are shed
+    admission_queue_timeout: float = 10.0  # Longest wait for a slot before answering 503
+    shed_retry_after: int = 5  # Retry-After seconds sent with shedding 503 responses
+    transparent: bool = False  # Relay iptables-REDIRECTed connections to their original destination, no HTTP
+    reuse_port: bool = False  # Bind with SO_REUSEPORT so worker processes share the port
+    workers: int = 1  # Threaded engine processes started by ProxySupervisor
+
+    def use_splice(self) -> bool:
+        """Whether the threaded relay should move bytes with os.splice"""
+        return self.relay_mode != 'copy' and SPLICE_SUPPORTED
+
+
+@dataclass
+class ProxyInstruments:
+    """Metrics the threaded proxy updates while serving connections"""
+    connect_latency: Histogram  # Seconds to reach the destination, by route
+    handshake_latency: Histogram  # Seconds to open a tunnel, by warm or fresh SOCKS socket or SSH channel
+    errors: Counter  # Failed requests and connections, by type
+    tunnel_wait: Histogram  # Seconds requests waited for a reconnecting tunnel, by outcome
+
+    @classmethod
+    def register(cls, registry: MetricsRegistry, prefix: str = 'socks_http_proxy') -> 'ProxyInstruments':
+        return cls(
+            registry.histogram(f'{prefix}_connect_seconds', 'Time to connect to the destination', ('route',)),
+            registry.histogram(f'{prefix}_socks_handshake_seconds',
+                               'Time from opening the SOCKS socket to the CONNECT reply', ('socket',)),
+            registry.counter(f'{prefix}_errors_total', 'Failed requests and connections', ('type',)),
+            registry.histogram(f'{prefix}_tunnel_wait_seconds',
+                               'Time requests were held while the tunnel was down', ('outcome',)),
+        )
+
+
+def stats_metrics(stats: Dict[str, int], prefix: str = 'socks_http_proxy') -> List[Metric]:
+    """Metrics for a stats() snapshot: gauges for readings, counters for running totals"""
+    metrics: List[Metric] = []
+    rule_hits = Counter(f'{prefix}_rule_hits_total', 'Destinations decided by each routing rule',
+                        ('action', 'pattern'))
+    for key, value in stats.items():
+        if key.startswith(RULE_HITS_STAT):
+            action, _, pattern = key[len(RULE_HITS_STAT):].partition(':')
+            rule_hits._values[(action, pattern)] = value
+        elif key in GAUGE_STATS:
+            metrics.append(collected(Gauge, f'{prefix}_{key}', f'Proxy {key.replace("_", " ")}', value))
+        else:
+            metrics.append(collected(Counter, f'{prefix}_{key}_total', f'Proxy {key.replace("_", " ")}', value))
+    if rule_hits._values:
+        metrics.append(rule_hits)
+    return metrics
+
 
 class SocketManager:
     """Socket operations manager with timeout and error handling"""
@@ -112,6 +388,24 @@ class SocketManager:
             logger.debug(f"Socket send failed: {e}")
             return False
 
+    @staticmethod
+    def send_all(sock: socket.socket, data: bytes, timeout: float = 5.0) -> bool:
+        """Send all data, waiting at most timeout seconds for each partial send"""
+        view = memoryview(data)
+        try:
+            while view:
+                ready = select.select([], [sock], [], timeout)
+                if not ready[1]:
+                    return False
+                sent = sock.send(view)
+                if sent == 0:
+                    return False
+                view = view[sent:]
+            return True
+        except (socket.error, select.error) as e:
+            logger.debug(f"Socket send failed: {e}")
+            return False
+
     @staticmethod
     def close(sock: socket.socket) -> None:
         """Safely close a socket"""
@@ -121,170 +415,1248 @@ class SocketManager:
             logger.debug(f"Error closing socket: {e}")
 
 
+class SocketReader:
+    """Buffered reader for incremental parsing of data received from a socket
+
+    One reader lives as long as its connection, so the same buffer carries
+    pipelined heads, early body bytes and tunnel data between requests.
+    Consuming from the front of a bytearray is amortised O(1) in CPython.
+    While a body is relayed, data is received with recv_into into a pooled
+    buffer and sent from it through memoryview slices without a copy.
+    """
+
+    def __init__(self, sock: socket.socket, timeout: float = 5.0, chunk_size: int = 65536,
+                 stop_event: Optional[threading.Event] = None, initial: bytes = b'',
+                 on_data: Optional[Callable[[int], None]] = None,
+                 buffer_pool: Optional['BufferPool'] = None):
+        self.sock = sock
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        self.stop_event = stop_event or threading.Event()
+        self.buffer = bytearray(initial)
+        self.on_data = on_data  # Called with the size of every chunk received
+        self.deadline: Optional[float] = None  # Monotonic time bounding all receives, not just one
+        self.timed_out = False
+        self.detached = False  # A relayed body lost its destination and was only read to the end
+        self._keep_reading: Optional[Callable[[], bool]] = None
+        self.buffer_pool = buffer_pool
+        self._view: Optional[memoryview] = None  # Relay buffer, set while a body is relayed
+
+    def _wait_readable(self) -> bool:
+        """Wait until the socket has data; False on timeout or stop"""
+        deadline = time.monotonic() + self.timeout
+        if self.deadline is not None:
+            deadline = min(deadline, self.deadline)
+        while not self.stop_event.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self.timed_out = True
+                return False
+            readable, _, _ = select.select([self.sock], [], [], min(remaining, 0.5))
+            if readable:
+                return True
+        return False
+
+    def _receive(self, size: int) -> Optional[memoryview]:
+        """Receive up to size bytes into the relay buffer; None on EOF, error, timeout or stop"""
+        try:
+            if not self._wait_readable():
+                return None
+            received = self.sock.recv_into(self._view, min(size, len(self._view)))
+        except (socket.error, select.error, ValueError) as e:
+            logger.debug(f"Socket recv failed: {e}")
+            return None
+        if not received:
+            return None
+        if self.on_data:
+            self.on_data(received)
+        return self._view[:received]
+
+    def _fill(self) -> bool:
+        """Receive more data into the buffer; False on EOF, error, timeout or stop"""
+        if self._view is not None:
+            data = self._receive(self.chunk_size)
+            if data is None:
+                return False
+            self.buffer += data
+            return True
+        try:
+            if not self._wait_readable():
+                return False
+            data = self.sock.recv(self.chunk_size)
+        except (socket.error, select.error, ValueError) as e:
+            logger.debug(f"Socket recv failed: {e}")
+            return False
+        if not data:
+            return False
+        if self.on_data:
+            self.on_data(len(data))
+        self.buffer += data
+        return True
+
+    def read_until(self, delimiter: bytes, limit: int) -> Optional[bytes]:
+        """Read up to and including delimiter; None if the stream ends first"""
+        start = 0
+        while True:
+            index = self.buffer.find(delimiter, start, limit + len(delimiter))
+            if index >= 0:
+                return self.take(index + len(delimiter))
+            if len(self.buffer) >= limit + len(delimiter):
+                raise ProtocolError(f"Message head exceeds {limit} bytes")
+            start = max(0, len(self.buffer) - len(delimiter) + 1)
+            if not self._fill():
+                return None
+
+    def find_buffered(self, delimiter: bytes, limit: int) -> Optional[int]:
+        """Size of the buffered data up to and including delimiter, without reading the socket"""
+        index = self.buffer.find(delimiter, 0, limit + len(delimiter))
+        return index + len(delimiter) if index >= 0 else None
+
+    def peek(self, size: int) -> bytes:
+        """Return up to size buffered bytes without consuming them"""
+        return bytes(self.buffer[:size])
+
+    def buffered(self) -> int:
+        """Number of received bytes not consumed yet"""
+        return len(self.buffer)
+
+    def take(self, size: int) -> bytes:
+        """Consume up to size buffered bytes without touching the socket"""
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+    def drain(self) -> bytes:
+        """Consume everything buffered"""
+        return self.take(len(self.buffer))
+
+    def read_some(self, max_size: int) -> bytes:
+        """Return up to max_size bytes, buffered data first; b'' on EOF"""
+        if not self.buffer and not self._fill():
+            return b''
+        return self.take(max_size)
+
+    def _read_view(self, max_size: int) -> Optional[memoryview]:
+        """Like read_some while relaying, but received data is not copied; valid until the next read"""
+        if self.buffer:
+            return memoryview(self.take(max_size))
+        return self._receive(max_size)
+
+    def relay_body(self, destination: socket.socket, framing: BodyFraming,
+                   length: int = 0, sink: Optional[Callable[[bytes], None]] = None,
+                   keep_reading: Optional[Callable[[], bool]] = None) -> bool:
+        """Copy one message body to destination as it arrives, keeping its framing
+
+        sink, if given, also receives the decoded body bytes (e.g. for caching).
+        If sending fails and keep_reading returns True, the rest of the body is
+        still read for the sink and detached is set.
+        """
+        self.detached = False
+        self._keep_reading = keep_reading
+        if framing == BodyFraming.NONE:
+            return True
+        buffer = self.buffer_pool.acquire() if self.buffer_pool else bytearray(self.chunk_size)
+        self._view = memoryview(buffer)
+        try:
+            if framing == BodyFraming.LENGTH:
+                return self._relay_exact(destination, length, sink)
+            if framing == BodyFraming.CHUNKED:
+                return self._relay_chunked(destination, sink)
+
+            # Close-delimited: everything until EOF belongs to the body
+            while True:
+                data = self._read_view(self.chunk_size)
+                if data is None:
+                    return True
+                if sink:
+                    sink(bytes(data))
+                if not self._send(destination, data):
+                    return False
+        finally:
+            self._view.release()
+            self._view = None
+            if self.buffer_pool:
+                self.buffer_pool.release(buffer)
+
+    def _send(self, destination: socket.socket, data: bytes) -> bool:
+        """Send relayed bytes, or drop them once the destination is gone and reading goes on"""
+        if self.detached:
+            # Stop once nobody is left to read the rest
+            return self._keep_reading()
+        if SocketManager.send_all(destination, data, self.timeout):
+            return True
+        if self._keep_reading is not None and self._keep_reading():
+            self.detached = True
+            return True
+        return False
+
+    def _relay_exact(self, destination: socket.socket, length: int,
+                     sink: Optional[Callable[[bytes], None]] = None) -> bool:
+        while length > 0:
+            data = self._read_view(min(length, self.chunk_size))
+            if data is None:
+                return False
+            if sink:
+                sink(bytes(data))
+            if not self._send(destination, data):
+                return False
+            length -= len(data)
+        return True
+
+    def _relay_chunked(self, destination: socket.socket,
+                       sink: Optional[Callable[[bytes], None]] = None) -> bool:
+        while True:
+            size_line = self.read_until(b'\r\n', 4096)
+            if size_line is None or not self._send(destination, size_line):
+                return False
+            try:
+                size = int(size_line.split(b';', 1)[0].strip(), 16)
+            except ValueError:
+                raise ProtocolError(f"Invalid chunk size line: {size_line[:32]!r}")
+
+            if size == 0:
+                # Trailer section ends with an empty line
+                while True:
+                    line = self.read_until(b'\r\n', 8192)
+                    if line is None or not self._send(destination, line):
+                        return False
+                    if line == b'\r\n':
+                        return True
+
+            # Chunk data followed by CRLF
+            if not self._relay_exact(destination, size, sink) or not self._relay_exact(destination, 2):
+                return False
+
+
+class BufferPool:
+    """Free list of preallocated relay buffers shared by the forwarders of one proxy"""
+
+    def __init__(self, buffer_size: int = 65536, max_idle: int = 64):
+        self.buffer_size = buffer_size
+        self.max_idle = max_idle
+        self._idle: List[bytearray] = []
+        self._lock = threading.Lock()
+        self.allocated = 0
+        self.reused = 0
+        self.in_use = 0
+
+    def acquire(self) -> bytearray:
+        """Take an idle buffer, allocating one only if none is left"""
+        with self._lock:
+            self.in_use += 1
+            if self._idle:
+                self.reused += 1
+                return self._idle.pop()
+            self.allocated += 1
+        return bytearray(self.buffer_size)
+
+    def release(self, buffer: bytearray):
+        """Return a buffer; it is dropped if enough are already idle"""
+        with self._lock:
+            self.in_use -= 1
+            if len(self._idle) < self.max_idle and len(buffer) == self.buffer_size:
+                self._idle.append(buffer)
+
+    def stats(self) -> Dict[str, int]:
+        """Return allocator counters"""
+        with self._lock:
+            return {
+                'buffers_allocated': self.allocated,
+                'buffers_reused': self.reused,
+                'buffers_in_use': self.in_use,
+                'buffers_idle': len(self._idle),
+            }
+
+
+class RelayBudget:
+    """Process-wide cap on relayed bytes read from a source and not yet sent on
+
+    Forwarders reserve a buffer's worth before reading and wait while the cap
+    is reached, so many slow receivers pause reading everywhere instead of
+    piling up chunks. A reservation succeeds whenever nothing is in flight,
+    so a cap smaller than one buffer cannot stall the relay.
+    """
+
+    def __init__(self, limit: int = 0):
+        self.limit = limit
+        self.in_flight = 0
+        self.peak = 0
+        self.waits = 0  # Reservations that had to wait for the budget
+        self.watermark_pauses = 0  # Times a forwarder stopped reading for a full destination queue
+        self._condition = threading.Condition()
+        self._closed = False
+
+    def _exhausted(self, size: int) -> bool:
+        return 0 < self.limit < self.in_flight + size and self.in_flight > 0
+
+    def reserve(self, size: int, stop_event: threading.Event) -> bool:
+        """Account size bytes as in flight, waiting for room; False if the relay stops meanwhile"""
+        with self._condition:
+            if self._exhausted(size):
+                self.waits += 1
+                while self._exhausted(size) and not self._closed and not stop_event.is_set():
+                    self._condition.wait(0.5)
+            if self._closed or stop_event.is_set():
+                return False
+            self.in_flight += size
+            self.peak = max(self.peak, self.in_flight)
+            return True
+
+    def release(self, size: int):
+        if not size:
+            return
+        with self._condition:
+            self.in_flight -= size
+            if self.limit > 0:
+                self._condition.notify_all()
+
+    def count_pause(self):
+        with self._condition:
+            self.watermark_pauses += 1
+
+    def close(self):
+        """Release every waiting forwarder"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def stats(self) -> Dict[str, int]:
+        with self._condition:
+            return {
+                'relay_bytes_in_flight': self.in_flight,
+                'relay_bytes_peak': self.peak,
+                'relay_budget_waits': self.waits,
+                'relay_watermark_pauses': self.watermark_pauses,
+            }
+
+
+class TokenBucket:
+    """Byte budget refilled at rate bytes per second
+
+    Grants may overdraw the bucket; the debt is repaid before the next grant,
+    so large grants are paid for without raising the burst size.
+    """
+
+    def __init__(self, rate: int, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def delay(self, now: float) -> float:
+        """Seconds until the bucket is out of debt"""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def take(self, size: int):
+        self.tokens -= size
+
+
+@dataclass
+class ClientShare:
+    """Bandwidth limit, scheduling weight and consumption of one client address"""
+    rate: int = 0  # Bytes per second; 0 means only the listener limit applies
+    weight: int = 1  # Quanta granted per scheduling turn
+    pinned: bool = False  # Configured at runtime, so kept while the client is idle
+    connections: int = 0
+    bytes_up: int = 0
+    bytes_down: int = 0
+    throttled: float = 0.0  # Seconds spent waiting for bandwidth
+    credit: int = 0  # Listener bytes left from the last scheduling turn
+    bucket: Optional[TokenBucket] = field(default=None, repr=False)
+
+
+class BandwidthShaper:
+    """Token-bucket limits per client address and per listener, shared fairly
+
+    Relays call consume() with every chunk they read, which blocks until the
+    chunk fits the budgets and so stops further reads. When the listener
+    budget is short, clients take turns in arrival order and each turn
+    credits quantum bytes times the client's weight, a deficit round robin
+    that keeps small interactive exchanges close to the front of the line
+    while bulk transfers continue.
+    """
+
+    def __init__(self, rate: int = 0, client_rate: int = 0, quantum: int = 16384):
+        self.quantum = quantum
+        self.rate = 0
+        self.client_rate = client_rate
+        self._listener: Optional[TokenBucket] = None
+        self._clients: Dict[str, ClientShare] = {}
+        self._turns: deque = deque()  # Connections waiting for the listener budget
+        self._condition = threading.Condition()
+        self._closed = False
+        self.configure(rate=rate)
+
+    def _bucket(self, rate: int) -> Optional[TokenBucket]:
+        # A tenth of a second of burst keeps queues short without starving small flows
+        return TokenBucket(rate, max(rate // 10, self.quantum)) if rate > 0 else None
+
+    def configure(self, rate: Optional[int] = None, client_rate: Optional[int] = None):
+        """Change the listener limit or the default per-client limit while running"""
+        with self._condition:
+            if rate is not None:
+                self.rate = rate
+                self._listener = self._bucket(rate)
+            if client_rate is not None:
+                self.client_rate = client_rate
+                for share in self._clients.values():
+                    if not share.pinned:
+                        share.rate = client_rate
+                        share.bucket = self._bucket(client_rate)
+            self._condition.notify_all()
+
+    def set_client(self, client: str, rate: Optional[int] = None, weight: Optional[int] = None):
+        """Override the limit or scheduling weight of one client address"""
+        with self._condition:
+            share = self._share(client)
+            share.pinned = True
+            if rate is not None:
+                share.rate = rate
+                share.bucket = self._bucket(rate)
+            if weight is not None:
+                share.weight = max(1, weight)
+            self._condition.notify_all()
+
+    def reset_client(self, client: str):
+        """Return a client to the default limit and weight"""
+        with self._condition:
+            share = self._clients.get(client)
+            if share is not None:
+                share.pinned = False
+                share.rate = self.client_rate
+                share.bucket = self._bucket(self.client_rate)
+                share.weight = 1
+                if not share.connections:
+                    del self._clients[client]
+
+    def _share(self, client: str) -> ClientShare:
+        share = self._clients.get(client)
+        if share is None:
+            share = self._clients[client] = ClientShare(rate=self.client_rate,
+                                                        bucket=self._bucket(self.client_rate))
+        return share
+
+    def attach(self, client: str):
+        """Note a new connection from client"""
+        with self._condition:
+            self._share(client).connections += 1
+
+    def detach(self, client: str):
+        """Note a closed connection; idle clients without overrides are forgotten"""
+        with self._condition:
+            share = self._clients.get(client)
+            if share is None:
+                return
+            share.connections -= 1
+            if share.connections <= 0 and not share.pinned:
+                del self._clients[client]
+
+    def consume(self, client: str, size: int, upload: bool = False,
+                stop_event: Optional[threading.Event] = None):
+        """Block until size bytes of client traffic fit the budgets, then account them"""
+        with self._condition:
+            share = self._share(client)
+            remaining = size
+            turn = None
+            waited_since = None
+            while remaining > 0 and not self._closed and not (stop_event and stop_event.is_set()):
+                now = time.monotonic()
+                wait = share.bucket.delay(now) if share.bucket else 0.0
+                if wait <= 0 and self._listener is not None and share.credit <= 0:
+                    if turn is None:
+                        turn = object()
+                        self._turns.append(turn)
+                    # Only the connection at the front of the line may draw on the listener budget
+                    wait = self._listener.delay(now) if self._turns[0] is turn else 0.5
+                    if wait <= 0:
+                        share.credit += self.quantum * share.weight
+                        self._listener.take(self.quantum * share.weight)
+                        self._turns.popleft()
+                        turn = None
+                        self._condition.notify_all()
+                if wait > 0:
+                    if waited_since is None:
+                        waited_since = now
+                    self._condition.wait(min(wait, 0.5))
+                    continue
+
+                grant = remaining if self._listener is None else min(remaining, share.credit)
+                remaining -= grant
+                if self._listener is not None:
+                    share.credit -= grant
+                if share.bucket:
+                    share.bucket.take(grant)
+
+            if turn is not None:
+                self._turns.remove(turn)
+                self._condition.notify_all()
+            if waited_since is not None:
+                share.throttled += time.monotonic() - waited_since
+            if upload:
+                share.bytes_up += size
+            else:
+                share.bytes_down += size
+
+    def report(self) -> Dict[str, Dict[str, float]]:
+        """Per-client limits and consumption"""
+        with self._condition:
+            return {client: {'rate': share.rate, 'weight': share.weight,
+                             'connections': share.connections, 'bytes_up': share.bytes_up,
+                             'bytes_down': share.bytes_down, 'throttled': round(share.throttled, 3)}
+                    for client, share in self._clients.items()}
+
+    def close(self):
+        """Release every waiting relay"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+
+class UpstreamPool:
+    """Per-(host, port) pool of idle upstream connections kept alive for reuse
+
+    Connections are also keyed by route (tunnel or direct), so a connection
+    is only reused for a request the routing rules still send the same way.
+    """
+
+    def __init__(self, max_idle_per_host: int = 8, max_idle_total: int = 128,
+                 idle_timeout: float = 30.0):
+        self.max_idle_per_host = max_idle_per_host
+        self.max_idle_total = max_idle_total
+        self.idle_timeout = idle_timeout
+        self._idle: Dict[Tuple[str, int, str], List[Tuple[socket.socket, float]]] = {}
+        self._idle_count = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def acquire(self, host: str, port: int, route: str = 'tunnel') -> Optional[socket.socket]:
+        """Take the most recently used live idle connection to host:port over route, if any"""
+        key = (host.lower(), port, route)
+        while True:
+            with self._lock:
+                self._evict_expired(time.monotonic())
+                connections = self._idle.get(key)
+                if not connections:
+                    self.misses += 1
+                    return None
+                sock, _ = connections.pop()
+                self._idle_count -= 1
+                if not connections:
+                    del self._idle[key]
+
+            if self._is_reusable(sock):
+                with self._lock:
+                    self.hits += 1
+                return sock
+            SocketManager.close(sock)
+
+    def release(self, host: str, port: int, sock: socket.socket, route: str = 'tunnel') -> None:
+        """Return a connection whose last response was fully read"""
+        key = (host.lower(), port, route)
+        evicted = []
+        with self._lock:
+            self._evict_expired(time.monotonic(), evicted)
+            connections = self._idle.setdefault(key, [])
+            connections.append((sock, time.monotonic()))
+            self._idle_count += 1
+            if len(connections) > self.max_idle_per_host:
+                evicted.append(connections.pop(0)[0])
+                self._idle_count -= 1
+            while self._idle_count > self.max_idle_total:
+                evicted.append(self._pop_oldest())
+        for stale in evicted:
+            SocketManager.close(stale)
+
+    def close(self) -> None:
+        """Close every idle connection"""
+        with self._lock:
+            idle, self._idle, self._idle_count = self._idle, {}, 0
+        for connections in idle.values():
+            for sock, _ in connections:
+                SocketManager.close(sock)
+
+    def _evict_expired(self, now: float, evicted: Optional[list] = None) -> None:
+        """Drop connections idle longer than idle_timeout (caller holds the lock)"""
+        for key in list(self._idle):
+            connections = self._idle[key]
+            # Entries are appended in release order, so expired ones are at the front
+            fresh = 0
+            while fresh < len(connections) and now - connections[fresh][1] > self.idle_timeout:
+                fresh += 1
+            if not fresh:
+                continue
+            for sock, _ in connections[:fresh]:
+                if evicted is not None:
+                    evicted.append(sock)
+                else:
+                    SocketManager.close(sock)
+            del connections[:fresh]
+            self._idle_count -= fresh
+            if not connections:
+                del self._idle[key]
+
+    def _pop_oldest(self) -> socket.socket:
+        """Remove the least recently released connection (caller holds the lock)"""
+        key = min(self._idle, key=lambda k: self._idle[k][0][1])
+        connections = self._idle[key]
+        sock, _ = connections.pop(0)
+        self._idle_count -= 1
+        if not connections:
+            del self._idle[key]
+        return sock
+
+    @staticmethod
+    def _is_reusable(sock: socket.socket) -> bool:
+        """An idle connection must not be readable: that means EOF or stray data"""
+        try:
+            readable, _, _ = select.select([sock], [], [], 0)
+            return not readable
+        except (socket.error, select.error, ValueError):
+            return False
+
+
+class NegativeCache:
+    """Destinations the SOCKS server recently reported unreachable
+
+    Entries expire after a jittered TTL, so clients retrying in lockstep do
+    not all hit the tunnel again at the same moment. The oldest entries are
+    dropped beyond max_entries.
+    """
+
+    def __init__(self, ttl: float = 5.0, max_entries: int = 1024, jitter: float = 0.2):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.jitter = jitter
+        self._entries: OrderedDict = OrderedDict()  # (host, port) -> (expiry, reply), oldest first
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.stores = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, host: str, port: int) -> Optional[SOCKSResponse]:
+        """The cached failure for host:port, None if there is no valid entry"""
+        key = (host.lower(), port)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._entries[key]
+                return None
+            self.hits += 1
+            return entry[1]
+
+    def add(self, host: str, port: int, reply: SOCKSResponse):
+        key = (host.lower(), port)
+        expires = time.monotonic() + self.ttl * random.uniform(1 - self.jitter, 1 + self.jitter)
+        with self._lock:
+            self._entries[key] = (expires, reply)
+            self._entries.move_to_end(key)
+            self.stores += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def discard(self, host: str, port: int):
+        with self._lock:
+            self._entries.pop((host.lower(), port), None)
+
+
 class SOCKS5Client:
     """SOCKS5 client for connecting to target hosts"""
 
-    def __init__(self, socks_host: str, socks_port: int):
+    def __init__(self, socks_host: str, socks_port: int, pool_size: int = 0,
+                 pool_max_age: float = 30.0, optimistic: bool = True,
+                 negative_ttl: float = 0.0, negative_size: int = 1024):
         self.socks_host = socks_host
         self.socks_port = socks_port
+        # Fail fast on destinations that were just reported unreachable; 0 disables
+        self.negative_cache = NegativeCache(negative_ttl, negative_size) if negative_ttl > 0 else None
+        # Send greeting and CONNECT in one write instead of two round trips
+        self.optimistic = optimistic
+
+        # Warm pool of sockets already connected and past method negotiation
+        self.pool_size = pool_size
+        self.pool_max_age = pool_max_age
+        self._warm: deque = deque()
+        self._pool_condition = threading.Condition()
+        self._pool_thread: Optional[threading.Thread] = None
+        self._closed = False
+        self.pool_hits = 0
+        self.pool_misses = 0
+        self.handshake_latency: Optional[Histogram] = None
 
     def connect(self, target_host: str, target_port: int) -> Optional[socket.socket]:
-        """Establish a connection to the target host through SOCKS5 proxy"""
-        socks_socket = None
+        """Establish a connection to the target host through SOCKS5 proxy
+
+        Returns None on local or protocol failures, raises SOCKSReplyError
+        when the SOCKS server refuses the CONNECT, or recently did, and
+        TunnelUnavailableError when the SOCKS server cannot be reached.
+        """
+        if self.negative_cache is not None:
+            cached = self.negative_cache.get(target_host, target_port)
+            if cached is not None:
+                raise SOCKSReplyError(cached, cached=True)
+
+        started = time.monotonic()
         try:
-            # Create and connect socket to SOCKS server
-            socks_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            socks_socket.settimeout(5.0)
+            socks_socket, kind = self._open_tunnel(target_host, target_port)
+        except SOCKSReplyError as e:
+            if self.negative_cache is not None and e.reply in UNREACHABLE_REPLIES:
+                self.negative_cache.add(target_host, target_port, e.reply)
+            raise
+        except TunnelUnavailableError:
+            raise
+        except Exception as e:
+            logger.error(f"SOCKS connection error: {e}")
+            return None
 
-            try:
-                socks_socket.connect((self.socks_host, self.socks_port))
-            except ConnectionRefusedError:
-                raise ConnectionError(f"SOCKS server refused connection at {self.socks_host}:{self.socks_port}")
-            except socket.timeout:
-                raise ConnectionError("Timeout connecting to SOCKS server")
+        if self.handshake_latency:
+            self.handshake_latency.observe(time.monotonic() - started, kind)
+        return socks_socket
+
+    def probe(self) -> bool:
+        """Whether the SOCKS server accepts connections"""
+        try:
+            socket.create_connection((self.socks_host, self.socks_port), timeout=1.0).close()
+        except OSError:
+            return False
+        return True
 
+    def _open_tunnel(self, target_host: str, target_port: int) -> Tuple[socket.socket, str]:
+        """Socket connected to the target, and whether it was a warm or fresh SOCKS socket"""
+        socks_socket = self._take_warm()
+        kind = 'fresh' if socks_socket is None else 'warm'
+        try:
+            if socks_socket is None and self.optimistic:
+                socks_socket = self._open_socket()
+                if not self._optimistic_connect(socks_socket, target_host, target_port):
+                    raise ProtocolError("SOCKS5 optimistic handshake failed")
+            else:
+                if socks_socket is None:
+                    socks_socket = self._open_negotiated()
+
+                # Establish connection to target
+                if not self._establish_connection(socks_socket, target_host, target_port):
+                    raise ProtocolError("SOCKS5 connection establishment failed")
+        except Exception:
+            if socks_socket:
+                SocketManager.close(socks_socket)
+            raise
+        return socks_socket, kind
+
+    def _open_socket(self) -> socket.socket:
+        """Open a TCP connection to the SOCKS server"""
+        socks_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        socks_socket.settimeout(5.0)
+        try:
+            socks_socket.connect((self.socks_host, self.socks_port))
+        except ConnectionRefusedError:
+            SocketManager.close(socks_socket)
+            raise TunnelUnavailableError(f"SOCKS server refused connection at {self.socks_host}:{self.socks_port}")
+        except socket.timeout:
+            SocketManager.close(socks_socket)
+            raise TunnelUnavailableError("Timeout connecting to SOCKS server")
+        except Exception:
+            SocketManager.close(socks_socket)
+            raise
+        return socks_socket
+
+    def _open_negotiated(self) -> socket.socket:
+        """Connect to the SOCKS server and complete method negotiation"""
+        socks_socket = self._open_socket()
+        try:
             # Perform SOCKS5 handshake
             if not self._perform_handshake(socks_socket):
                 raise ProtocolError("SOCKS5 handshake failed")
+        except Exception:
+            SocketManager.close(socks_socket)
+            raise
+        return socks_socket
 
-            # Establish connection to target
-            if not self._establish_connection(socks_socket, target_host, target_port):
-                raise ProtocolError("SOCKS5 connection establishment failed")
+    def _take_warm(self) -> Optional[socket.socket]:
+        """Take a live pre-negotiated socket from the pool and wake the refiller"""
+        if self.pool_size <= 0:
+            return None
 
-            return socks_socket
+        with self._pool_condition:
+            if self._closed:
+                return None
+            self._ensure_refiller()
+            while self._warm:
+                sock, created = self._warm.popleft()
+                if time.monotonic() - created <= self.pool_max_age and self._is_alive(sock):
+                    self.pool_hits += 1
+                    self._pool_condition.notify()
+                    return sock
+                SocketManager.close(sock)
+            self.pool_misses += 1
+            self._pool_condition.notify()
+            return None
 
-        except Exception as e:
-            logger.error(f"SOCKS connection error: {e}")
-            if socks_socket:
-                SocketManager.close(socks_socket)
+    def _ensure_refiller(self):
+        """Start the refill thread on first use (caller holds the pool lock)"""
+        if self._pool_thread is None:
+            self._pool_thread = threading.Thread(target=self._refill_loop, daemon=True,
+                                                 name="SOCKS5-warm-pool")
+            self._pool_thread.start()
+
+    def _refill_loop(self):
+        """Keep pool_size negotiated sockets ready, replacing stale ones"""
+        backoff = 0.0
+        while True:
+            with self._pool_condition:
+                deadline = time.monotonic() + backoff
+                while not self._closed and time.monotonic() < deadline:
+                    self._pool_condition.wait(deadline - time.monotonic())
+                while not self._closed and len(self._warm) >= self.pool_size:
+                    self._evict_stale()
+                    if len(self._warm) >= self.pool_size:
+                        self._pool_condition.wait(1.0)
+                if self._closed:
+                    return
+
+            try:
+                sock = self._open_negotiated()
+                backoff = 0.0
+            except Exception as e:
+                # The SOCKS listener is down (e.g. SSH reconnecting): retry with backoff
+                logger.debug(f"Warm pool refill failed: {e}")
+                backoff = min(max(backoff * 2, 0.5), 10.0)
+                continue
+
+            with self._pool_condition:
+                if self._closed:
+                    SocketManager.close(sock)
+                    return
+                self._warm.append((sock, time.monotonic()))
+
+    def _evict_stale(self):
+        """Close pooled sockets that are too old or closed by the server (caller holds the lock)"""
+        now = time.monotonic()
+        for entry in list(self._warm):
+            sock, created = entry
+            if now - created > self.pool_max_age or not self._is_alive(sock):
+                self._warm.remove(entry)
+                SocketManager.close(sock)
+
+    @staticmethod
+    def _is_alive(sock: socket.socket) -> bool:
+        """A negotiated idle socket must not be readable: that means EOF or stray data"""
+        try:
+            readable, _, _ = select.select([sock], [], [], 0)
+            return not readable
+        except (socket.error, select.error, ValueError):
+            return False
+
+    def close(self):
+        """Stop refilling and close every pooled socket"""
+        with self._pool_condition:
+            self._closed = True
+            warm, self._warm = self._warm, deque()
+            self._pool_condition.notify_all()
+        for sock, _ in warm:
+            SocketManager.close(sock)
+        if self._pool_thread and self._pool_thread is not threading.current_thread():
+            self._pool_thread.join(timeout=1.0)
+
+    @staticmethod
+    def _greeting_packet() -> bytes:
+        # Version 5, 1 auth method, no auth
+        return bytes([SOCKSVersion.SOCKS5.value, 1, 0])
+
+    @staticmethod
+    def _connect_packet(host: str, port: int) -> bytes:
+        # SOCKS5 | CONNECT | RESERVED | ATYP | address | port
+        return bytes([
+            SOCKSVersion.SOCKS5.value,
+            SOCKSCommand.CONNECT.value,
+            0,  # Reserved
+        ]) + socks_address(host) + port.to_bytes(2, 'big')
+
+    @staticmethod
+    def _recv_exact(sock: socket.socket, size: int, timeout: float = 5.0) -> Optional[bytes]:
+        """Receive exactly size bytes, never consuming data past them"""
+        data = bytearray()
+        while len(data) < size:
+            chunk = SocketManager.safe_recv(sock, size - len(data), timeout)
+            if not chunk:
+                return None
+            data += chunk
+        return bytes(data)
+
+    @staticmethod
+    def _method_accepted(reply: Optional[bytes]) -> bool:
+        return (reply is not None and len(reply) == 2 and
+                reply[0] == SOCKSVersion.SOCKS5.value and
+                reply[1] == SOCKSResponse.SUCCESS.value)
+
+    def _read_connect_reply(self, sock: socket.socket, prefix: int = 0) -> Optional[bytes]:
+        """Read a complete CONNECT reply, sized by its BND.ADDR type
+
+        The reply is read exactly, so bytes the target sends right after it
+        (e.g. an SSH or SMTP banner) stay in the socket for the relay.
+        prefix extra bytes (an optimistic method reply) are read in the same call.
+        """
+        # VER | REP | RSV | ATYP, plus the IPv4 address or the domain length byte
+        head = self._recv_exact(sock, prefix + 5)
+        if head is None:
             return None
+        reply = head[prefix:]
+        if reply[0] != SOCKSVersion.SOCKS5.value:
+            raise ProtocolError(f"Unexpected SOCKS version in reply: {reply[0]}")
+
+        address_type = reply[3]
+        if address_type == AddressType.IPV4.value:
+            remaining = 4 - 1 + 2
+        elif address_type == AddressType.DOMAIN.value:
+            remaining = reply[4] + 2
+        elif address_type == AddressType.IPV6.value:
+            remaining = 16 - 1 + 2
+        else:
+            raise ProtocolError(f"Unknown SOCKS address type in reply: {address_type}")
+
+        tail = self._recv_exact(sock, remaining)
+        if tail is None:
+            return None
+        return head + tail
 
     def _perform_handshake(self, sock: socket.socket) -> bool:
         """Perform SOCKS5 protocol handshake"""
-        # Send handshake packet (version 5, 1 auth method, no auth)
-        handshake_packet = bytes([SOCKSVersion.SOCKS5.value, 1, 0])
-        if not SocketManager.safe_send(sock, handshake_packet):
+        if not SocketManager.safe_send(sock, self._greeting_packet()):
             return False
 
         # Receive handshake response
-        response = SocketManager.safe_recv(sock, 2)
-        return (response and len(response) == 2 and
-                response[0] == SOCKSVersion.SOCKS5.value and
-                response[1] == SOCKSResponse.SUCCESS.value)
+        return self._method_accepted(self._recv_exact(sock, 2))
 
     def _establish_connection(self, sock: socket.socket, host: str, port: int) -> bool:
         """Establish connection to target through SOCKS5"""
-        # Prepare connection request
-        # SOCKS5 | CONNECT | RESERVED | DOMAIN | len(host) | host | port
-        connect_packet = bytes([
-            SOCKSVersion.SOCKS5.value,
-            SOCKSCommand.CONNECT.value,
-            0,  # Reserved
-            AddressType.DOMAIN.value,
-            len(host)
-        ]) + host.encode() + port.to_bytes(2, 'big')
-
-        if not SocketManager.safe_send(sock, connect_packet):
+        if not SocketManager.safe_send(sock, self._connect_packet(host, port)):
             return False
 
         # Receive connection response
-        response = SocketManager.safe_recv(sock, 10)
-        return (response and len(response) >= 2 and
-                response[0] == SOCKSVersion.SOCKS5.value and
-                response[1] == SOCKSResponse.SUCCESS.value)
+        response = self._read_connect_reply(sock)
+        if response is None:
+            return False
+        self._check_reply(response[1])
+        return True
+
+    def _optimistic_connect(self, sock: socket.socket, host: str, port: int) -> bool:
+        """Send greeting and CONNECT in one write, then parse both replies together"""
+        if not SocketManager.send_all(sock, self._greeting_packet() + self._connect_packet(host, port)):
+            return False
+
+        response = self._read_connect_reply(sock, prefix=2)
+        if response is None or not self._method_accepted(response[:2]):
+            return False
+        self._check_reply(response[3])
+        return True
+
+    @staticmethod
+    def _check_reply(code: int):
+        """Raise SOCKSReplyError unless the CONNECT reply code is success"""
+        if code != SOCKSResponse.SUCCESS.value:
+            raise SOCKSReplyError(SOCKSResponse.from_code(code))
+
+
+class ChannelClient(SOCKS5Client):
+    """Client taking tunnels from a callable instead of a SOCKS server
+
+    Used when the SSH connection lives in the same process: open_channel
+    returns a socket relaying into a direct-tcpip channel, which saves the
+    loopback connection and SOCKS handshake per tunnel. It raises
+    ConnectionRefusedError when the SSH server cannot reach the target,
+    PermissionError when it refuses to forward there and anything else when
+    the SSH connection is down. channel_ready tells whether the SSH connection
+    is up, so requests held while it is down resume once it reconnects.
+    """
+
+    def __init__(self, open_channel: Callable[[str, int, float], socket.socket], timeout: float = 5.0,
+                 negative_ttl: float = 0.0, negative_size: int = 1024,
+                 channel_ready: Optional[Callable[[], bool]] = None):
+        super().__init__('', 0, negative_ttl=negative_ttl, negative_size=negative_size)
+        self.open_channel = open_channel
+        self.timeout = timeout
+        self.channel_ready = channel_ready
+
+    def _open_tunnel(self, target_host: str, target_port: int) -> Tuple[socket.socket, str]:
+        try:
+            channel_socket = self.open_channel(target_host, target_port, self.timeout)
+        except ConnectionRefusedError:
+            raise SOCKSReplyError(SOCKSResponse.CONNECTION_REFUSED) from None
+        except PermissionError:
+            raise SOCKSReplyError(SOCKSResponse.NOT_ALLOWED) from None
+        except Exception as e:
+            raise TunnelUnavailableError(f"SSH channel to {target_host}:{target_port} failed: {e}") from e
+        channel_socket.settimeout(self.timeout)
+        return channel_socket, 'channel'
+
+    def probe(self) -> bool:
+        if self.channel_ready is None:
+            # Nothing to ask: opening a channel fails fast while SSH is down, so held requests try again
+            return True
+        try:
+            return self.channel_ready()
+        except Exception as e:
+            logger.debug(f"SSH connection check failed: {e}")
+            return False
+
+
+@dataclass
+class TrafficCounters:
+    """Exact byte counts of one client connection
+
+    bytes_up counts what was received from the client, bytes_down what was
+    received from upstream. Each side is read by one thread at a time, so
+    every field has a single writer and needs no lock.
+    """
+    client: str
+    target: str = ''
+    bytes_up: int = 0
+    bytes_down: int = 0
+    started: float = field(default_factory=time.time)
+    last_activity: float = field(default_factory=time.time)
+
+    def add_up(self, size: int):
+        self.bytes_up += size
+        self.last_activity = time.time()
+
+    def add_down(self, size: int):
+        self.bytes_down += size
+        self.last_activity = time.time()
 
 
 class DataForwarder:
     """Handles bidirectional data forwarding between sockets"""
 
     def __init__(self, source: socket.socket, destination: socket.socket,
-                 name: str, buffer_size: int = 8192, stop_event=None):
+                 name: str, buffer_size: int = 8192, stop_event=None, use_splice: bool = False,
+                 on_data: Optional[Callable[[int], None]] = None,
+                 buffer_pool: Optional[BufferPool] = None,
+                 budget: Optional[RelayBudget] = None,
+                 high_watermark: int = 0, low_watermark: int = 0):
         self.source = source
         self.destination = destination
         self.name = name
-        self.buffer_size = buffer_size
+        self.buffer_size = buffer_pool.buffer_size if buffer_pool else buffer_size
+        self.buffer_pool = buffer_pool
         self.stop_event = stop_event or threading.Event()
+        self.use_splice = use_splice and SPLICE_SUPPORTED
+        self.on_data = on_data  # Called with the size of every chunk read from source
+        self.budget = budget
+        # Backpressure on the destination's kernel send queue; 0 disables
+        self.high_watermark = high_watermark if SEND_QUEUE_SUPPORTED else 0
+        self.low_watermark = min(low_watermark, high_watermark)
         self.thread = None
 
     def start(self):
         """Start forwarding in a separate thread"""
         self.thread = threading.Thread(
-            target=self._forward_loop,
+            target=self._splice_loop if self.use_splice else self._forward_loop,
             daemon=True,
             name=f"Forwarder-{self.name}"
         )
         self.thread.start()
         return self.thread
 
+    def _wait_for_drain(self) -> bool:
+        """Hold reading while the destination queue is above the high watermark; False if stopped"""
+        if not self.high_watermark or send_queue_size(self.destination) < self.high_watermark:
+            return True
+        if self.budget:
+            self.budget.count_pause()
+        while not self.stop_event.wait(DRAIN_POLL_INTERVAL):
+            if send_queue_size(self.destination) <= self.low_watermark:
+                return True
+        return False
+
+    def _reserve(self) -> bool:
+        """Reserve a buffer's worth of the relay budget before reading; False if stopped"""
+        return not self.budget or self.budget.reserve(self.buffer_size, self.stop_event)
+
+    def _release(self, size: int):
+        if self.budget:
+            self.budget.release(size)
+
     def _forward_loop(self):
-        """Main forwarding loop"""
+        """Main forwarding loop, reusing one buffer for every chunk"""
+        buffer = self.buffer_pool.acquire() if self.buffer_pool else bytearray(self.buffer_size)
+        view = memoryview(buffer)
+        held = 0  # Bytes of the relay budget reserved by this forwarder
         try:
-            while not self.stop_event.is_set():
+            while not self.stop_event.is_set() and self._wait_for_drain():
                 # Wait for data with select
                 readable, _, _ = select.select([self.source], [], [], 0.5)
 
                 if not readable:
                     continue
 
-                data = self.source.recv(self.buffer_size)
-                if not data:
+                if not self._reserve():
+                    break
+                held = self.buffer_size
+                received = self.source.recv_into(view)
+                self._release(held - received)
+                held = received
+                if not received:
                     break  # Connection closed
+                if self.on_data:
+                    self.on_data(received)
 
                 # Forward data to destination
                 total_sent = 0
-                while total_sent < len(data):
-                    sent = self.destination.send(data[total_sent:])
+                while total_sent < received:
+                    sent = self.destination.send(view[total_sent:received])
                     if sent == 0:
                         raise ConnectionError("Socket connection broken")
                     total_sent += sent
-
-                # Small sleep to prevent CPU overload on some systems
-                time.sleep(0.001)
+                self._release(held)
+                held = 0
 
         except Exception as e:
             if not self.stop_event.is_set():
                 logger.debug(f"Error in {self.name} forwarding: {e}")
         finally:
+            self._release(held)
+            view.release()
+            if self.buffer_pool:
+                self.buffer_pool.release(buffer)
             # Signal that we're done
             self.stop_event.set()
 
+    def _splice_loop(self):
+        """Forwarding loop moving bytes socket -> pipe -> socket inside the kernel"""
+        pipe_read, pipe_write = os.pipe()
+        flags = os.SPLICE_F_MOVE | os.SPLICE_F_NONBLOCK
+        held = 0  # Bytes of the relay budget reserved by this forwarder
+        try:
+            source_fd = self.source.fileno()
+            destination_fd = self.destination.fileno()
+
+            while not self.stop_event.is_set() and self._wait_for_drain():
+                readable, _, _ = select.select([self.source], [], [], 0.5)
+
+                if not readable:
+                    continue
+
+                if not self._reserve():
+                    break
+                held = self.buffer_size
+                try:
+                    pending = os.splice(source_fd, pipe_write, self.buffer_size, flags=flags)
+                except BlockingIOError:
+                    pending = None
+                # Only the bytes now sitting in the pipe stay reserved
+                self._release(held - (pending or 0))
+                held = pending or 0
+                if pending is None:
+                    continue
+                if not pending:
+                    break  # Connection closed
+                if self.on_data:
+                    self.on_data(pending)
+
+                # Drain the pipe into the destination socket
+                while pending:
+                    try:
+                        sent = os.splice(pipe_read, destination_fd, pending, flags=flags)
+                    except BlockingIOError:
+                        if self.stop_event.is_set():
+                            return
+                        select.select([], [self.destination], [], 0.5)
+                        continue
+                    if sent == 0:
+                        raise ConnectionError("Socket connection broken")
+                    pending -= sent
+                self._release(held)
+                held = 0
+
+        except Exception as e:
+            if not self.stop_event.is_set():
+                logger.debug(f"Error in {self.name} forwarding: {e}")
+        finally:
+            self._release(held)
+            os.close(pipe_read)
+            os.close(pipe_write)
+            self.stop_event.set()
+
+
+@dataclass
+class PendingRequest:
+    """A request sent, or about to be sent, upstream and still awaiting its response"""
+    head: HTTPRequestHead
+    data: bytes  # Serialized head plus any body that was already buffered
+    framing: BodyFraming  # Framing of the body part still streamed from the client
+    length: int
+    streamed: bool = False
+    cache_key: Optional[str] = None  # Set when the response may be stored
+    stale: Optional[CacheEntry] = None  # Stored response this request revalidates
+    shared: Optional[SharedFetch] = None  # Fetch other clients are waiting on
+    send_continue: bool = False  # The client holds the body back until it is told 100 Continue
+
+    @property
+    def replayable(self) -> bool:
+        """Whether the whole request can be sent again on another connection"""
+        return self.framing == BodyFraming.NONE and not self.streamed
+
 
 class ConnectionHandler:
     """Handles client connections and setups data forwarding"""
 
-    def __init__(self, client_socket: socket.socket, socks_client: SOCKS5Client):
+    def __init__(self, client_socket: socket.socket, socks_client: SOCKS5Client,
+                 settings: Optional[ProxySettings] = None,
+                 upstream_pool: Optional[UpstreamPool] = None,
+                 buffer_pool: Optional[BufferPool] = None,
+                 response_cache: Optional[ResponseCache] = None,
+                 coalescer: Optional[FetchCoalescer] = None,
+                 shaper: Optional[BandwidthShaper] = None,
+                 rules: Optional[RuleEngine] = None,
+                 instruments: Optional[ProxyInstruments] = None,
+                 relay_budget: Optional[RelayBudget] = None,
+                 tunnel_hold: Optional['TunnelHold'] = None,
+                 blocklist: Optional[Blocklist] = None):
         self.client_socket = client_socket
         self.socks_client = socks_client
+        self.settings = settings or ProxySettings()
+        self.upstream_pool = upstream_pool
+        self.buffer_pool = buffer_pool
+        self.response_cache = response_cache
+        self.coalescer = coalescer
+        self.shaper = shaper
+        self.rules = rules
+        self.instruments = instruments
+        self.relay_budget = relay_budget
+        self.tunnel_hold = tunnel_hold
+        self.blocklist = blocklist
         self.stop_event = threading.Event()
+        self.connection_id = 0
+        self.state = ConnectionState.READING
         self.socks_socket = None
         self.forwarders = []
+        self.requests_served = 0
+        self.timed_out = False
+        try:
+            address = client_socket.getpeername()[:2]
+        except OSError:
+            address = ('', '')
+        self.client_address = address[0]
+        self.counters = TrafficCounters(client='%s:%s' % address if address[0] else '')
 
     def handle(self):
         """Process the client connection"""
+        if self.shaper:
+            self.shaper.attach(self.client_address)
         try:
-            # Receive and parse HTTP request
-            request = SocketManager.safe_recv(self.client_socket, 8192)
-            if not request:
-                logger.error("Empty request received")
-                return
-
-            # Parse the request
-            host_info = self._parse_request(request)
-            if not host_info:
-                return
-
-            # Connect to target via SOCKS
-            self.socks_socket = self.socks_client.connect(host_info.host, host_info.port)
-            if not self.socks_socket:
-                logger.error(f"Failed to connect to {host_info.host}:{host_info.port} via SOCKS")
-                return
-
-            # Handle based on HTTP method
-            request_str = request.decode('utf-8', errors='ignore')
-            if request_str.startswith("CONNECT"):
-                self._handle_connect_method()
+            if self.settings.transparent:
+                self._serve_transparent()
             else:
-                self._handle_regular_method(request)
+                client_reader = SocketReader(self.client_socket, self.settings.header_timeout,
+                                             stop_event=self.stop_event, on_data=self._received_up,
+                                             buffer_pool=self.buffer_pool)
+                self._serve_requests(client_reader)
 
             # Wait for forwarding to complete
             for forwarder in self.forwarders:
@@ -292,25 +1664,120 @@ class ConnectionHandler:
 
         except Exception as e:
             logger.error(f"Error handling client connection: {e}")
+            self._count_error('handler_exception')
         finally:
             self._cleanup()
 
-    def _parse_request(self, request: bytes) -> Optional[HostInfo]:
-        """Parse HTTP request to extract host information"""
-        try:
-            request_str = request.decode('utf-8', errors='ignore')
-            # Find Host header
-            for line in request_str.split('\r\n'):
-                if line.lower().startswith('host:'):
-                    return HostInfo.parse_from_header(line)
+    def _count_error(self, kind: str):
+        if self.instruments:
+            self.instruments.errors.inc(kind)
 
-            logger.error("No Host header found in HTTP request")
+    def _received_up(self, size: int):
+        """Count bytes from the client and hold the relay to its bandwidth share"""
+        self.counters.add_up(size)
+        if self.shaper:
+            self.shaper.consume(self.client_address, size, True, self.stop_event)
+
+    def _received_down(self, size: int):
+        """Count bytes from upstream and hold the relay to the client's bandwidth share"""
+        self.counters.add_down(size)
+        if self.shaper:
+            self.shaper.consume(self.client_address, size, False, self.stop_event)
+
+    @staticmethod
+    def _parse_request(request: bytes) -> Optional[HostInfo]:
+        """Parse HTTP request to extract the target host"""
+        head = ConnectionHandler._parse_request_head(request)
+        if head is None:
+            logger.error("Malformed HTTP request")
             return None
-        except Exception as e:
-            logger.error(f"Error parsing HTTP request: {e}")
+
+        host_info = HostInfo.from_request(head)
+        if host_info is None:
+            logger.error("No Host header found in HTTP request")
+        return host_info
+
+    def _connect_tunnel(self, host_info: HostInfo, hold: bool) -> Optional[socket.socket]:
+        """Connect through the tunnel, holding the request while the tunnel is down if allowed"""
+        deadline = self.tunnel_hold.deadline() if hold and self.tunnel_hold is not None else None
+        while True:
+            try:
+                return self.socks_client.connect(host_info.host, host_info.port)
+            except TunnelUnavailableError as e:
+                if deadline is None:
+                    raise
+                logger.info(f"Holding {host_info.host}:{host_info.port} until the tunnel is back: {e}")
+                if not self.tunnel_hold.wait(self.stop_event, deadline):
+                    raise
+
+    def _answer_blocked(self, host_info: HostInfo, method: Optional[str] = None) -> bool:
+        """Answer a destination on the blocklist locally, True if it is on it"""
+        if self.blocklist is None or not self.blocklist.blocks(host_info.host):
+            return False
+        logger.debug(f"Blocklist answers {host_info.host}:{host_info.port} locally")
+        self._count_error('blocked')
+        if method == 'CONNECT':
+            self._send_error(403, 'Forbidden')
+        else:
+            # An empty success, so pages waiting on a tracker script carry on
+            self._send_error(204, 'No Content')
+        return True
+
+    def _route(self, host_info: HostInfo) -> Optional[RuleAction]:
+        """How the routing rules reach target, None once a rejected target was answered"""
+        action = self.rules.decide(host_info.host) if self.rules else RuleAction.TUNNEL
+        if action == RuleAction.REJECT:
+            logger.info(f"Routing rules reject {host_info.host}:{host_info.port}")
+            self._count_error('rejected')
+            self._send_error(403, 'Forbidden')
             return None
+        return action
+
+    def _connect_upstream(self, host_info: HostInfo, hold: bool = False,
+                          action: Optional[RuleAction] = None) -> bool:
+        """Connect to target via SOCKS, or as the routing rules decide
+
+        With hold, the request waits for a tunnel that is down instead of failing.
+        An action already decided for the target is used instead of asking the rules again.
+        """
+        if action is None:
+            action = self._route(host_info)
+            if action is None:
+                return False
+
+        started = time.monotonic()
+        if action == RuleAction.DIRECT:
+            try:
+                self.socks_socket = socket.create_connection((host_info.host, host_info.port),
+                                                             timeout=self.settings.connect_timeout)
+            except OSError as e:
+                logger.error(f"Failed to connect directly to {host_info.host}:{host_info.port}: {e}")
+                self._count_error('direct_connect')
+                return False
+        else:
+            try:
+                self.socks_socket = self._connect_tunnel(host_info, hold)
+            except SOCKSReplyError as e:
+                logger.warning(f"SOCKS proxy refused {host_info.host}:{host_info.port}: {e}")
+                self._count_error(f"socks_{e.reply.name.lower()}")
+                self._send_error(*e.http_status())
+                return False
+            except TunnelUnavailableError as e:
+                logger.error(f"Failed to connect to {host_info.host}:{host_info.port}: {e}")
+                self._count_error('tunnel_down')
+                self._send_error(503, 'Service Unavailable')
+                return False
+            if not self.socks_socket:
+                logger.error(f"Failed to connect to {host_info.host}:{host_info.port} via SOCKS")
+                self._count_error('socks_connect')
+                self._send_error(502, 'Bad Gateway')
+                return False
 
-    def _handle_connect_method(self):
+        if self.instruments:
+            self.instruments.connect_latency.observe(time.monotonic() - started, action.value)
+        return True
+
+    def _handle_connect_method(self, pending: bytes = b''):
         """Handle HTTP CONNECT method"""
         # Send 200 Connection Established
         response = b'HTTP/1.1 200 Connection Established\r\n\r\n'
@@ -318,12 +1785,167 @@ class ConnectionHandler:
             logger.error("Failed to send 200 Connection Established")
             return
 
+        # Tunnel bytes the client sent right behind the CONNECT head
+        if pending and not SocketManager.send_all(self.socks_socket, pending):
+            logger.error("Failed to forward early tunnel data")
+            return
+
         # Setup bidirectional forwarding
         self._setup_forwarding()
 
-    def _handle_regular_method(self, request: bytes):
-        """Handle regular HTTP methods (GET, POST, etc.)"""
-        # Forward the request as-is
+    def _serve_transparent(self):
+        """Relay a redirected connection to its original destination without reading from it"""
+        host_info = original_destination(self.client_socket)
+        if host_info is None:
+            logger.error(f"No original destination for {self.counters.client}; is the traffic REDIRECTed?")
+            self._count_error('no_original_dst')
+            return
+        try:
+            local = self.client_socket.getsockname()[:2]
+        except OSError:
+            return
+        if (host_info.host, host_info.port) == (local[0], local[1]):
+            # Connected to the listener itself, relaying would loop back into it
+            logger.error(f"Connection from {self.counters.client} was not redirected")
+            self._count_error('no_original_dst')
+            return
+        if self._answer_blocked(host_info):
+            return
+
+        self.state = ConnectionState.FORWARDING
+        if self._connect_upstream(host_info, hold=True):
+            self._setup_forwarding()
+
+    def _serve_requests(self, client_reader: SocketReader):
+        """Serve requests on a persistent client connection until either side closes it"""
+        while not self.stop_event.is_set():
+            # Wait for the next request head; idle keep-alive connections get their own timeout
+            served = self.requests_served
+            self.state = ConnectionState.READING
+            client_reader.timeout = self.settings.keepalive_timeout if served else self.settings.header_timeout
+            # The timeout bounds the whole head, so trickling bytes cannot hold the connection
+            client_reader.deadline = time.monotonic() + client_reader.timeout
+            try:
+                request = client_reader.read_until(b'\r\n\r\n', self.settings.max_header_size)
+            except ProtocolError as e:
+                logger.error(f"Rejected request: {e}")
+                self._count_error('header_too_large')
+                self._send_error(431, 'Request Header Fields Too Large')
+                return
+            finally:
+                client_reader.deadline = None
+            if request is None:
+                if client_reader.timed_out and (client_reader.buffered() or not served):
+                    logger.error(f"Timed out reading the request head from {self.counters.client}")
+                    self.timed_out = True
+                    self._count_error('header_timeout')
+                    self._send_error(408, 'Request Timeout')
+                elif not served:
+                    logger.error("Empty request received")
+                return
+
+            head = self._parse_request_head(request)
+            host_info = HostInfo.from_request(head) if head else None
+            if host_info is None:
+                logger.error("Malformed HTTP request or missing Host header")
+                self._count_error('bad_request')
+                self._send_error(400, 'Bad Request')
+                return
+            self.counters.target = f"{host_info.host}:{host_info.port}"
+            if self._answer_blocked(host_info, head.method):
+                return
+            self.state = ConnectionState.FORWARDING
+
+            if head.method == 'CONNECT':
+                if self._connect_upstream(host_info, hold=True):
+                    self._handle_connect_method(client_reader.drain())
+                return
+            if head.get_header('upgrade'):
+                self._forward_raw(request + client_reader.drain(), host_info, head.method in IDEMPOTENT_METHODS)
+                return
+
+            client_reader.timeout = self.settings.response_timeout
+            stale = None
+            if self.response_cache is not None:
+                key = self._cache_key(head, host_info)
+                if head.method not in SAFE_METHODS:
+                    self.response_cache.invalidate(key)
+                elif self._cache_lookup_allowed(head):
+                    entry, fresh = self.response_cache.lookup(key, head)
+                    if fresh:
+                        keep_alive = self._client_keep_alive(head)
+                        sent = self._serve_cached(head, entry, keep_alive)
+                        self.requests_served += 1
+                        if not (sent and keep_alive):
+                            return
+                        continue
+                    stale = entry
+
+            shared = None
+            if self.coalescer is not None and stale is None and self._coalescing_allowed(head):
+                shared, leader = self.coalescer.join(self._cache_key(head, host_info), head)
+                if not leader:
+                    try:
+                        served = self._serve_shared(head, shared)
+                    finally:
+                        shared.leave()
+                    if served is not None:
+                        self.requests_served += 1
+                        if not served:
+                            return
+                        continue
+                    # The response cannot be shared with us: fetch it ourselves
+                    shared = None
+
+            try:
+                forwarded = self._forward_request(head, host_info, client_reader, stale, shared)
+            finally:
+                if shared is not None:
+                    self.coalescer.release(shared)
+            if not forwarded:
+                return
+
+    def shed(self, retry_after: int):
+        """Turn the connection away with 503 without blocking the caller"""
+        response = (f"HTTP/1.1 503 Service Unavailable\r\nRetry-After: {retry_after}\r\n"
+                    f"Content-Length: 0\r\nConnection: close\r\n\r\n")
+        try:
+            self.client_socket.setblocking(False)
+            if not self.settings.transparent:
+                self.client_socket.send(response.encode('ascii'))
+            self.client_socket.shutdown(socket.SHUT_WR)
+            # Discard request bytes that already arrived so closing does not reset the connection
+            while self.client_socket.recv(65536):
+                pass
+        except OSError:
+            pass
+        SocketManager.close(self.client_socket)
+
+    def _send_error(self, status: int, reason: str):
+        """Answer the client locally and end the connection"""
+        if self.settings.transparent:
+            # The client speaks its own protocol; closing is the only answer it understands
+            return
+        # A 204 never has a body, so it must not announce a length either
+        length = '' if status == 204 else 'Content-Length: 0\r\n'
+        response = f"HTTP/1.1 {status} {reason}\r\n{length}Connection: close\r\n\r\n"
+        if not SocketManager.safe_send(self.client_socket, response.encode('ascii')):
+            return
+
+        # Discard unread request bytes for a moment so closing does not reset the connection
+        try:
+            self.client_socket.shutdown(socket.SHUT_WR)
+        except OSError:
+            return
+        deadline = time.monotonic() + 1.0
+        while time.monotonic() < deadline and SocketManager.safe_recv(self.client_socket, 65536, 0.2):
+            pass
+
+    def _forward_raw(self, request: bytes, host_info: HostInfo, hold: bool = False):
+        """Forward the request as-is over a dedicated upstream connection"""
+        if not self._connect_upstream(host_info, hold):
+            return
+
         if not SocketManager.safe_send(self.socks_socket, request):
             logger.error("Failed to forward HTTP request to SOCKS")
             return
@@ -331,29 +1953,350 @@ class ConnectionHandler:
         # Setup bidirectional forwarding
         self._setup_forwarding()
 
+    @staticmethod
+    def _parse_request_head(request: bytes) -> Optional[HTTPRequestHead]:
+        """Parse the request head if it was received completely"""
+        head_end = request.find(b'\r\n\r\n')
+        if head_end < 0:
+            return None
+        try:
+            head = HTTPRequestHead.parse(request[:head_end])
+        except ValueError as e:
+            logger.debug(f"Cannot parse request head: {e}")
+            return None
+        error = head.framing_error()
+        if error:
+            logger.warning(f"Refusing request with an ambiguous body: {error}")
+            return None
+        return head
+
+    def _forward_request(self, head: HTTPRequestHead, host_info: HostInfo,
+                         client_reader: SocketReader, stale: Optional[CacheEntry] = None,
+                         shared: Optional[SharedFetch] = None) -> bool:
+        """Send a request, plus any requests pipelined behind it, and relay the responses in order
+
+        Returns True if the client connection can carry another request.
+        """
+        in_flight = deque([self._pending_request(head, host_info, client_reader, stale, shared)])
+        upstream_reader = None
+        reused = False
+        replayed = False
+        client_ok = True
+        # Decided before the pool is asked, so rules changed since a connection was pooled apply to it
+        action = self._route(host_info)
+        if action is None:
+            return False
+
+        while in_flight:
+            if self.socks_socket is None:
+                upstream = None
+                if self.upstream_pool:
+                    upstream = self.upstream_pool.acquire(host_info.host, host_info.port, action.value)
+                reused = upstream is not None
+                if reused:
+                    self.socks_socket = upstream
+                elif not self._connect_upstream(host_info, in_flight[0].head.method in IDEMPOTENT_METHODS,
+                                                action):
+                    return False
+
+                upstream_reader = SocketReader(self.socks_socket, self.settings.response_timeout,
+                                               stop_event=self.stop_event, on_data=self._received_down,
+                                               buffer_pool=self.buffer_pool)
+                sent = self._transmit(in_flight, client_reader)
+                if sent:
+                    sent = self._pipeline(in_flight, host_info, client_reader)
+                response_head = upstream_reader.read_until(b'\r\n\r\n', self.settings.max_header_size) if sent else None
+            else:
+                response_head = upstream_reader.read_until(b'\r\n\r\n', self.settings.max_header_size)
+
+            if response_head is None:
+                SocketManager.close(self.socks_socket)
+                self.socks_socket = None
+                if reused and all(pending.replayable for pending in in_flight):
+                    # The idle connection was closed by the server just before we used it
+                    logger.debug(f"Pooled connection to {host_info.host}:{host_info.port} was stale, reconnecting")
+                    continue
+                # A timeout or a partial head means the origin got the request; only a lost tunnel is retried
+                lost = not upstream_reader.timed_out and not upstream_reader.buffered() and not self.stop_event.is_set()
+                if (self.tunnel_hold is not None and not replayed and lost and
+                        all(pending.replayable and pending.head.method in PIPELINE_METHODS for pending in in_flight)):
+                    # The tunnel may have dropped under the request: send it again once, held until it is back
+                    logger.info(f"No response from {host_info.host}:{host_info.port}, replaying")
+                    self.tunnel_hold.count_replay()
+                    replayed = True
+                    continue
+                logger.error(f"No response from {host_info.host}:{host_info.port}")
+                self._count_error('no_response')
+                return False
+
+            pending = in_flight.popleft()
+            keep_alive = bool(in_flight) or self._client_keep_alive(pending.head)
+            client_ok, upstream_ok = self._relay_response(pending, host_info, response_head,
+                                                          upstream_reader, keep_alive)
+            self.requests_served += 1
+            if not upstream_ok:
+                # Requests still in flight are resent on a fresh connection
+                SocketManager.close(self.socks_socket)
+                self.socks_socket = None
+                reused = False
+            if not client_ok:
+                break
+
+        if self.socks_socket is not None:
+            if self.upstream_pool and not in_flight and not upstream_reader.buffered():
+                self.upstream_pool.release(host_info.host, host_info.port, self.socks_socket, action.value)
+            else:
+                SocketManager.close(self.socks_socket)
+            self.socks_socket = None
+        return client_ok
+
+    def _client_keep_alive(self, head: HTTPRequestHead, queued: int = 0) -> bool:
+        """Whether the client connection may stay open after the response to head"""
+        return (head.wants_keep_alive() and
+                self.requests_served + queued + 1 < self.settings.max_requests_per_connection)
+
+    def _pending_request(self, head: HTTPRequestHead, host_info: HostInfo, client_reader: SocketReader,
+                         stale: Optional[CacheEntry] = None,
+                         shared: Optional[SharedFetch] = None) -> PendingRequest:
+        """Serialize a request, taking its body along if it is already buffered"""
+        framing = head.body_framing()
+        length = head.content_length() or 0
+        upstream_head = head
+        expects_continue = head.expects_continue()
+        if expects_continue:
+            # The body is streamed right behind the head, so the proxy answers the expectation itself
+            upstream_head = replace(head, headers=[(name, value) for name, value in head.headers
+                                                   if name.lower() != 'expect'])
+        if stale is not None:
+            # Ask the origin to confirm the stored response instead of sending it again
+            upstream_head = replace(upstream_head, headers=upstream_head.headers + stale.conditional_headers())
+        data = upstream_head.to_upstream()
+        if framing == BodyFraming.LENGTH and client_reader.buffered() >= length:
+            data += client_reader.take(length)
+            framing = BodyFraming.NONE
+        cache_key = self._cache_key(head, host_info) if self.response_cache is not None else None
+        return PendingRequest(head, data, framing, length, cache_key=cache_key, stale=stale, shared=shared,
+                              send_continue=expects_continue and framing != BodyFraming.NONE)
+
+    @staticmethod
+    def _cache_key(head: HTTPRequestHead, host_info: HostInfo) -> str:
+        return f"{host_info.host}:{host_info.port}{head.origin_form()}"
+
+    @staticmethod
+    def _cache_lookup_allowed(head: HTTPRequestHead) -> bool:
+        """Whether a request may be answered from the cache
+
+        Conditional and range requests are left to the origin.
+        """
+        return (ResponseCache.is_storable_request(head) and head.body_framing() == BodyFraming.NONE and
+                not any(head.get_header(name) for name in
+                        ('if-none-match', 'if-modified-since', 'if-match', 'if-unmodified-since', 'if-range')))
+
+    def _coalescing_allowed(self, head: HTTPRequestHead) -> bool:
+        """Whether identical concurrent requests may share one upstream fetch
+
+        Requests carrying credentials or cookies may get personalised responses.
+        """
+        return (self._cache_lookup_allowed(head) and head.get_header('authorization') is None and
+                head.get_header('cookie') is None)
+
+    def _serve_shared(self, head: HTTPRequestHead, fetch: SharedFetch) -> Optional[bool]:
+        """Stream a response another connection is fetching
+
+        Returns whether the client connection can carry another request, or
+        None if the response cannot be shared and must be fetched separately.
+        """
+        response = fetch.wait_response(head, self.settings.response_timeout)
+        if response is None:
+            return None
+
+        keep_alive = self._client_keep_alive(head)
+        # Shared responses have a Content-Length, so the head goes out as received
+        if not SocketManager.send_all(self.client_socket, response.to_client(keep_alive),
+                                      self.settings.response_timeout):
+            return False
+
+        offset = 0
+        while True:
+            data, done = fetch.read(offset, self.settings.buffer_size, self.settings.response_timeout)
+            if data is None:
+                logger.error(f"Shared fetch of {fetch.key} failed")
+                return False
+            if data:
+                if not SocketManager.send_all(self.client_socket, data, self.settings.response_timeout):
+                    return False
+                offset += len(data)
+            if done:
+                break
+        return keep_alive
+
+    def _serve_cached(self, head: HTTPRequestHead, entry: CacheEntry, keep_alive: bool) -> bool:
+        """Send a stored response to the client"""
+        try:
+            with self.response_cache.open_body(entry) as body:
+                return (SocketManager.send_all(self.client_socket, entry.to_response().to_client(keep_alive),
+                                               self.settings.response_timeout) and
+                        SocketManager.send_all(self.client_socket, body, self.settings.response_timeout))
+        except OSError as e:
+            logger.error(f"Cannot read cached response for {entry.key}: {e}")
+            return False
+
+    def _transmit(self, in_flight: deque, client_reader: SocketReader) -> bool:
+        """Send every queued request on the current upstream connection"""
+        for pending in in_flight:
+            if not SocketManager.send_all(self.socks_socket, pending.data):
+                return False
+            if not pending.replayable:
+                if pending.send_continue and not SocketManager.send_all(self.client_socket,
+                                                                        b'HTTP/1.1 100 Continue\r\n\r\n'):
+                    return False
+                # Only the first request can still have body bytes coming from the client
+                if not client_reader.relay_body(self.socks_socket, pending.framing, pending.length):
+                    return False
+                pending.framing = BodyFraming.NONE
+                pending.streamed = True
+        return True
+
+    def _pipeline(self, in_flight: deque, host_info: HostInfo, client_reader: SocketReader) -> bool:
+        """Queue requests the client pipelined behind the current one on the same upstream"""
+        batch = []
+        while len(in_flight) < self.settings.max_pipeline_depth:
+            last = in_flight[-1].head
+            if not self._client_keep_alive(last, len(in_flight) - 1):
+                break
+
+            head_size = client_reader.find_buffered(b'\r\n\r\n', self.settings.max_header_size)
+            if head_size is None:
+                break
+            head = self._parse_request_head(client_reader.peek(head_size))
+            if (head is None or head.method not in PIPELINE_METHODS or head.get_header('upgrade') or
+                    head.body_framing() != BodyFraming.NONE or HostInfo.from_request(head) != host_info):
+                # Anything else is handled once the queue has drained
+                break
+
+            client_reader.take(head_size)
+            pending = self._pending_request(head, host_info, client_reader)
+            in_flight.append(pending)
+            batch.append(pending.data)
+
+        return not batch or SocketManager.send_all(self.socks_socket, b''.join(batch))
+
+    def _relay_response(self, pending: PendingRequest, host_info: HostInfo,
+                        response_head: bytes, upstream_reader: SocketReader,
+                        keep_alive: bool) -> Tuple[bool, bool]:
+        """Relay one response to the client
+
+        Returns whether the client connection and the upstream connection can
+        each carry another exchange.
+        """
+        request_head = pending.head
+        while True:
+            try:
+                response = HTTPResponseHead.parse(response_head[:-4])
+            except ValueError as e:
+                logger.error(f"Invalid response from {host_info.host}:{host_info.port}: {e}")
+                return False, False
+
+            if not response.is_interim() or response.status == 101:
+                break
+
+            # Pass informational responses (e.g. 100 Continue) through and wait for the final one
+            if not SocketManager.send_all(self.client_socket, response_head, upstream_reader.timeout):
+                return False, False
+            response_head = upstream_reader.read_until(b'\r\n\r\n', self.settings.max_header_size)
+            if response_head is None:
+                return False, False
+
+        if pending.stale is not None and response.status == 304:
+            # The stored response is still valid: refresh it and serve its body
+            self.response_cache.refresh(pending.stale, response)
+            sent = self._serve_cached(request_head, pending.stale, keep_alive)
+            return sent and keep_alive, response.wants_keep_alive()
+
+        framing = response.body_framing(request_head.method)
+        # A close-delimited body can only be ended by closing the client connection
+        keep_alive = keep_alive and framing != BodyFraming.CLOSE
+        if not SocketManager.send_all(self.client_socket, response.to_client(keep_alive),
+                                      upstream_reader.timeout):
+            return False, False
+        writer = None
+        if pending.cache_key is not None:
+            writer = self.response_cache.begin(pending.cache_key, request_head, response)
+        shared = pending.shared if pending.shared is not None and pending.shared.publish(response) else None
+
+        def sink(data: bytes):
+            if writer:
+                writer.write(data)
+            if shared:
+                shared.append(data)
+
+        # Followers were already sent the head, so the body is finished for them if our client leaves
+        keep_reading = (lambda: shared.followers > 0 and not shared.failed) if shared else None
+        if not upstream_reader.relay_body(self.client_socket, framing, response.content_length() or 0,
+                                          sink if writer or shared else None, keep_reading):
+            if writer:
+                writer.abort()
+            return False, False
+        if writer:
+            writer.commit()
+        if shared:
+            shared.finish(True)
+        if upstream_reader.detached:
+            logger.info(f"Client left during a shared response from {host_info.host}:{host_info.port}; "
+                        f"finished it for {shared.followers} waiting clients")
+            return False, framing != BodyFraming.CLOSE and response.wants_keep_alive()
+
+        reusable = framing != BodyFraming.CLOSE and response.wants_keep_alive()
+        return keep_alive, reusable
+
     def _setup_forwarding(self):
         """Setup bidirectional data forwarding"""
+        if self.settings.use_splice():
+            relay_options = {'buffer_size': self.settings.buffer_size, 'use_splice': True}
+        else:
+            relay_options = {'buffer_pool': self.buffer_pool}
+        relay_options.update(budget=self.relay_budget, high_watermark=self.settings.relay_high_watermark,
+                             low_watermark=self.settings.relay_low_watermark)
+
         # Client to SOCKS
         client_to_socks = DataForwarder(
             self.client_socket, self.socks_socket,
-            "client->socks", stop_event=self.stop_event
+            "client->socks", stop_event=self.stop_event, on_data=self._received_up,
+            **relay_options
         )
 
         # SOCKS to client
         socks_to_client = DataForwarder(
             self.socks_socket, self.client_socket,
-            "socks->client", stop_event=self.stop_event
+            "socks->client", stop_event=self.stop_event, on_data=self._received_down,
+            **relay_options
         )
 
         self.forwarders = [client_to_socks, socks_to_client]
+        self.state = ConnectionState.TUNNEL
 
         # Start forwarding
         client_to_socks.start()
         socks_to_client.start()
 
+    def close(self):
+        """Abort the connection from another thread"""
+        self.stop_event.set()
+        for sock in (self.client_socket, self.socks_socket):
+            if sock is None:
+                continue
+            try:
+                # Wakes up the handler and forwarders blocked on the sockets
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
     def _cleanup(self):
         """Clean up resources"""
         self.stop_event.set()
+        self.state = ConnectionState.CLOSED
+        if self.shaper:
+            self.shaper.detach(self.client_address)
 
         if self.socks_socket:
             SocketManager.close(self.socks_socket)
@@ -361,55 +2304,397 @@ class ConnectionHandler:
         SocketManager.close(self.client_socket)
 
 
+class TunnelHold:
+    """Bounded wait for a tunnel that is down, typically while SSH reconnects
+
+    Held requests share one probe: the first waiter to find the last probe
+    older than probe_interval runs it, and a success wakes every waiter at
+    once so they all retry together.
+    """
+
+    def __init__(self, probe: Callable[[], bool], max_waiting: int = 256, timeout: float = 15.0,
+                 probe_interval: float = 0.25):
+        self.probe = probe
+        self.max_waiting = max_waiting
+        self.timeout = timeout
+        self.probe_interval = probe_interval
+        self._condition = threading.Condition()
+        self._waiting = 0
+        self._probing = False
+        self._last_probe = 0.0
+        self._recoveries = 0  # Successful probes; waiters resume once it moves past what they saw
+        self._closed = False
+        self.held = 0
+        self.resumed = 0
+        self.expired = 0
+        self.rejected = 0
+        self.replayed = 0  # Requests sent again after the tunnel dropped before their response
+        self.wait_time: Optional[Histogram] = None
+
+    def __len__(self) -> int:
+        return self._waiting
+
+    def deadline(self) -> float:
+        """Latest time a request arriving now may be held until"""
+        return time.monotonic() + self.timeout
+
+    def wait(self, stop_event: threading.Event, deadline: float) -> bool:
+        """Block until a probe sees the tunnel back; False if full, past deadline or stopped"""
+        started = time.monotonic()
+        with self._condition:
+            if self._waiting >= self.max_waiting:
+                self.rejected += 1
+                return False
+            self._waiting += 1
+            self.held += 1
+            seen = self._recoveries
+
+        resumed = False
+        try:
+            while True:
+                with self._condition:
+                    while True:
+                        now = time.monotonic()
+                        resumed = self._recoveries != seen
+                        if resumed or self._closed or stop_event.is_set() or now >= deadline:
+                            return resumed
+                        if not self._probing and now - self._last_probe >= self.probe_interval:
+                            self._probing = True
+                            break
+                        self._condition.wait(min(deadline - now, self.probe_interval))
+
+                up = False
+                try:
+                    up = self.probe()
+                finally:
+                    with self._condition:
+                        self._probing = False
+                        self._last_probe = time.monotonic()
+                        if up:
+                            self._recoveries += 1
+                        self._condition.notify_all()
+        finally:
+            with self._condition:
+                self._waiting -= 1
+                if resumed:
+                    self.resumed += 1
+                else:
+                    self.expired += 1
+            if self.wait_time:
+                self.wait_time.observe(time.monotonic() - started, 'resumed' if resumed else 'expired')
+
+    def count_replay(self):
+        with self._condition:
+            self.replayed += 1
+
+    def close(self):
+        """Release every held request"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+
+class ConnectionRegistry:
+    """Active connections of a proxy, with idle tunnels reaped from a deadline heap
+
+    Every connection has one heap entry. When it comes due, the reaper checks
+    the real last activity and either closes an idle tunnel or pushes a new
+    deadline, so relayed traffic never touches the heap.
+    """
+
+    def __init__(self, idle_timeout: float = 600.0):
+        self.idle_timeout = idle_timeout
+        self._connections: Dict[int, ConnectionHandler] = {}
+        self._deadlines: List[Tuple[float, int]] = []
+        self._condition = threading.Condition()
+        self._reaper: Optional[threading.Thread] = None
+        self._closed = False
+        self._next_id = 0
+        self.accepted = 0
+        self.reaped = 0
+        self.header_timeouts = 0
+        # Bytes of connections that already closed
+        self.closed_bytes_up = 0
+        self.closed_bytes_down = 0
+
+    def __len__(self) -> int:
+        return len(self._connections)
+
+    def add(self, handler: ConnectionHandler) -> bool:
+        """Register a new connection; False once the registry is closed"""
+        with self._condition:
+            if self._closed:
+                return False
+            self._next_id += 1
+            handler.connection_id = self._next_id
+            self._connections[handler.connection_id] = handler
+            self.accepted += 1
+            if self.idle_timeout > 0:
+                heapq.heappush(self._deadlines, (time.time() + self.idle_timeout, handler.connection_id))
+                if self._deadlines[0][1] == handler.connection_id:
+                    # The reaper sleeps without a bound while the heap is empty
+                    self._condition.notify()
+                if self._reaper is None:
+                    self._reaper = threading.Thread(target=self._reap_loop, daemon=True,
+                                                    name="Connection-reaper")
+                    self._reaper.start()
+            return True
+
+    def remove(self, handler: ConnectionHandler):
+        """Forget a finished connection and keep its byte counts; its deadline expires lazily"""
+        with self._condition:
+            if self._connections.pop(handler.connection_id, None) is not None:
+                self.closed_bytes_up += handler.counters.bytes_up
+                self.closed_bytes_down += handler.counters.bytes_down
+                self.header_timeouts += handler.timed_out
+
+    def handlers(self) -> List[ConnectionHandler]:
+        with self._condition:
+            return list(self._connections.values())
+
+    def byte_totals(self) -> Tuple[int, int]:
+        """Bytes up and down over closed and active connections"""
+        with self._condition:
+            bytes_up, bytes_down = self.closed_bytes_up, self.closed_bytes_down
+            for handler in self._connections.values():
+                bytes_up += handler.counters.bytes_up
+                bytes_down += handler.counters.bytes_down
+        return bytes_up, bytes_down
+
+    def _reap_loop(self):
+        while True:
+            idle = []
+            with self._condition:
+                while not self._closed:
+                    now = time.time()
+                    if self._deadlines and self._deadlines[0][0] <= now:
+                        break
+                    self._condition.wait(self._deadlines[0][0] - now if self._deadlines else None)
+                if self._closed:
+                    return
+
+                # Handle every entry that came due
+                while self._deadlines and self._deadlines[0][0] <= now:
+                    _, connection_id = heapq.heappop(self._deadlines)
+                    handler = self._connections.get(connection_id)
+                    if handler is None:
+                        continue
+                    last_activity = handler.counters.last_activity
+                    if handler.state == ConnectionState.TUNNEL and now - last_activity >= self.idle_timeout:
+                        idle.append(handler)
+                        continue
+                    next_check = last_activity if handler.state == ConnectionState.TUNNEL else now
+                    heapq.heappush(self._deadlines, (next_check + self.idle_timeout, connection_id))
+
+            for handler in idle:
+                logger.info(f"Closing tunnel {handler.counters.client} -> {handler.counters.target} "
+                            f"idle for {self.idle_timeout:.0f}s")
+                self.reaped += 1
+                handler.close()
+
+    def close(self):
+        """Close every connection and stop the reaper"""
+        with self._condition:
+            self._closed = True
+            handlers = list(self._connections.values())
+            self._condition.notify_all()
+        for handler in handlers:
+            handler.close()
+        if self._reaper is not None:
+            self._reaper.join(timeout=1.0)
+
+
+class AdmissionControl:
+    """Cap on concurrent connections with a bounded queue for the excess
+
+    Connections arriving when the queue is full, or waiting in it past the
+    timeout, are shed so that admitted clients keep predictable latency.
+    """
+
+    def __init__(self, max_active: int = 0, queue_size: int = 256, queue_timeout: float = 10.0):
+        self.max_active = max_active
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self._waiting: deque = deque()  # (deadline, handler) in arrival order
+        self._lock = threading.Lock()
+        self.active = 0
+        self.queued = 0
+        self.shed = 0
+        self.timed_out = 0
+
+    def __len__(self) -> int:
+        return len(self._waiting)
+
+    def admit(self, handler: ConnectionHandler) -> Optional[bool]:
+        """True to serve the handler now, False if it was queued, None to shed it"""
+        with self._lock:
+            if self.max_active <= 0 or self.active < self.max_active:
+                self.active += 1
+                return True
+            if len(self._waiting) < self.queue_size:
+                self._waiting.append((time.monotonic() + self.queue_timeout, handler))
+                self.queued += 1
+                return False
+            self.shed += 1
+            return None
+
+    def release(self) -> Optional[ConnectionHandler]:
+        """Free a slot, handing it to the longest waiting handler if there is one"""
+        with self._lock:
+            if self._waiting:
+                return self._waiting.popleft()[1]
+            self.active -= 1
+            return None
+
+    def expire(self) -> List[ConnectionHandler]:
+        """Remove and return the handlers that waited past the queue timeout"""
+        now = time.monotonic()
+        expired = []
+        with self._lock:
+            while self._waiting and self._waiting[0][0] <= now:
+                expired.append(self._waiting.popleft()[1])
+            self.timed_out += len(expired)
+        return expired
+
+    def close(self) -> List[ConnectionHandler]:
+        """Remove and return every waiting handler"""
+        with self._lock:
+            waiting = [handler for _, handler in self._waiting]
+            self._waiting.clear()
+        return waiting
+
+
 class SOCKStoHTTPProxy:
     """Main proxy server class"""
 
     def __init__(self, socks_host='localhost', socks_port=1080,
-                 http_host='localhost', http_port=8080):
+                 http_host='localhost', http_port=8080,
+                 settings: Optional[ProxySettings] = None,
+                 open_channel: Optional[Callable[[str, int, float], socket.socket]] = None,
+                 channel_ready: Optional[Callable[[], bool]] = None):
         self.socks_host = socks_host
         self.socks_port = socks_port
         self.http_host = http_host
         self.http_port = http_port
+        self.settings = settings or ProxySettings()
+        if self.settings.relay_mode == 'splice' and not SPLICE_SUPPORTED:
+            logger.warning("splice relay mode is not supported on this platform, using copy mode")
         self.server_socket = None
         self.stop_event = threading.Event()
-        self.active_connections = set()
-        self.connections_lock = threading.Lock()
-        self.socks_client = SOCKS5Client(socks_host, socks_port)
+        self.connections = ConnectionRegistry(self.settings.tunnel_idle_timeout)
+        self.admission = AdmissionControl(self.settings.max_connections, self.settings.admission_queue_size,
+                                          self.settings.admission_queue_timeout)
+        if open_channel is not None:
+            # Tunnels go straight into channels of an SSH connection in this process
+            self.socks_client = ChannelClient(open_channel, self.settings.connect_timeout,
+                                              self.settings.negative_cache_ttl,
+                                              self.settings.negative_cache_size, channel_ready)
+        else:
+            self.socks_client = SOCKS5Client(socks_host, socks_port, self.settings.socks_pool_size,
+                                             self.settings.socks_pool_max_age,
+                                             self.settings.socks_optimistic,
+                                             self.settings.negative_cache_ttl,
+                                             self.settings.negative_cache_size)
+        self.upstream_pool = None
+        if self.settings.upstream_pool_size > 0:
+            self.upstream_pool = UpstreamPool(self.settings.upstream_pool_size,
+                                              self.settings.upstream_pool_total,
+                                              self.settings.upstream_idle_timeout)
+        self.buffer_pool = BufferPool(self.settings.buffer_size, self.settings.buffer_pool_size)
+        self.response_cache = None
+        if self.settings.cache_memory_size > 0 or self.settings.cache_dir:
+            self.response_cache = ResponseCache(self.settings.cache_memory_size, self.settings.cache_dir,
+                                                self.settings.cache_disk_size,
+                                                self.settings.cache_max_object_size,
+                                                self.settings.cache_mmap_threshold)
+        self.coalescer = None
+        if self.settings.collapsed_forwarding:
+            self.coalescer = FetchCoalescer(self.settings.collapsed_max_size)
+        # Always present so that limits and rules can be changed while running
+        self.shaper = BandwidthShaper(self.settings.listener_rate, self.settings.client_rate,
+                                      self.settings.shaping_quantum)
+        self.relay_budget = RelayBudget(self.settings.relay_budget)
+        self.tunnel_hold = None
+        if self.settings.tunnel_hold_timeout > 0:
+            self.tunnel_hold = TunnelHold(self.socks_client.probe, self.settings.tunnel_hold_queue,
+                                          self.settings.tunnel_hold_timeout, self.settings.tunnel_probe_interval)
+        self.rules = RuleEngine(RuleSet.from_file(self.settings.rules_file) if self.settings.rules_file else None)
+        self.blocklist: Optional[Blocklist] = None
+        if self.settings.blocklist_files:
+            self.blocklist = Blocklist.from_files(self.settings.blocklist_files, self.settings.blocklist_cache)
+        self.instruments: Optional[ProxyInstruments] = None
+        self.metrics: Optional[MetricsRegistry] = None
+        self.metrics_server: Optional[MetricsServer] = None
+        if self.settings.metrics_port:
+            self.metrics = MetricsRegistry()
+            self.register_metrics(self.metrics)
 
         # Setup signal handlers for graceful shutdown
         signal.signal(signal.SIGINT, self._signal_handler)
         signal.signal(signal.SIGTERM, self._signal_handler)
+        if (self.settings.rules_file or self.settings.blocklist_files) and hasattr(signal, 'SIGHUP'):
+            signal.signal(signal.SIGHUP, self._reload_rules)
 
     def _signal_handler(self, sig, frame):
         """Handle termination signals"""
         logger.info(f"Received signal {sig}, shutting down...")
         self.stop()
 
+    def register_metrics(self, registry: MetricsRegistry):
+        """Publish the proxy counters and latency histograms in registry"""
+        self.instruments = ProxyInstruments.register(registry)
+        self.socks_client.handshake_latency = self.instruments.handshake_latency
+        if self.tunnel_hold is not None:
+            self.tunnel_hold.wait_time = self.instruments.tunnel_wait
+        registry.register_collector(lambda: stats_metrics(self.stats()))
+
+    def _reload_rules(self, sig, frame):
+        """Recompile the routing rules file and the blocklists and swap them in"""
+        if self.settings.rules_file:
+            try:
+                self.rules.load(self.settings.rules_file)
+            except (OSError, ValueError) as e:
+                logger.error(f"Keeping the current routing rules: {e}")
+        if self.settings.blocklist_files:
+            try:
+                blocklist = Blocklist.from_files(self.settings.blocklist_files, self.settings.blocklist_cache)
+            except OSError as e:
+                logger.error(f"Keeping the current blocklist: {e}")
+                return
+            # New connections pick up the new lists; the running total carries over
+            blocklist.hits = self.blocklist.hits
+            self.blocklist = blocklist
+
     def start(self):
         """Start the proxy server"""
         try:
             # Initialize server socket
             self._init_server_socket()
+            if self.metrics is not None:
+                self.metrics_server = MetricsServer(self.metrics, self.settings.metrics_host,
+                                                    self.settings.metrics_port)
+                self.metrics_server.start()
 
             # Main accept loop
             while not self.stop_event.is_set():
                 try:
+                    self._shed_expired()
+
                     # Accept with timeout to allow checking stop_event
                     client_socket, client_addr = self.server_socket.accept()
                     logger.debug(f"New connection from {client_addr}")
 
-                    # Register connection
-                    with self.connections_lock:
-                        self.active_connections.add(client_socket)
-
-                    # Handle in a separate thread
-                    handler = ConnectionHandler(client_socket, self.socks_client)
-                    thread = threading.Thread(
-                        target=handler.handle,
-                        daemon=True,
-                        name=f"Handler-{client_addr[0]}:{client_addr[1]}"
-                    )
-                    thread.start()
+                    handler = ConnectionHandler(client_socket, self.socks_client, self.settings,
+                                                self.upstream_pool, self.buffer_pool,
+                                                self.response_cache, self.coalescer, self.shaper,
+                                                self.rules, self.instruments, self.relay_budget,
+                                                self.tunnel_hold, self.blocklist)
+                    admitted = self.admission.admit(handler)
+                    if admitted is None:
+                        logger.warning(f"Shedding connection from {handler.counters.client}: queue is full")
+                        handler.shed(self.settings.shed_retry_after)
+                    elif admitted and not self._start_handler(handler):
+                        break
 
                 except socket.timeout:
                     # This is expected due to the timeout we set
@@ -427,21 +2712,66 @@ class SOCKStoHTTPProxy:
         finally:
             self.stop()
 
+    def _start_handler(self, handler: ConnectionHandler) -> bool:
+        """Register the connection and serve it in its own thread"""
+        if not self.connections.add(handler):
+            # stop() already closed the registered connections
+            SocketManager.close(handler.client_socket)
+            return False
+        thread = threading.Thread(
+            target=self._run_handler,
+            args=(handler,),
+            daemon=True,
+            name=f"Handler-{handler.counters.client}"
+        )
+        thread.start()
+        return True
+
+    def _run_handler(self, handler: ConnectionHandler):
+        """Serve one connection, unregister it and pass its slot on"""
+        try:
+            handler.handle()
+        finally:
+            self.connections.remove(handler)
+            self._shed_expired()
+            waiting = self.admission.release()
+            if waiting is not None:
+                self._start_handler(waiting)
+
+    def _shed_expired(self):
+        """Answer 503 to queued connections that waited too long for a slot"""
+        for handler in self.admission.expire():
+            logger.warning(f"Shedding connection from {handler.counters.client}: no slot within "
+                           f"{self.settings.admission_queue_timeout:.0f}s")
+            handler.shed(self.settings.shed_retry_after)
+
     def _init_server_socket(self):
         """Initialize the server socket"""
         try:
             self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if self.settings.reuse_port:
+                if not REUSEPORT_SUPPORTED:
+                    raise ProxyError("SO_REUSEPORT is not supported on this platform")
+                self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
 
             # Set timeout for accept() to allow checking stop_event periodically
             self.server_socket.settimeout(1.0)
 
             # Bind and listen
             self.server_socket.bind((self.http_host, self.http_port))
-            self.server_socket.listen(10)  # Increased backlog
+            self.server_socket.listen(self.settings.backlog)
 
-            logger.info(f"HTTP Proxy started at {self.http_host}:{self.http_port}")
-            logger.info(f"Forwarding to SOCKS proxy at {self.socks_host}:{self.socks_port}")
+            if self.settings.transparent:
+                if not TRANSPARENT_SUPPORTED:
+                    raise ProxyError("Transparent mode needs SO_ORIGINAL_DST, which is Linux-only")
+                logger.info(f"Transparent proxy started at {self.http_host}:{self.http_port}")
+            else:
+                logger.info(f"HTTP Proxy started at {self.http_host}:{self.http_port}")
+            if isinstance(self.socks_client, ChannelClient):
+                logger.info("Forwarding through SSH channels opened in this process")
+            else:
+                logger.info(f"Forwarding to SOCKS proxy at {self.socks_host}:{self.socks_port}")
 
         except Exception as e:
             logger.error(f"Failed to initialize HTTP proxy: {e}")
@@ -458,11 +2788,22 @@ class SOCKStoHTTPProxy:
         self.stop_event.set()
         logger.info("Stopping proxy server...")
 
-        # Close all active connections
-        with self.connections_lock:
-            for sock in self.active_connections:
-                SocketManager.close(sock)
-            self.active_connections.clear()
+        # Close all active and queued connections
+        self.shaper.close()
+        self.relay_budget.close()
+        if self.tunnel_hold is not None:
+            self.tunnel_hold.close()
+        self.connections.close()
+        for handler in self.admission.close():
+            SocketManager.close(handler.client_socket)
+
+        if self.upstream_pool:
+            self.upstream_pool.close()
+        if self.response_cache:
+            self.response_cache.close()
+        self.socks_client.close()
+        if self.metrics_server:
+            self.metrics_server.stop()
 
         # Close server socket
         if self.server_socket:
@@ -471,22 +2812,600 @@ class SOCKStoHTTPProxy:
 
         logger.info("Proxy server stopped")
 
+    def stats(self) -> Dict[str, int]:
+        """Return a snapshot of the proxy counters"""
+        bytes_up, bytes_down = self.connections.byte_totals()
+        stats = {
+            'connections_accepted': self.connections.accepted,
+            'connections_active': len(self.connections),
+            'connections_reaped': self.connections.reaped,
+            'connections_waiting': len(self.admission),
+            'connections_queued': self.admission.queued,
+            'connections_shed': self.admission.shed,
+            'queue_timeouts': self.admission.timed_out,
+            'header_timeouts': self.connections.header_timeouts,
+            'bytes_up': bytes_up,
+            'bytes_down': bytes_down,
+        }
+        if self.upstream_pool:
+            stats['upstream_pool_hits'] = self.upstream_pool.hits
+            stats['upstream_pool_misses'] = self.upstream_pool.misses
+        stats['socks_pool_hits'] = self.socks_client.pool_hits
+        stats['socks_pool_misses'] = self.socks_client.pool_misses
+        negative_cache = self.socks_client.negative_cache
+        if negative_cache is not None:
+            stats['negative_cache_hits'] = negative_cache.hits
+            stats['negative_cache_entries'] = len(negative_cache)
+        stats.update(self.buffer_pool.stats())
+        stats.update(self.relay_budget.stats())
+        if self.tunnel_hold is not None:
+            stats['tunnel_waiting'] = len(self.tunnel_hold)
+            stats['tunnel_holds'] = self.tunnel_hold.held
+            stats['tunnel_hold_resumed'] = self.tunnel_hold.resumed
+            stats['tunnel_hold_expired'] = self.tunnel_hold.expired
+            stats['tunnel_hold_rejected'] = self.tunnel_hold.rejected
+            stats['requests_replayed'] = self.tunnel_hold.replayed
+        for rule in self.rules.report():
+            stats[f"{RULE_HITS_STAT}{rule['action']}:{rule['pattern'] or 'default'}"] = rule['hits']
+        if self.blocklist is not None:
+            stats['requests_blocked'] = self.blocklist.hits
+            stats['blocklist_entries'] = len(self.blocklist)
+        if self.response_cache:
+            stats.update(self.response_cache.stats())
+        if self.coalescer:
+            stats.update(self.coalescer.stats())
+        return stats
+
+    def traffic_snapshot(self) -> List[dict]:
+        """Return the state and byte counters of every active connection"""
+        return [dict(asdict(handler.counters), id=handler.connection_id, state=handler.state.value)
+                for handler in self.connections.handlers()]
+
+    def bandwidth_report(self) -> Dict[str, Dict[str, float]]:
+        """Return the bandwidth limits and consumption of every known client address"""
+        return self.shaper.report()
+
+
+def _run_worker(index: int, socks_host: str, socks_port: int, http_host: str, http_port: int,
+                settings: ProxySettings, stats_queue, stats_interval: float):
+    """Worker process body: serve the shared port and report stats to the supervisor"""
+    if settings.cache_dir:
+        # Each worker owns its cache index and body files
+        settings = replace(settings, cache_dir=os.path.join(settings.cache_dir, f"worker-{index}"))
+    proxy = SOCKStoHTTPProxy(socks_host, socks_port, http_host, http_port, settings)
+    # Ctrl-C reaches the whole process group; the supervisor decides when workers stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    def report():
+        while not proxy.stop_event.wait(stats_interval):
+            stats_queue.put((index, os.getpid(), proxy.stats()))
+
+    reporter = threading.Thread(target=report, daemon=True, name="Worker-stats")
+    reporter.start()
+    try:
+        proxy.start()
+    finally:
+        reporter.join(timeout=1.0)
+        stats_queue.put((index, os.getpid(), proxy.stats()))
+
+
+class ProxySupervisor:
+    """Run the threaded proxy in several worker processes sharing one port"""
+
+    # Point-in-time values that must not outlive the worker reporting them
+    GAUGES = GAUGE_STATS
+
+    def __init__(self, socks_host='localhost', socks_port=1080,
+                 http_host='localhost', http_port=8080,
+                 settings: Optional[ProxySettings] = None, stats_interval: float = 1.0):
+        self.socks_host = socks_host
+        self.socks_port = socks_port
+        self.http_host = http_host
+        self.http_port = http_port
+        self.settings = settings or ProxySettings()
+        self.stats_interval = stats_interval
+        self.workers = max(1, self.settings.workers)
+        if self.workers > 1 and not REUSEPORT_SUPPORTED:
+            logger.warning("SO_REUSEPORT is not supported on this platform, running one worker")
+            self.workers = 1
+        # The supervisor serves metrics for all workers, so they must not bind the port themselves
+        self.metrics_port = self.settings.metrics_port
+        self.settings = replace(self.settings, reuse_port=self.workers > 1, metrics_port=0)
+
+        # Fork keeps worker start cheap; spawn is the only choice on Windows
+        method = 'fork' if 'fork' in multiprocessing.get_all_start_methods() else 'spawn'
+        self._context = multiprocessing.get_context(method)
+        self._stats_queue = self._context.Queue()
+        self.processes: List[Optional[multiprocessing.Process]] = [None] * self.workers
+        self._started_at = [0.0] * self.workers
+        self._restart_at = [0.0] * self.workers
+        self._backoff = [0.0] * self.workers
+        self.restarts = 0
+
+        # Latest snapshot per live worker plus the final counters of exited workers
+        self.worker_stats: Dict[int, Dict[str, int]] = {}
+        self._worker_pids: Dict[int, int] = {}
+        self._retired: Dict[str, int] = {}
+        self.stats_lock = threading.Lock()
+        self.stop_event = threading.Event()
+
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGINT, self._signal_handler)
+            signal.signal(signal.SIGTERM, self._signal_handler)
+
+    def _signal_handler(self, sig, frame):
+        """Handle termination signals"""
+        logger.info(f"Received signal {sig}, stopping workers...")
+        self.stop()
+
+    def start(self):
+        """Start the workers and supervise them until stop() is called"""
+        logger.info(f"Starting {self.workers} proxy workers on {self.http_host}:{self.http_port}")
+        metrics_server = None
+        if self.metrics_port:
+            registry = MetricsRegistry()
+            registry.register_collector(lambda: stats_metrics(self.stats()))
+            metrics_server = MetricsServer(registry, self.settings.metrics_host, self.metrics_port)
+            metrics_server.start()
+        try:
+            for index in range(self.workers):
+                self._spawn(index)
+            while not self.stop_event.wait(0.2):
+                self._collect_stats()
+                self._check_workers()
+        finally:
+            if metrics_server:
+                metrics_server.stop()
+            self._shutdown_workers()
+
+    def _spawn(self, index: int):
+        """Start the worker process for one slot"""
+        process = self._context.Process(
+            target=_run_worker,
+            args=(index, self.socks_host, self.socks_port, self.http_host, self.http_port,
+                  self.settings, self._stats_queue, self.stats_interval),
+            name=f"ProxyWorker-{index}",
+            daemon=True
+        )
+        process.start()
+        self.processes[index] = process
+        self._started_at[index] = time.monotonic()
+        logger.debug(f"Worker {index} started with pid {process.pid}")
+
+    def _check_workers(self):
+        """Restart exited workers, backing off if they keep crashing on start"""
+        now = time.monotonic()
+        for index, process in enumerate(self.processes):
+            if process is not None:
+                if process.is_alive():
+                    continue
+                logger.warning(f"Worker {index} (pid {process.pid}) exited with code {process.exitcode}")
+                process.join()
+                self.processes[index] = None
+                self._retire(index)
+                # A worker that dies within seconds of starting is likely to do so again
+                if now - self._started_at[index] < 5.0:
+                    self._backoff[index] = min(max(self._backoff[index] * 2, 0.5), 30.0)
+                else:
+                    self._backoff[index] = 0.0
+                self._restart_at[index] = now + self._backoff[index]
+            if now >= self._restart_at[index]:
+                self.restarts += 1
+                self._spawn(index)
+
+    def _collect_stats(self):
+        """Drain worker stat reports"""
+        while True:
+            try:
+                index, pid, stats = self._stats_queue.get_nowait()
+            except queue.Empty:
+                return
+            with self.stats_lock:
+                if self._worker_pids.get(index, pid) != pid:
+                    # Late report from a replaced worker: only its final counters matter
+                    continue
+                self._worker_pids[index] = pid
+                self.worker_stats[index] = stats
+
+    def _retire(self, index: int):
+        """Fold the last counters of an exited worker into the running totals"""
+        self._collect_stats()
+        with self.stats_lock:
+            stats = self.worker_stats.pop(index, {})
+            self._worker_pids.pop(index, None)
+            for key, value in stats.items():
+                if key not in self.GAUGES:
+                    self._retired[key] = self._retired.get(key, 0) + value
+
+    def stats(self) -> Dict[str, int]:
+        """Return counters summed over all workers, including exited ones"""
+        self._collect_stats()
+        with self.stats_lock:
+            totals = dict(self._retired)
+            for stats in self.worker_stats.values():
+                for key, value in stats.items():
+                    totals[key] = totals.get(key, 0) + value
+        totals['workers_alive'] = sum(1 for p in self.processes if p is not None and p.is_alive())
+        totals['worker_restarts'] = self.restarts
+        return totals
+
+    def _shutdown_workers(self):
+        """Ask every worker to stop, killing those that do not exit in time"""
+        for process in self.processes:
+            if process is not None and process.is_alive():
+                process.terminate()
+        deadline = time.monotonic() + 5.0
+        for index, process in enumerate(self.processes):
+            if process is None:
+                continue
+            # Keep draining so workers are not blocked flushing their final report
+            while process.is_alive() and time.monotonic() < deadline:
+                self._collect_stats()
+                process.join(timeout=0.1)
+            if process.is_alive():
+                process.kill()
+                process.join()
+            self._retire(index)
+            self.processes[index] = None
+        logger.info("Proxy workers stopped")
+
+    def stop(self):
+        """Stop supervising; start() terminates the workers on its way out"""
+        self.stop_event.set()
+
+
+class AsyncSOCKS5Client:
+    """Asyncio SOCKS5 client for connecting to target hosts"""
+
+    def __init__(self, socks_host: str, socks_port: int, connect_timeout: float = 5.0):
+        self.socks_host = socks_host
+        self.socks_port = socks_port
+        self.connect_timeout = connect_timeout
+
+    async def connect(self, target_host: str,
+                      target_port: int) -> Optional[Tuple[asyncio.StreamReader, asyncio.StreamWriter]]:
+        """Establish a stream pair to the target host through SOCKS5 proxy"""
+        writer = None
+        try:
+            try:
+                reader, writer = await asyncio.wait_for(
+                    asyncio.open_connection(self.socks_host, self.socks_port),
+                    timeout=self.connect_timeout
+                )
+            except ConnectionRefusedError:
+                raise ConnectionError(f"SOCKS server refused connection at {self.socks_host}:{self.socks_port}")
+            except asyncio.TimeoutError:
+                raise ConnectionError("Timeout connecting to SOCKS server")
+
+            await asyncio.wait_for(
+                self._negotiate(reader, writer, target_host, target_port),
+                timeout=self.connect_timeout
+            )
+            return reader, writer
+
+        except Exception as e:
+            logger.error(f"SOCKS connection error: {e}")
+            if writer:
+                writer.close()
+            return None
+
+    @staticmethod
+    async def _negotiate(reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                         host: str, port: int) -> None:
+        """Perform the SOCKS5 handshake and CONNECT request"""
+        writer.write(bytes([SOCKSVersion.SOCKS5.value, 1, 0]))
+        await writer.drain()
+
+        response = await reader.readexactly(2)
+        if response[0] != SOCKSVersion.SOCKS5.value or response[1] != SOCKSResponse.SUCCESS.value:
+            raise ProtocolError("SOCKS5 handshake failed")
+
+        writer.write(bytes([
+            SOCKSVersion.SOCKS5.value,
+            SOCKSCommand.CONNECT.value,
+            0,  # Reserved
+        ]) + socks_address(host) + port.to_bytes(2, 'big'))
+        await writer.drain()
+
+        # VER | REP | RSV | ATYP, followed by BND.ADDR and BND.PORT
+        reply = await reader.readexactly(4)
+        if reply[0] != SOCKSVersion.SOCKS5.value or reply[1] != SOCKSResponse.SUCCESS.value:
+            raise ProtocolError("SOCKS5 connection establishment failed")
+
+        if reply[3] == AddressType.IPV4.value:
+            await reader.readexactly(4 + 2)
+        elif reply[3] == AddressType.IPV6.value:
+            await reader.readexactly(16 + 2)
+        elif reply[3] == AddressType.DOMAIN.value:
+            length = await reader.readexactly(1)
+            await reader.readexactly(length[0] + 2)
+        else:
+            raise ProtocolError(f"Unsupported SOCKS5 address type: {reply[3]}")
+
+
+class AsyncConnectionHandler:
+    """Handles a client connection on the asyncio engine"""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                 socks_client: AsyncSOCKS5Client, settings: ProxySettings):
+        self.client_reader = reader
+        self.client_writer = writer
+        self.socks_client = socks_client
+        self.settings = settings
+
+    async def handle(self):
+        """Process the client connection"""
+        socks_writer = None
+        try:
+            try:
+                request = await asyncio.wait_for(
+                    self.client_reader.readuntil(b'\r\n\r\n'),
+                    timeout=self.settings.header_timeout
+                )
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError):
+                logger.error("Empty request received")
+                return
+
+            host_info = ConnectionHandler._parse_request(request)
+            if not host_info:
+                return
+
+            streams = await self.socks_client.connect(host_info.host, host_info.port)
+            if not streams:
+                logger.error(f"Failed to connect to {host_info.host}:{host_info.port} via SOCKS")
+                return
+            socks_reader, socks_writer = streams
+
+            if request.startswith(b'CONNECT'):
+                self.client_writer.write(b'HTTP/1.1 200 Connection Established\r\n\r\n')
+            else:
+                socks_writer.write(request)
+
+            await self._relay(socks_reader, socks_writer)
+
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error handling client connection: {e}")
+        finally:
+            if socks_writer:
+                socks_writer.close()
+            self.client_writer.close()
+
+    async def _relay(self, socks_reader: asyncio.StreamReader, socks_writer: asyncio.StreamWriter):
+        """Relay data in both directions until either side closes"""
+        tasks = [
+            asyncio.ensure_future(self._pipe(self.client_reader, socks_writer)),
+            asyncio.ensure_future(self._pipe(socks_reader, self.client_writer)),
+        ]
+        try:
+            await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
 
-async def async_main():
-    """Async entry point for future async implementation"""
-    # This function is a placeholder for future async implementation
-    # Currently it just runs the synchronous proxy
-    proxy = SOCKStoHTTPProxy()
+    async def _pipe(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Copy data from reader to writer, honouring transport flow control"""
+        try:
+            while True:
+                data = await reader.read(self.settings.buffer_size)
+                if not data:
+                    break  # Connection closed
+                writer.write(data)
+                await writer.drain()
+        except (ConnectionError, OSError) as e:
+            logger.debug(f"Error in async forwarding: {e}")
 
-    # Run in a thread pool
-    loop = asyncio.get_running_loop()
-    await loop.run_in_executor(None, proxy.start)
+
+class AsyncSOCKStoHTTPProxy:
+    """Asyncio proxy server: one task per connection instead of three threads"""
+
+    def __init__(self, socks_host='localhost', socks_port=1080,
+                 http_host='localhost', http_port=8080,
+                 settings: Optional[ProxySettings] = None):
+        self.socks_host = socks_host
+        self.socks_port = socks_port
+        self.http_host = http_host
+        self.http_port = http_port
+        self.settings = settings or ProxySettings()
+        self.socks_client = AsyncSOCKS5Client(socks_host, socks_port, self.settings.connect_timeout)
+        self.active_tasks = set()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stop_event: Optional[asyncio.Event] = None
+        self._stopped = threading.Event()
+
+        # Setup signal handlers for graceful shutdown
+        signal.signal(signal.SIGINT, self._signal_handler)
+        signal.signal(signal.SIGTERM, self._signal_handler)
+
+    def _signal_handler(self, sig, frame):
+        """Handle termination signals"""
+        logger.info(f"Received signal {sig}, shutting down...")
+        self.stop()
+
+    def start(self):
+        """Start the proxy server and block until it is stopped"""
+        try:
+            asyncio.run(self.serve())
+        except Exception as e:
+            logger.error(f"Server error: {e}")
+
+    async def serve(self):
+        """Run the accept loop until stop() is called"""
+        self._loop = asyncio.get_running_loop()
+        self._stop_event = asyncio.Event()
+        if self._stopped.is_set():
+            return
+
+        _raise_nofile_limit()
+        server = await asyncio.start_server(
+            self._on_client, self.http_host, self.http_port,
+            backlog=self.settings.backlog,
+            limit=self.settings.max_header_size,
+            reuse_address=True
+        )
+        logger.info(f"HTTP Proxy (asyncio) started at {self.http_host}:{self.http_port}")
+        logger.info(f"Forwarding to SOCKS proxy at {self.socks_host}:{self.socks_port}")
+
+        try:
+            async with server:
+                await self._stop_event.wait()
+        finally:
+            for task in list(self.active_tasks):
+                task.cancel()
+            await asyncio.gather(*self.active_tasks, return_exceptions=True)
+            logger.info("Proxy server stopped")
+
+    async def _on_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Serve a newly accepted client connection"""
+        task = asyncio.current_task()
+        self.active_tasks.add(task)
+        try:
+            logger.debug(f"New connection from {writer.get_extra_info('peername')}")
+            handler = AsyncConnectionHandler(reader, writer, self.socks_client, self.settings)
+            await handler.handle()
+        finally:
+            self.active_tasks.discard(task)
+
+    def stop(self):
+        """Stop the proxy server; safe to call from any thread"""
+        if self._stopped.is_set():
+            return  # Already stopping
+
+        self._stopped.set()
+        logger.info("Stopping proxy server...")
+        if self._loop and self._stop_event:
+            try:
+                self._loop.call_soon_threadsafe(self._stop_event.set)
+            except RuntimeError:
+                pass  # Event loop already closed
+
+
+def _raise_nofile_limit():
+    """Raise the soft open-files limit so thousands of tunnels fit in one process"""
+    if resource is None:
+        return
+    try:
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if hard == resource.RLIM_INFINITY or soft < hard:
+            target = hard if hard != resource.RLIM_INFINITY else max(soft, 65536)
+            resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+    except (ValueError, OSError) as e:
+        logger.debug(f"Could not raise open-files limit: {e}")
+
+
+async def async_main(socks_host='localhost', socks_port=1080, http_host='localhost', http_port=8080):
+    """Async entry point running the asyncio engine"""
+    proxy = AsyncSOCKStoHTTPProxy(socks_host, socks_port, http_host, http_port)
+    await proxy.serve()
+
+
+# Options only the threaded engine implements, by destination, with the flag setting them
+THREADED_ONLY_OPTIONS = {
+    'relay_mode': '--relay-mode', 'socks_pool_size': '--socks-pool-size', 'workers': '--workers',
+    'cache_memory_size': '--cache-memory-size', 'cache_dir': '--cache-dir',
+    'collapsed_forwarding': '--collapsed-forwarding', 'tunnel_idle_timeout': '--tunnel-idle-timeout',
+    'max_connections': '--max-connections', 'listener_rate': '--listener-rate', 'client_rate': '--client-rate',
+    'relay_budget': '--relay-budget', 'tunnel_hold_timeout': '--tunnel-hold-timeout',
+    'rules_file': '--rules-file', 'blocklist': '--blocklist', 'blocklist_cache': '--blocklist-cache',
+    'metrics_port': '--metrics-port', 'negative_cache_ttl': '--negative-cache-ttl',
+    'transparent': '--transparent', 'socks_optimistic': '--no-socks-optimistic',
+}
+
+
+def parse_args(argv: Optional[List[str]] = None):
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description='HTTP proxy forwarding to a SOCKS5 proxy')
+    parser.add_argument('--engine', choices=['threaded', 'asyncio'], default='threaded',
+                        help='Connection handling engine (default: threaded)')
+    parser.add_argument('--socks-host', default='localhost')
+    parser.add_argument('--socks-port', type=int, default=1080)
+    parser.add_argument('--http-host', default='localhost')
+    parser.add_argument('--http-port', type=int, default=8080)
+    parser.add_argument('--relay-mode', choices=['auto', 'splice', 'copy'], default='auto',
+                        help='Threaded engine relay: zero-copy splice (Linux) or user-space copy')
+    parser.add_argument('--socks-pool-size', type=int, default=0,
+                        help='Pre-negotiated SOCKS connections kept ready (threaded engine)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Threaded engine processes sharing the HTTP port via SO_REUSEPORT')
+    parser.add_argument('--backlog', type=int, default=1024,
+                        help='Listen backlog of the HTTP socket')
+    parser.add_argument('--cache-memory-size', type=int, default=0,
+                        help='Bytes of cached HTTP responses kept in memory '
+                             '(threaded engine; 0 disables the memory cache)')
+    parser.add_argument('--cache-dir', default=None,
+                        help='Directory persisting the HTTP response cache (threaded engine)')
+    parser.add_argument('--collapsed-forwarding', action='store_true',
+                        help='Share one upstream fetch between identical concurrent GET requests '
+                             '(threaded engine)')
+    parser.add_argument('--tunnel-idle-timeout', type=float, default=600.0,
+                        help='Seconds a tunnel may stay silent before it is closed (threaded engine; 0 disables)')
+    parser.add_argument('--max-connections', type=int, default=0,
+                        help='Connections served at once by the threaded engine; 0 means unlimited')
+    parser.add_argument('--listener-rate', type=int, default=0,
+                        help='Bytes per second relayed by the threaded engine; 0 means unlimited')
+    parser.add_argument('--client-rate', type=int, default=0,
+                        help='Bytes per second relayed for each client address; 0 means unlimited')
+    parser.add_argument('--relay-budget', type=int, default=256 * 1024 * 1024,
+                        help='Bytes read and not yet sent across all threaded tunnels before reading pauses; '
+                             '0 means unlimited')
+    parser.add_argument('--tunnel-hold-timeout', type=float, default=0.0,
+                        help='Seconds new CONNECT and idempotent requests wait for a tunnel that is down '
+                             '(e.g. SSH reconnecting) before failing (threaded engine); 0 fails them at once')
+    parser.add_argument('--rules-file', default=None,
+                        help='Routing rules sending destinations through the tunnel, direct or rejecting them; '
+                             'reloaded on SIGHUP (threaded engine)')
+    parser.add_argument('--blocklist', action='append', default=[], metavar='FILE',
+                        help='Hosts-file or Adblock domain list whose destinations are answered locally '
+                             '(403 for CONNECT, empty 204 otherwise); repeatable, reloaded on SIGHUP '
+                             '(threaded engine)')
+    parser.add_argument('--blocklist-cache', default=None, metavar='FILE',
+                        help='Compiled copy of the blocklists, reused at startup while they are unchanged '
+                             '(threaded engine)')
+    parser.add_argument('--metrics-port', type=int, default=0,
+                        help='Serve Prometheus metrics of the threaded engine on this port at /metrics')
+    parser.add_argument('--negative-cache-ttl', type=float, default=5.0,
+                        help='Seconds to answer destinations the SOCKS server reported unreachable '
+                             'without asking it again (threaded engine; 0 disables)')
+    parser.add_argument('--transparent', action='store_true',
+                        help='Relay iptables-REDIRECTed TCP connections to their original destination '
+                             'instead of serving HTTP (threaded engine, Linux only)')
+    parser.add_argument('--no-socks-optimistic', dest='socks_optimistic', action='store_false',
+                        help='Wait for the SOCKS method reply before sending CONNECT (threaded engine)')
+    args = parser.parse_args(argv)
+    if args.engine == 'asyncio':
+        # Refuse rather than ignore them, so nothing the user asked for silently goes missing
+        unsupported = [flag for dest, flag in THREADED_ONLY_OPTIONS.items()
+                       if getattr(args, dest) != parser.get_default(dest)]
+        if unsupported:
+            parser.error(f"the asyncio engine does not support {', '.join(unsupported)}")
+    return args
 
 
 def main():
     """Main entry point"""
+    args = parse_args()
+    if args.engine == 'asyncio':
+        proxy_class = AsyncSOCKStoHTTPProxy
+    else:
+        proxy_class = ProxySupervisor if args.workers > 1 else SOCKStoHTTPProxy
+    settings = ProxySettings(relay_mode=args.relay_mode, socks_pool_size=args.socks_pool_size,
+                             socks_optimistic=args.socks_optimistic, workers=args.workers,
+                             backlog=args.backlog, cache_memory_size=args.cache_memory_size,
+                             cache_dir=args.cache_dir, collapsed_forwarding=args.collapsed_forwarding,
+                             tunnel_idle_timeout=args.tunnel_idle_timeout,
+                             max_connections=args.max_connections, listener_rate=args.listener_rate,
+                             client_rate=args.client_rate, relay_budget=args.relay_budget,
+                             tunnel_hold_timeout=args.tunnel_hold_timeout,
+                             rules_file=args.rules_file, blocklist_files=tuple(args.blocklist),
+                             blocklist_cache=args.blocklist_cache,
+                             metrics_port=args.metrics_port, negative_cache_ttl=args.negative_cache_ttl,
+                             transparent=args.transparent)
     try:
-        proxy = SOCKStoHTTPProxy()
+        proxy = proxy_class(socks_host=args.socks_host, socks_port=args.socks_port,
+                            http_host=args.http_host, http_port=args.http_port,
+                            settings=settings)
         proxy.start()
     except KeyboardInterrupt:
         pass
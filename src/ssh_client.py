@@ -1,13 +1,17 @@
 import asyncio
 import asyncssh
 import aiohttp
+import concurrent.futures
 import logging
+import socket
+import time
 from dataclasses import dataclass
-from typing import Optional, Callable
+from typing import Optional, Callable, List, Set
 from aiohttp_socks import ProxyConnector
 
 # Assuming this module exists and provides the necessary functions
 from password_encryption_decryption import decrypt_password, salt
+from proxy_metrics import Counter, Gauge, Histogram, Metric, MetricsRegistry, collected
 
 
 class SSHConnectionError(Exception):
@@ -65,7 +69,11 @@ class SSHClient:
         status_callback: Optional callback to notify status changes.
         reconnect_attempts: Number of reconnection attempts made.
         max_reconnect_attempts: Maximum allowed reconnection attempts.
+        reconnects_total: Reconnection attempts made over the client's lifetime.
+        health_check_latency: Histogram of SOCKS health check durations, once metrics are registered.
         _forwarder: The SOCKS forwarder object.
+        _loop: The event loop running the connection, used to open channels from other threads.
+        _bridges: Tasks relaying between SSH channels and their local socket pairs.
     """
 
     def __init__(self, config: SSHConfig, status_callback: Optional[Callable[[bool], None]] = None):
@@ -85,7 +93,32 @@ class SSHClient:
         self.status_callback = status_callback
         self.reconnect_attempts: int = 0
         self.max_reconnect_attempts: int = 10
+        self.reconnects_total: int = 0
+        self.health_check_latency: Optional[Histogram] = None
         self._forwarder = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._bridges: Set[asyncio.Task] = set()
+
+    def register_metrics(self, registry: MetricsRegistry, prefix: str = 'ssh_tunnel') -> None:
+        """Publishes the tunnel state, reconnects and health check latency in a metrics registry.
+
+        Args:
+            registry: The registry rendered by the metrics endpoint.
+            prefix: Prefix of the metric names.
+        """
+        self.health_check_latency = registry.histogram(
+            f'{prefix}_health_check_seconds', 'Duration of SOCKS proxy health checks', ('result',))
+
+        def collect() -> List[Metric]:
+            return [
+                collected(Gauge, f'{prefix}_connected', 'Whether the SSH tunnel is up', int(self._connected)),
+                collected(Counter, f'{prefix}_reconnect_attempts_total', 'SSH reconnection attempts',
+                          self.reconnects_total),
+                collected(Gauge, f'{prefix}_consecutive_reconnect_attempts',
+                          'Reconnection attempts since the tunnel was last up', self.reconnect_attempts),
+            ]
+
+        registry.register_collector(collect)
 
     def _update_status(self, connected: bool) -> None:
         """Updates the connection status and invokes the callback if provided.
@@ -205,6 +238,7 @@ class SSHClient:
         This method runs in a loop until stopped, handling connection
         maintenance and reconnection attempts when necessary.
         """
+        self._loop = asyncio.get_running_loop()
         while self._running:
             try:
                 if not await self.is_connected():
@@ -214,6 +248,7 @@ class SSHClient:
                         self.reconnect_attempts = 0
                     except SSHConnectionError as e:
                         self.reconnect_attempts += 1
+                        self.reconnects_total += 1
                         logging.error(f"Reconnect attempt {self.reconnect_attempts}/{self.max_reconnect_attempts}: {e}")
                         if self.reconnect_attempts >= self.max_reconnect_attempts:
                             logging.error("Maximum reconnect attempts reached. Stopping client.")
@@ -242,6 +277,121 @@ class SSHClient:
                 logging.error(f"Error in connection management loop: {e}")
                 await asyncio.sleep(5)
 
+    def open_channel(self, host: str, port: int, timeout: float = 10.0) -> socket.socket:
+        """Opens a direct-tcpip channel from any thread and returns a socket relaying into it.
+
+        Lets an HTTP proxy in the same process tunnel through the SSH connection
+        without the loopback SOCKS listener. The returned socket is one end of a
+        socket pair; the other end is bridged to the channel on the connection's
+        event loop.
+
+        Args:
+            host: The destination host, resolved by the SSH server.
+            port: The destination port.
+            timeout: Seconds to wait for the channel to open.
+
+        Returns:
+            A connected blocking socket owned by the caller.
+
+        Raises:
+            SSHConnectionError: If the tunnel is down or the channel did not open in time.
+            ConnectionRefusedError: If the SSH server could not connect to the destination.
+            PermissionError: If the SSH server refused to forward to the destination.
+        """
+        loop = self._loop
+        if loop is None or loop.is_closed() or self.connection is None:
+            raise SSHConnectionError("SSH tunnel is not connected")
+
+        future = asyncio.run_coroutine_threadsafe(self._open_channel(host, port), loop)
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise SSHConnectionError(f"Timed out opening a channel to {host}:{port}")
+
+    def channel_ready(self) -> bool:
+        """Checks, from any thread, whether open_channel can currently succeed.
+
+        Returns:
+            True if the SSH connection is up, False while it is down or reconnecting.
+        """
+        loop = self._loop
+        connection = self.connection
+        return (loop is not None and not loop.is_closed() and
+                connection is not None and not connection.is_closed())
+
+    async def _open_channel(self, host: str, port: int) -> socket.socket:
+        """Opens a channel to host:port and starts bridging it to a new socket pair.
+
+        Args:
+            host: The destination host.
+            port: The destination port.
+
+        Returns:
+            The socket pair end handed to the caller.
+        """
+        connection = self.connection
+        if connection is None or connection.is_closed():
+            raise SSHConnectionError("SSH tunnel is not connected")
+        try:
+            channel_reader, channel_writer = await connection.open_connection(host, port)
+        except asyncssh.ChannelOpenError as e:
+            # A dropped connection fails channel opens too, but that is not the destination's fault
+            if connection.is_closed():
+                raise SSHConnectionError(f"SSH connection closed while opening {host}:{port}")
+            if e.code == asyncssh.OPEN_CONNECT_FAILED:
+                raise ConnectionRefusedError(f"SSH server could not connect to {host}:{port}: {e.reason}")
+            raise PermissionError(f"SSH server refused to forward to {host}:{port}: {e.reason}")
+
+        local, bridged = socket.socketpair()
+        try:
+            local_reader, local_writer = await asyncio.open_connection(sock=bridged)
+        except BaseException:
+            channel_writer.close()
+            local.close()
+            bridged.close()
+            raise
+
+        task = asyncio.ensure_future(self._bridge(channel_reader, channel_writer, local_reader, local_writer))
+        self._bridges.add(task)
+        task.add_done_callback(self._bridges.discard)
+        return local
+
+    async def _bridge(self, channel_reader, channel_writer, local_reader, local_writer) -> None:
+        """Relays between an SSH channel and a local socket until both directions are finished.
+
+        Args:
+            channel_reader: Reader of the SSH channel.
+            channel_writer: Writer of the SSH channel.
+            local_reader: Reader of the bridged socket pair end.
+            local_writer: Writer of the bridged socket pair end.
+        """
+        try:
+            await asyncio.gather(self._pipe(local_reader, channel_writer),
+                                 self._pipe(channel_reader, local_writer))
+        except (asyncssh.Error, OSError) as e:
+            logging.debug(f"SSH channel bridge closed: {e}")
+        finally:
+            channel_writer.close()
+            local_writer.close()
+
+    @staticmethod
+    async def _pipe(reader, writer) -> None:
+        """Copies one direction of a bridge and passes the end of stream on.
+
+        Args:
+            reader: The stream to read from.
+            writer: The stream to write to, waiting for it to drain to apply backpressure.
+        """
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                break
+            writer.write(data)
+            await writer.drain()
+        if writer.can_write_eof():
+            writer.write_eof()
+
     async def _check_socks_connection(self) -> bool:
         """Checks if the SOCKS proxy connection is working.
 
@@ -252,6 +402,8 @@ class SSHClient:
             logging.error("No test URL configured for SOCKS connection check")
             return False
 
+        started = time.monotonic()
+        is_successful = False
         try:
             connector = ProxyConnector.from_url(f'socks5://localhost:{self.config.dynamic_port}')
             async with aiohttp.ClientSession(connector=connector) as session:
@@ -267,6 +419,9 @@ class SSHClient:
         except (aiohttp.ClientError, aiohttp.ClientConnectorError, asyncio.TimeoutError, OSError) as e:
             logging.error(f"SOCKS connection check failed: {e}")
             return False
+        finally:
+            if self.health_check_latency:
+                self.health_check_latency.observe(time.monotonic() - started, 'ok' if is_successful else 'failed')
 
     async def is_connected(self) -> bool:
         """Asynchronously checks the current connection status.
@@ -0,0 +1,93 @@
+import os
+import sys
+import unittest
+
+# Get the absolute path to the project root
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+
+# Add project root and src directory to Python path
+sys.path.insert(0, project_root)
+sys.path.insert(0, os.path.join(project_root, 'src'))
+
+from http_message import BodyFraming, HTTPRequestHead, HTTPResponseHead
+
+
+class TestHTTPRequestHead(unittest.TestCase):
+    def test_parse_request_line_and_headers(self):
+        head = HTTPRequestHead.parse(b'get http://example.com/x HTTP/1.1\r\nHost: example.com\r\nX-A:  1 ')
+        self.assertEqual(head.method, 'GET')
+        self.assertEqual(head.target, 'http://example.com/x')
+        self.assertEqual(head.get_header('host'), 'example.com')
+        self.assertEqual(head.get_header('x-a'), '1')
+
+    def test_malformed_request_line(self):
+        with self.assertRaises(ValueError):
+            HTTPRequestHead.parse(b'GET /\r\nHost: example.com')
+
+    def test_to_upstream_strips_hop_by_hop_headers(self):
+        head = HTTPRequestHead.parse(
+            b'GET http://example.com/a?b=1 HTTP/1.1\r\n'
+            b'Host: example.com\r\n'
+            b'Proxy-Connection: keep-alive\r\n'
+            b'Connection: X-Private\r\n'
+            b'X-Private: secret\r\n'
+            b'Accept: */*'
+        )
+        self.assertEqual(
+            head.to_upstream(),
+            b'GET /a?b=1 HTTP/1.1\r\nHost: example.com\r\nAccept: */*\r\n\r\n'
+        )
+
+    def test_body_framing(self):
+        chunked = HTTPRequestHead.parse(b'POST / HTTP/1.1\r\nTransfer-Encoding: gzip, chunked')
+        sized = HTTPRequestHead.parse(b'POST / HTTP/1.1\r\nContent-Length: 10')
+        empty = HTTPRequestHead.parse(b'GET / HTTP/1.1\r\nHost: a')
+        self.assertEqual(chunked.body_framing(), BodyFraming.CHUNKED)
+        self.assertEqual(sized.body_framing(), BodyFraming.LENGTH)
+        self.assertEqual(empty.body_framing(), BodyFraming.NONE)
+
+    def test_ambiguous_framing_refused(self):
+        for headers in (b'Content-Length: abc', b'Content-Length: 4, 40', b'Content-Length: 4\r\nContent-Length: 5',
+                        b'Content-Length: -1', b'Transfer-Encoding: gzip',
+                        b'Transfer-Encoding: chunked\r\nTransfer-Encoding: identity'):
+            with self.subTest(headers=headers):
+                head = HTTPRequestHead.parse(b'POST / HTTP/1.1\r\nHost: a\r\n' + headers)
+                self.assertIsNotNone(head.framing_error())
+
+        repeated = HTTPRequestHead.parse(b'POST / HTTP/1.1\r\nContent-Length: 4, 4')
+        self.assertIsNone(repeated.framing_error())
+        self.assertEqual(repeated.content_length(), 4)
+
+    def test_transfer_encoding_drops_content_length(self):
+        head = HTTPRequestHead.parse(b'POST http://a/ HTTP/1.1\r\nHost: a\r\nContent-Length: 4\r\n'
+                                     b'Transfer-Encoding: chunked')
+        self.assertIsNone(head.framing_error())
+        self.assertEqual(head.body_framing(), BodyFraming.CHUNKED)
+        self.assertEqual(head.to_upstream(), b'POST / HTTP/1.1\r\nHost: a\r\nTransfer-Encoding: chunked\r\n\r\n')
+
+
+class TestHTTPResponseHead(unittest.TestCase):
+    def test_body_framing(self):
+        sized = HTTPResponseHead.parse(b'HTTP/1.1 200 OK\r\nContent-Length: 3')
+        unframed = HTTPResponseHead.parse(b'HTTP/1.0 200 OK')
+        not_modified = HTTPResponseHead.parse(b'HTTP/1.1 304 Not Modified\r\nContent-Length: 3')
+        self.assertEqual(sized.body_framing('GET'), BodyFraming.LENGTH)
+        self.assertEqual(sized.body_framing('HEAD'), BodyFraming.NONE)
+        self.assertEqual(unframed.body_framing('GET'), BodyFraming.CLOSE)
+        self.assertEqual(not_modified.body_framing('GET'), BodyFraming.NONE)
+
+    def test_keep_alive_semantics(self):
+        self.assertTrue(HTTPResponseHead.parse(b'HTTP/1.1 200 OK').wants_keep_alive())
+        self.assertFalse(HTTPResponseHead.parse(b'HTTP/1.1 200 OK\r\nConnection: close').wants_keep_alive())
+        self.assertFalse(HTTPResponseHead.parse(b'HTTP/1.0 200 OK').wants_keep_alive())
+        self.assertTrue(HTTPResponseHead.parse(b'HTTP/1.0 200 OK\r\nConnection: Keep-Alive').wants_keep_alive())
+
+    def test_to_client_sets_connection(self):
+        head = HTTPResponseHead.parse(b'HTTP/1.1 200 OK\r\nKeep-Alive: timeout=5\r\nContent-Length: 0')
+        self.assertEqual(head.to_client(keep_alive=False),
+                         b'HTTP/1.1 200 OK\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
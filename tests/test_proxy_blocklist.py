@@ -0,0 +1,115 @@
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+# Get the absolute path to the project root
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+
+# Add project root and src directory to Python path
+sys.path.insert(0, project_root)
+sys.path.insert(0, os.path.join(project_root, 'src'))
+
+from proxy_blocklist import Blocklist
+
+HOSTS = '''
+# Hosts file
+127.0.0.1 localhost
+::1 localhost ip6-localhost
+0.0.0.0 tracker.example.com  # inline comment
+0.0.0.0 pixel.example.org beacon.example.org
+'''
+
+ADBLOCK = '''
+[Adblock Plus 2.0]
+! Title: trackers
+||ads.example.net^
+||metrics.example.io^$third-party
+||cdn.example.net^$script,domain=news.example.com
+@@||ok.ads.example.net^
+example.com##.banner
+/banner[0-9]+/
+analytics.example.co
+3.4
+0.0.0.0 10.0.0.1
+'''
+
+
+class TestBlocklist(unittest.TestCase):
+    def setUp(self):
+        self.blocklist = Blocklist.parse(HOSTS + ADBLOCK)
+
+    def test_hosts_entries_block_exact_names(self):
+        self.assertEqual(self.blocklist.match('tracker.example.com'), 'tracker.example.com')
+        self.assertEqual(self.blocklist.match('Beacon.Example.org.'), 'beacon.example.org')
+        self.assertIsNone(self.blocklist.match('www.tracker.example.com'))
+        self.assertIsNone(self.blocklist.match('example.com'))
+        self.assertIsNone(self.blocklist.match('localhost'))
+
+    def test_domain_rules_block_subdomains(self):
+        self.assertEqual(self.blocklist.match('ads.example.net'), 'ads.example.net')
+        self.assertEqual(self.blocklist.match('a.b.ads.example.net'), 'ads.example.net')
+        self.assertEqual(self.blocklist.match('eu.metrics.example.io'), 'metrics.example.io')
+        self.assertEqual(self.blocklist.match('www.analytics.example.co'), 'analytics.example.co')
+        # Labels must match whole
+        self.assertIsNone(self.blocklist.match('badads.example.net'))
+
+    def test_exceptions_and_unsupported_rules(self):
+        self.assertIsNone(self.blocklist.match('ok.ads.example.net'))
+        self.assertIsNone(self.blocklist.match('img.ok.ads.example.net'))
+        # Rules narrowed to some pages cannot be applied to a whole destination
+        self.assertIsNone(self.blocklist.match('cdn.example.net'))
+        # Numeric entries are address fragments, not domains
+        self.assertIsNone(self.blocklist.match('1.2.3.4'))
+        self.assertIsNone(self.blocklist.match('10.0.0.1'))
+        self.assertEqual(len(self.blocklist), 6)
+
+    def test_hit_counter(self):
+        self.assertTrue(self.blocklist.blocks('ads.example.net'))
+        self.assertFalse(self.blocklist.blocks('example.org'))
+        self.assertEqual(self.blocklist.hits, 1)
+
+    def test_compiled_copy(self):
+        with tempfile.TemporaryDirectory() as directory:
+            list_path = os.path.join(directory, 'hosts')
+            cache_path = os.path.join(directory, 'blocklist.json')
+            with open(list_path, 'w') as f:
+                f.write(HOSTS)
+            compiled = Blocklist.from_files([list_path], cache_path)
+            self.assertTrue(os.path.exists(cache_path))
+
+            cached = Blocklist.load(cache_path)
+            self.assertEqual(cached.exact, compiled.exact)
+            self.assertEqual(Blocklist.from_files([list_path], cache_path).sources, cached.sources)
+
+            # A changed list is compiled again
+            with open(list_path, 'a') as f:
+                f.write('0.0.0.0 new.example.com\n')
+            os.utime(list_path, ns=(0, time.time_ns() + 10 ** 9))
+            self.assertEqual(Blocklist.from_files([list_path], cache_path).match('new.example.com'),
+                             'new.example.com')
+            self.assertIn('new.example.com', Blocklist.load(cache_path).exact)
+
+            for broken in ('{not json', '{"version": 1, "exact": []}',
+                           '{"version": 1, "exact": [1], "suffixes": [], "allowed": [], "sources": []}'):
+                with self.subTest(broken=broken):
+                    with open(cache_path, 'w') as f:
+                        f.write(broken)
+                    self.assertIsNone(Blocklist.load(cache_path))
+            # An unusable compiled copy is replaced instead of failing startup
+            self.assertIn('new.example.com', Blocklist.from_files([list_path], cache_path).exact)
+
+    def test_large_list_lookup(self):
+        blocklist = Blocklist(suffixes=(f'tracker{i}.example.com' for i in range(500000)))
+        started = time.perf_counter()
+        for i in range(10000):
+            blocklist.match(f'cdn.eu.site{i}.example.org')
+        # Microseconds per lookup, with a wide margin for slow machines
+        self.assertLess((time.perf_counter() - started) / 10000, 0.0005)
+        self.assertEqual(blocklist.match('a.tracker499999.example.com'), 'tracker499999.example.com')
+
+
+if __name__ == '__main__':
+    unittest.main()
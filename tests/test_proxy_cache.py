@@ -0,0 +1,192 @@
+import mmap
+import os
+import sys
+import tempfile
+import time
+import unittest
+from email.utils import formatdate
+
+# Get the absolute path to the project root
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+
+# Add project root and src directory to Python path
+sys.path.insert(0, project_root)
+sys.path.insert(0, os.path.join(project_root, 'src'))
+
+from http_message import HTTPRequestHead, HTTPResponseHead
+from proxy_cache import FetchCoalescer, ResponseCache, freshness_lifetime, parse_cache_control
+
+
+def request(extra=b''):
+    return HTTPRequestHead.parse(b'GET http://example.com/a HTTP/1.1\r\nHost: example.com' + extra)
+
+
+def response(headers=b'Cache-Control: max-age=60', status=b'200 OK'):
+    return HTTPResponseHead.parse(b'HTTP/1.1 ' + status + b'\r\n' + headers)
+
+
+def store(cache, key, body, head=None, req=None):
+    writer = cache.begin(key, req or request(), head or response())
+    if writer is None:
+        return False
+    writer.write(body)
+    writer.commit()
+    return True
+
+
+class TestFreshness(unittest.TestCase):
+    def test_cache_control_parsing(self):
+        self.assertEqual(parse_cache_control('public, Max-Age=60, no-cache="Set-Cookie"'),
+                         {'public': None, 'max-age': '60', 'no-cache': 'Set-Cookie'})
+
+    def test_lifetime_sources(self):
+        now = time.time()
+        self.assertEqual(freshness_lifetime(response(b'Cache-Control: max-age=60, s-maxage=5'), now), 5)
+        expires = b'Date: ' + formatdate(now, usegmt=True).encode() + \
+                  b'\r\nExpires: ' + formatdate(now + 100, usegmt=True).encode()
+        self.assertAlmostEqual(freshness_lifetime(response(expires), now), 100, delta=1)
+        heuristic = b'Date: ' + formatdate(now, usegmt=True).encode() + \
+                    b'\r\nLast-Modified: ' + formatdate(now - 1000, usegmt=True).encode()
+        self.assertAlmostEqual(freshness_lifetime(response(heuristic), now), 100, delta=1)
+        self.assertIsNone(freshness_lifetime(response(b'X-A: 1'), now))
+
+
+class TestResponseCache(unittest.TestCase):
+    def test_fresh_hit_and_request_no_cache(self):
+        cache = ResponseCache(memory_size=1024)
+        self.assertTrue(store(cache, 'k', b'hello'))
+        entry, fresh = cache.lookup('k', request())
+        self.assertTrue(fresh)
+        self.assertEqual(entry.body, b'hello')
+        self.assertEqual(entry.to_response().get_header('content-length'), '5')
+
+        # Without validators a request demanding revalidation is a plain miss
+        self.assertEqual(cache.lookup('k', request(b'\r\nCache-Control: no-cache')), (None, False))
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_not_storable(self):
+        cache = ResponseCache(memory_size=1024)
+        self.assertFalse(store(cache, 'k', b'x', response(b'Cache-Control: private, max-age=60')))
+        self.assertFalse(store(cache, 'k', b'x', response(b'Cache-Control: no-store')))
+        self.assertFalse(store(cache, 'k', b'x', response(b'Cache-Control: max-age=60\r\nVary: *')))
+        self.assertFalse(store(cache, 'k', b'x', response(b'X-A: 1')))
+        self.assertFalse(store(cache, 'k', b'x', req=request(b'\r\nAuthorization: Basic eDp5')))
+        self.assertFalse(store(cache, 'k', b'x', response(status=b'500 Internal Server Error')))
+        self.assertFalse(store(cache, 'k', b'x', response(b'Cache-Control: max-age=60\r\nSet-Cookie: id=1')))
+
+    def test_vary_selects_variant(self):
+        cache = ResponseCache(memory_size=1024)
+        store(cache, 'k', b'gz', response(b'Cache-Control: max-age=60\r\nVary: Accept-Encoding'),
+              request(b'\r\nAccept-Encoding: gzip'))
+        self.assertTrue(cache.lookup('k', request(b'\r\nAccept-Encoding: gzip'))[1])
+        self.assertIsNone(cache.lookup('k', request())[0])
+
+    def test_stale_entry_revalidated(self):
+        cache = ResponseCache(memory_size=1024)
+        store(cache, 'k', b'body', response(b'Cache-Control: no-cache\r\nETag: "v1"'))
+        entry, fresh = cache.lookup('k', request())
+        self.assertFalse(fresh)
+        self.assertEqual(entry.conditional_headers(), [('If-None-Match', '"v1"')])
+
+        cache.refresh(entry, response(b'Cache-Control: max-age=60\r\nETag: "v1"', b'304 Not Modified'))
+        self.assertTrue(cache.lookup('k', request())[1])
+        self.assertEqual(entry.header('cache-control'), 'max-age=60')
+
+    def test_lru_eviction_in_memory(self):
+        cache = ResponseCache(memory_size=10)
+        store(cache, 'a', b'12345')
+        store(cache, 'b', b'12345')
+        cache.lookup('a', request())
+        store(cache, 'c', b'12345')
+        self.assertEqual(list(cache.entries), ['a', 'c'])
+        self.assertEqual((cache.evictions, cache.memory_used), (1, 10))
+
+    def test_disk_persistence_and_mmap(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = ResponseCache(memory_size=1024, directory=directory, mmap_threshold=1024)
+            large = os.urandom(4096)
+            store(cache, 'large', large)
+            store(cache, 'small', b'small')
+            self.assertIsNone(cache.entries['large'].body)
+            cache.close()
+
+            reopened = ResponseCache(memory_size=1024, directory=directory, mmap_threshold=1024)
+            entry, fresh = reopened.lookup('large', request())
+            self.assertTrue(fresh)
+            with reopened.open_body(entry) as body:
+                self.assertIsInstance(body, mmap.mmap)
+                self.assertEqual(body[:], large)
+            with reopened.open_body(reopened.lookup('small', request())[0]) as body:
+                self.assertEqual(body, b'small')
+
+            reopened.invalidate('large')
+            self.assertEqual(len(os.listdir(directory)), 2)  # index and the small body
+
+    def test_foreign_files_kept(self):
+        with tempfile.TemporaryDirectory() as directory:
+            for name in ('notes.txt', '1-2-3.body', 'index.json.tmp'):
+                with open(os.path.join(directory, name), 'w') as f:
+                    f.write('x')
+            ResponseCache(memory_size=1024, directory=directory)
+            # Only leftovers of the cache itself are swept
+            self.assertEqual(os.listdir(directory), ['notes.txt'])
+
+    def test_oversized_body_not_stored(self):
+        cache = ResponseCache(memory_size=1024, max_object_size=8)
+        self.assertTrue(store(cache, 'k', b'0123456789'))
+        self.assertNotIn('k', cache.entries)
+
+
+class TestFetchCoalescer(unittest.TestCase):
+    def test_late_joiner_reads_from_start(self):
+        coalescer = FetchCoalescer()
+        fetch, leader = coalescer.join('k', request())
+        self.assertTrue(leader)
+        self.assertTrue(fetch.publish(response(b'Content-Length: 6')))
+        fetch.append(b'abc')
+
+        joined, leader = coalescer.join('k', request())
+        self.assertIs(joined, fetch)
+        self.assertFalse(leader)
+        self.assertIsNotNone(joined.wait_response(request(), 1.0))
+        self.assertEqual(joined.read(0, 64, 1.0), (b'abc', False))
+
+        fetch.append(b'def')
+        coalescer.release(fetch, success=True)
+        self.assertEqual(joined.read(3, 64, 1.0), (b'def', True))
+        self.assertTrue(coalescer.join('k', request())[1])
+
+    def test_personalised_response_not_shared(self):
+        coalescer = FetchCoalescer()
+        fetch, _ = coalescer.join('k', request())
+        self.assertFalse(fetch.publish(response(b'Set-Cookie: id=1\r\nContent-Length: 1')))
+        self.assertIsNone(fetch.wait_response(request(), 1.0))
+
+    def test_followers_counted_while_reading(self):
+        coalescer = FetchCoalescer()
+        fetch, _ = coalescer.join('k', request())
+        coalescer.join('k', request())
+        coalescer.join('k', request())
+        self.assertEqual(fetch.followers, 2)
+        fetch.leave()
+        fetch.leave()
+        self.assertEqual(fetch.followers, 0)
+
+    def test_unknown_length_not_shared(self):
+        coalescer = FetchCoalescer()
+        fetch, _ = coalescer.join('k', request())
+        self.assertFalse(fetch.publish(response(b'Transfer-Encoding: chunked')))
+        self.assertIsNone(fetch.wait_response(request(), 1.0))
+
+    def test_failed_fetch_aborts_followers(self):
+        coalescer = FetchCoalescer()
+        fetch, _ = coalescer.join('k', request())
+        fetch.publish(response(b'Content-Length: 10'))
+        fetch.append(b'01234')
+        coalescer.release(fetch)
+        self.assertEqual(fetch.read(0, 64, 1.0), (None, False))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import os
+import sys
+import unittest
+import urllib.error
+import urllib.request
+
+# Get the absolute path to the project root
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+
+# Add project root and src directory to Python path
+sys.path.insert(0, project_root)
+sys.path.insert(0, os.path.join(project_root, 'src'))
+
+from proxy_metrics import Gauge, MetricsRegistry, MetricsServer, collected
+
+
+class TestMetricsRegistry(unittest.TestCase):
+    def test_counter_and_gauge_rendering(self):
+        registry = MetricsRegistry()
+        errors = registry.counter('proxy_errors_total', 'Errors by type', ('type',))
+        errors.inc('timeout')
+        errors.inc('timeout')
+        errors.inc('say "hi"\n')
+        registry.register_collector(lambda: [collected(Gauge, 'proxy_active', 'Active connections', 3)])
+
+        self.assertEqual(registry.render(),
+                         '# HELP proxy_errors_total Errors by type\n'
+                         '# TYPE proxy_errors_total counter\n'
+                         'proxy_errors_total{type="timeout"} 2\n'
+                         'proxy_errors_total{type="say \\"hi\\"\\n"} 1\n'
+                         '# HELP proxy_active Active connections\n'
+                         '# TYPE proxy_active gauge\n'
+                         'proxy_active 3\n')
+
+    def test_histogram_buckets_are_cumulative(self):
+        registry = MetricsRegistry()
+        latency = registry.histogram('connect_seconds', 'Connect time', ('route',), buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 0.7, 3.0):
+            latency.observe(value, 'tunnel')
+        lines = registry.render().splitlines()[2:]
+        self.assertEqual(lines[:3], ['connect_seconds_bucket{route="tunnel",le="0.1"} 1',
+                                     'connect_seconds_bucket{route="tunnel",le="1.0"} 3',
+                                     'connect_seconds_bucket{route="tunnel",le="+Inf"} 4'])
+        self.assertTrue(lines[3].startswith('connect_seconds_sum{route="tunnel"} 4.25'))
+        self.assertEqual(lines[4], 'connect_seconds_count{route="tunnel"} 4')
+        self.assertEqual(latency.count('tunnel'), 4)
+
+    def test_registration_is_idempotent(self):
+        registry = MetricsRegistry()
+        counter = registry.counter('requests_total', 'Requests')
+        self.assertIs(registry.counter('requests_total', 'Requests'), counter)
+        with self.assertRaises(ValueError):
+            registry.gauge('requests_total', 'Requests')
+        with self.assertRaises(ValueError):
+            counter.inc('unexpected-label')
+
+
+class TestMetricsServer(unittest.TestCase):
+    def test_scrape(self):
+        registry = MetricsRegistry()
+        registry.counter('scrapes_total', 'Scrapes').inc()
+        server = MetricsServer(registry, port=0)
+        server.start()
+        try:
+            with urllib.request.urlopen(f'http://localhost:{server.port}/metrics', timeout=2.0) as response:
+                self.assertTrue(response.headers['Content-Type'].startswith('text/plain; version=0.0.4'))
+                self.assertIn(b'scrapes_total 1\n', response.read())
+            with self.assertRaises(urllib.error.HTTPError):
+                urllib.request.urlopen(f'http://localhost:{server.port}/', timeout=2.0)
+        finally:
+            server.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import os
+import sys
+import tempfile
+import unittest
+
+# Get the absolute path to the project root
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+
+# Add project root and src directory to Python path
+sys.path.insert(0, project_root)
+sys.path.insert(0, os.path.join(project_root, 'src'))
+
+from proxy_rules import RuleAction, RuleEngine, RuleSet
+
+RULES = '''
+# Intranet and LAN stay off the tunnel
+direct  corp.example.com
+direct  10.0.0.0/8
+direct  fd00::/8
+reject  ads.example.net
+reject  10.1.2.3
+tunnel  *.example.com
+direct  *
+'''
+
+
+class TestRuleSet(unittest.TestCase):
+    def setUp(self):
+        self.rules = RuleSet.parse(RULES)
+
+    def action(self, host):
+        rule = self.rules.match(host)
+        return rule.action if rule else None
+
+    def test_domain_suffix_matching(self):
+        self.assertEqual(self.action('corp.example.com'), RuleAction.DIRECT)
+        self.assertEqual(self.action('Wiki.Corp.Example.com.'), RuleAction.DIRECT)
+        self.assertEqual(self.action('www.example.com'), RuleAction.TUNNEL)
+        self.assertEqual(self.action('tracker.ads.example.net'), RuleAction.REJECT)
+        # Labels must match whole
+        self.assertEqual(self.action('badcorp.example.com'), RuleAction.TUNNEL)
+
+    def test_first_match_wins(self):
+        # The /8 rule comes before the single address
+        self.assertEqual(self.action('10.1.2.3'), RuleAction.DIRECT)
+        self.assertEqual(self.action('fd12::1'), RuleAction.DIRECT)
+        self.assertEqual(self.action('[fd12::1]'), RuleAction.DIRECT)
+        # Catch-all applies to everything else
+        self.assertEqual(self.action('192.0.2.1'), RuleAction.DIRECT)
+        self.assertEqual(self.action('example.org'), RuleAction.DIRECT)
+
+    def test_no_match(self):
+        rules = RuleSet.parse('direct 192.168.0.0/16')
+        self.assertIsNone(rules.match('192.169.0.1'))
+        self.assertIsNone(rules.match('example.com'))
+
+    def test_invalid_rules(self):
+        for text in ('bypass example.com', 'direct', 'direct a..b'):
+            with self.subTest(text=text):
+                with self.assertRaises(ValueError):
+                    RuleSet.parse(text)
+
+
+class TestRuleEngine(unittest.TestCase):
+    def test_hit_counters_and_swap(self):
+        engine = RuleEngine(RuleSet.parse('direct lan\nreject ads.example.net'))
+        self.assertEqual(engine.decide('printer.lan'), RuleAction.DIRECT)
+        self.assertEqual(engine.decide('nas.lan'), RuleAction.DIRECT)
+        self.assertEqual(engine.decide('example.com'), RuleAction.TUNNEL)
+        self.assertEqual([entry['hits'] for entry in engine.report()], [2, 0, 1])
+
+        with tempfile.NamedTemporaryFile('w', suffix='.rules', delete=False) as f:
+            f.write('reject lan\n')
+        try:
+            previous = engine.load(f.name)
+        finally:
+            os.unlink(f.name)
+        self.assertEqual(previous.rules[0].hits, 2)
+        self.assertEqual(engine.decide('printer.lan'), RuleAction.REJECT)
+        self.assertEqual(engine.report()[0], {'action': 'reject', 'pattern': 'lan', 'hits': 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
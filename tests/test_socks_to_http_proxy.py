@@ -8,6 +8,9 @@ import threading
 import time
 import requests
 import logging
+import ipaddress
+import signal
+import struct
 from unittest.mock import patch, MagicMock
 from contextlib import contextmanager
 
@@ -19,7 +22,14 @@ project_root = os.path.dirname(current_dir)
 sys.path.insert(0, project_root)
 sys.path.insert(0, os.path.join(project_root, 'src'))
 
-from socks_to_http_proxy import SOCKStoHTTPProxy
+from socks_to_http_proxy import (SOCKStoHTTPProxy, AsyncSOCKStoHTTPProxy, DataForwarder, ProxySettings, BufferPool,
+                                SOCKS5Client, ProxySupervisor, HostInfo, BandwidthShaper, NegativeCache,
+                                SOCKSResponse, SOCKSReplyError, socks_address, original_destination,
+                                RelayBudget, TunnelHold, send_queue_size, SPLICE_SUPPORTED, REUSEPORT_SUPPORTED,
+                                TRANSPARENT_SUPPORTED, SEND_QUEUE_SUPPORTED, SocketReader, parse_args)
+from http_message import BodyFraming
+from proxy_blocklist import Blocklist
+from proxy_rules import RuleSet
 
 
 class TestSOCKStoHTTPProxy(unittest.TestCase):
@@ -170,6 +180,1797 @@ class TestSOCKStoHTTPProxy(unittest.TestCase):
         self.assertEqual(len(client_threads), 0, "All client threads should be terminated")
 
 
+class MockSOCKSServer:
+    """Mock SOCKS5 server that hands every tunnel to an HTTP origin handler"""
+
+    # CONNECT reply with an IPv4 bound address
+    reply = b'\x05\x00\x00\x01\x00\x00\x00\x00\x00\x00'
+
+    def __init__(self, origin_handler, port=0):
+        self.origin_handler = origin_handler
+        self.connections = 0
+        self.requests = []
+        self.connect_requests = []
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind(('localhost', port))
+        self.server.listen(16)
+        self.server.settimeout(0.2)
+        self.port = self.server.getsockname()[1]
+        self.running = True
+        self.threads = []
+        self.accept_thread = threading.Thread(target=self._accept_loop, daemon=True)
+        self.accept_thread.start()
+
+    def _accept_loop(self):
+        while self.running:
+            try:
+                conn, _ = self.server.accept()
+            except (socket.timeout, OSError):
+                continue
+            self.connections += 1
+            thread = threading.Thread(target=self._serve, args=(conn,), daemon=True)
+            self.threads.append(thread)
+            thread.start()
+
+    def _serve(self, conn):
+        try:
+            conn.settimeout(2.0)
+            conn.recv(3)
+            conn.sendall(b'\x05\x00')
+            self.connect_requests.append(conn.recv(1024))
+            conn.sendall(self.reply)
+            self.origin_handler(self, conn)
+        except (socket.timeout, OSError):
+            pass
+        finally:
+            conn.close()
+
+    def read_request(self, conn, buffer=b''):
+        """Read one request head from an origin connection"""
+        while b'\r\n\r\n' not in buffer:
+            data = conn.recv(4096)
+            if not data:
+                return None, b''
+            buffer += data
+        head, _, rest = buffer.partition(b'\r\n\r\n')
+        self.requests.append(head)
+        return head, rest
+
+    def close(self):
+        self.running = False
+        self.accept_thread.join(timeout=2.0)
+        self.server.close()
+        for thread in self.threads:
+            thread.join(timeout=2.0)
+
+
+def keep_alive_origin(server, conn):
+    """Origin answering every request on the connection with a small body"""
+    rest = b''
+    while True:
+        head, rest = server.read_request(conn, rest)
+        if head is None:
+            return
+        if head.startswith(b'GET /chunked'):
+            conn.sendall(b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n'
+                         b'5\r\nhello\r\n6\r\n world\r\n0\r\n\r\n')
+        else:
+            conn.sendall(b'HTTP/1.1 200 OK\r\nContent-Length: 5\r\nConnection: keep-alive\r\n\r\nhello')
+
+
+def read_http_response(sock):
+    """Read from sock until the server closes the connection"""
+    response = b''
+    while True:
+        try:
+            chunk = sock.recv(4096)
+        except socket.timeout:
+            break
+        if not chunk:
+            break
+        response += chunk
+    return response
+
+
+def read_response_head(sock):
+    """Read a response head that nothing follows until the client sends more, e.g. 200 to CONNECT"""
+    head = b''
+    while b'\r\n\r\n' not in head:
+        chunk = sock.recv(4096)
+        if not chunk:
+            break
+        head += chunk
+    return head
+
+
+def read_sized_response(sock, buffer=b''):
+    """Read one Content-Length or chunked response; returns (response, leftover bytes)"""
+    while b'\r\n\r\n' not in buffer:
+        chunk = sock.recv(4096)
+        if not chunk:
+            return buffer, b''
+        buffer += chunk
+    head, _, body = buffer.partition(b'\r\n\r\n')
+    length = 0
+    for line in head.split(b'\r\n')[1:]:
+        name, _, value = line.partition(b':')
+        if name.strip().lower() == b'content-length':
+            length = int(value)
+        elif name.strip().lower() == b'transfer-encoding':
+            # Only simple bodies without trailers are used in these tests
+            while b'0\r\n\r\n' not in body:
+                chunk = sock.recv(4096)
+                if not chunk:
+                    break
+                body += chunk
+            length = body.find(b'0\r\n\r\n') + 5
+    while len(body) < length:
+        chunk = sock.recv(4096)
+        if not chunk:
+            break
+        body += chunk
+    return head + b'\r\n\r\n' + body[:length], body[length:]
+
+
+class TestUpstreamPooling(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        logging.disable(logging.CRITICAL)
+
+    def setUp(self):
+        self.mock_socks = MockSOCKSServer(keep_alive_origin)
+        self.http_port = get_free_port()
+        self.proxy = SOCKStoHTTPProxy(socks_port=self.mock_socks.port, http_port=self.http_port)
+        self.proxy_thread = threading.Thread(target=self.proxy.start, daemon=True)
+        self.proxy_thread.start()
+        time.sleep(0.2)
+
+    def tearDown(self):
+        self.proxy.stop()
+        self.proxy_thread.join(timeout=2.0)
+        self.mock_socks.close()
+
+    def _get(self, target):
+        with socket.create_connection(('localhost', self.http_port), timeout=2.0) as client:
+            client.sendall(f'GET {target} HTTP/1.1\r\nHost: example.com\r\n'
+                           f'Proxy-Connection: close\r\n\r\n'.encode())
+            return read_http_response(client)
+
+    def test_upstream_connection_reused(self):
+        """Consecutive requests to one origin share a single SOCKS tunnel"""
+        for _ in range(3):
+            response = self._get('http://example.com/index.html')
+            self.assertTrue(response.endswith(b'hello'))
+        self.assertEqual(self.mock_socks.connections, 1)
+
+    def test_origin_form_rewrite(self):
+        """Absolute-form targets are sent upstream in origin-form without proxy headers"""
+        self._get('http://example.com/a?b=1')
+        request = self.mock_socks.requests[0]
+        self.assertTrue(request.startswith(b'GET /a?b=1 HTTP/1.1\r\n'))
+        self.assertNotIn(b'Proxy-Connection', request)
+
+    def test_chunked_response_relayed(self):
+        """Chunked responses are relayed intact and the connection is pooled"""
+        response = self._get('http://example.com/chunked')
+        self.assertIn(b'5\r\nhello\r\n6\r\n world\r\n0\r\n\r\n', response)
+        self._get('http://example.com/')
+        self.assertEqual(self.mock_socks.connections, 1)
+
+
+class TestClientKeepAlive(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        logging.disable(logging.CRITICAL)
+
+    def setUp(self):
+        self.mock_socks = MockSOCKSServer(keep_alive_origin)
+        self.http_port = get_free_port()
+        self.proxy = SOCKStoHTTPProxy(socks_port=self.mock_socks.port, http_port=self.http_port,
+                                      settings=ProxySettings(max_requests_per_connection=3))
+        self.proxy_thread = threading.Thread(target=self.proxy.start, daemon=True)
+        self.proxy_thread.start()
+        time.sleep(0.2)
+
+    def tearDown(self):
+        self.proxy.stop()
+        self.proxy_thread.join(timeout=2.0)
+        self.mock_socks.close()
+
+    def test_requests_share_client_connection(self):
+        """An HTTP/1.1 client can send several requests over one connection"""
+        with socket.create_connection(('localhost', self.http_port), timeout=2.0) as client:
+            for _ in range(2):
+                client.sendall(b'GET http://example.com/ HTTP/1.1\r\nHost: example.com\r\n\r\n')
+                response, _ = read_sized_response(client)
+                self.assertIn(b'Connection: keep-alive', response)
+                self.assertTrue(response.endswith(b'hello'))
+
+    def test_max_requests_closes_connection(self):
+        """The last allowed request is answered with Connection: close"""
+        with socket.create_connection(('localhost', self.http_port), timeout=2.0) as client:
+            for _ in range(3):
+                client.sendall(b'GET http://example.com/ HTTP/1.1\r\nHost: example.com\r\n\r\n')
+                response, _ = read_sized_response(client)
+            self.assertIn(b'Connection: close', response)
+            self.assertEqual(client.recv(1024), b'')
+
+    def test_http10_without_keep_alive_closes(self):
+        """HTTP/1.0 clients get a closed connection unless they ask for keep-alive"""
+        with socket.create_connection(('localhost', self.http_port), timeout=2.0) as client:
+            client.sendall(b'GET http://example.com/ HTTP/1.0\r\nHost: example.com\r\n\r\n')
+            response = read_http_response(client)
+        self.assertIn(b'Connection: close', response)
+        self.assertTrue(response.endswith(b'hello'))
+
+
+def echo_body_origin(server, conn):
+    """Origin answering each request with its body, or echoing raw tunnel data"""
+    rest = b''
+    while True:
+        head, rest = server.read_request(conn, rest)
+        if head is None:
+            # Not HTTP at all: behave like a raw echo tunnel
+            return
+        length = 0
+        for line in head.split(b'\r\n')[1:]:
+            name, _, value = line.partition(b':')
+            if name.strip().lower() == b'content-length':
+                length = int(value)
+        while len(rest) < length:
+            rest += conn.recv(4096)
+        body, rest = rest[:length], rest[length:]
+        conn.sendall(b'HTTP/1.1 200 OK\r\nContent-Length: %d\r\n\r\n%s' % (len(body), body))
+
+
+def raw_echo_origin(server, conn):
+    """Origin echoing whatever arrives through the tunnel"""
+    while True:
+        data = conn.recv(4096)
+        if not data:
+            return
+        conn.sendall(data)
+
+
+class TestRequestHeadParsing(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        logging.disable(logging.CRITICAL)
+
+    def _start(self, origin_handler, settings=None):
+        self.mock_socks = MockSOCKSServer(origin_handler)
+        self.http_port = get_free_port()
+        self.proxy = SOCKStoHTTPProxy(socks_port=self.mock_socks.port, http_port=self.http_port,
+                                      settings=settings)
+        self.proxy_thread = threading.Thread(target=self.proxy.start, daemon=True)
+        self.proxy_thread.start()
+        time.sleep(0.2)
+
+    def tearDown(self):
+        self.proxy.stop()
+        self.proxy_thread.join(timeout=2.0)
+        self.mock_socks.close()
+
+    def test_head_split_across_segments(self):
+        """A request head arriving in several TCP segments is reassembled"""
+        self._start(echo_body_origin)
+        with socket.create_connection(('localhost', self.http_port), timeout=2.0) as client:
+            client.sendall(b'POST http://example.com/upload HTTP/1.1\r\nHo')
+            time.sleep(0.1)
+            client.sendall(b'st: example.com\r\nContent-Length: 10\r\n\r\n01234')
+            time.sleep(0.1)
+            client.sendall(b'56789')
+            response, _ = read_sized_response(client)
+        self.assertTrue(response.endswith(b'\r\n\r\n0123456789'))
+        self.assertTrue(self.mock_socks.requests[0].startswith(b'POST /upload HTTP/1.1'))
+
+    def test_oversized_head_rejected(self):
+        """Heads above max_header_size get a 431 instead of being truncated"""
+        self._start(echo_body_origin, ProxySettings(max_header_size=1024))
+        with socket.create_connection(('localhost', self.http_port), timeout=2.0) as client:
+            client.sendall(b'GET http://example.com/ HTTP/1.1\r\nX-Big: ' + b'a' * 4096 + b'\r\n\r\n')
+            response = read_http_response(client)
+        self.assertTrue(response.startswith(b'HTTP/1.1 431'))
+        self.assertEqual(self.mock_socks.connections, 0)
+
+    def test_ambiguous_body_framing_rejected(self):
+        """Requests another server could delimit differently get a 400 and never reach the origin"""
+        self._start(echo_body_origin)
+        with socket.create_connection(('localhost', self.http_port), timeout=2.0) as client:
+            client.sendall(b'POST http://example.com/ HTTP/1.1\r\nHost: example.com\r\n'
+                           b'Content-Length: 4, 40\r\n\r\nbody')
+            self.assertTrue(read_http_response(client).startswith(b'HTTP/1.1 400'))
+        self.assertEqual(self.mock_socks.connections, 0)
+
+    def test_expect_continue_answered(self):
+        """A client waiting for 100 Continue is told to send its body"""
+        self._start(echo_body_origin)
+        with socket.create_connection(('localhost', self.http_port), timeout=2.0) as client:
+            client.sendall(b'PUT http://example.com/upload HTTP/1.1\r\nHost: example.com\r\n'
+                           b'Expect: 100-continue\r\nContent-Length: 10\r\n\r\n')
+            self.assertEqual(read_response_head(client), b'HTTP/1.1 100 Continue\r\n\r\n')
+            client.sendall(b'0123456789')
+            response, _ = read_sized_response(client)
+        self.assertTrue(response.endswith(b'\r\n\r\n0123456789'))
+        self.assertNotIn(b'Expect', self.mock_socks.requests[0])
+
+    def test_target_taken_from_request_line(self):
+        """The absolute URI wins over a missing Host header"""
+        self._start(echo_body_origin)
+        with socket.create_connection(('localhost', self.http_port), timeout=2.0) as client:
+            client.sendall(b'GET http://example.com:8080/x HTTP/1.1\r\nConnection: close\r\n\r\n')
+            response = read_http_response(client)
+        self.assertTrue(response.startswith(b'HTTP/1.1 200 OK'))
+        self.assertIn(b'Host: example.com:8080', self.mock_socks.requests[0])
+
+    def test_connect_early_data_forwarded(self):
+        """Bytes sent right behind a CONNECT head reach the tunnel"""
+        self._start(raw_echo_origin)
+        with socket.create_connection(('localhost', self.http_port), timeout=2.0) as client:
+            client.sendall(b'CONNECT example.com:443 HTTP/1.1\r\nHost: example.com:443\r\n\r\nhello')
+            received = b''
+            while not received.endswith(b'hello'):
+                chunk = client.recv(1024)
+                if not chunk:
+                    break
+                received += chunk
+        self.assertEqual(received, b'HTTP/1.1 200 Connection Established\r\n\r\nhello')
+
+
+def batch_origin(server, conn):
+    """Origin that only answers once three requests have arrived, echoing their paths"""
+    buffer = b''
+    while buffer.count(b'\r\n\r\n') < 3:
+        data = conn.recv(4096)
+        if not data:
+            return
+        buffer += data
+    for head in buffer.split(b'\r\n\r\n')[:3]:
+        server.requests.append(head)
+        path = head.split(b' ')[1]
+        conn.sendall(b'HTTP/1.1 200 OK\r\nContent-Length: %d\r\n\r\n%s' % (len(path), path))
+    # Keep the connection open until the proxy closes it
+    conn.recv(4096)
+
+
+class TestPipelining(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        logging.disable(logging.CRITICAL)
+
+    def setUp(self):
+        self.mock_socks = MockSOCKSServer(batch_origin)
+        self.http_port = get_free_port()
+        self.proxy = SOCKStoHTTPProxy(socks_port=self.mock_socks.port, http_port=self.http_port)
+        self.proxy_thread = threading.Thread(target=self.proxy.start, daemon=True)
+        self.proxy_thread.start()
+        time.sleep(0.2)
+
+    def tearDown(self):
+        self.proxy.stop()
+        self.proxy_thread.join(timeout=2.0)
+        self.mock_socks.close()
+
+    def test_pipelined_requests_answered_in_order(self):
+        """Pipelined requests go upstream back-to-back and are answered in order"""
+        requests = b''.join(
+            b'GET http://example.com/%d HTTP/1.1\r\nHost: example.com\r\n\r\n' % i for i in range(1, 4)
+        )
+        with socket.create_connection(('localhost', self.http_port), timeout=2.0) as client:
+            client.sendall(requests)
+            leftover = b''
+            for i in range(1, 4):
+                response, leftover = read_sized_response(client, leftover)
+                self.assertTrue(response.endswith(b'\r\n\r\n/%d' % i))
+        self.assertEqual(self.mock_socks.connections, 1)
+        self.assertEqual(len(self.mock_socks.requests), 3)
+
+
+class TestSOCKS5WarmPool(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        logging.disable(logging.CRITICAL)
+
+    def setUp(self):
+        self.mock_socks = MockSOCKSServer(raw_echo_origin)
+
+    def tearDown(self):
+        self.client.close()
+        self.mock_socks.close()
+
+    def _wait_for_warm(self, count):
+        deadline = time.monotonic() + 2.0
+        while len(self.client._warm) < count and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(len(self.client._warm), count)
+
+    def test_warm_socket_used_for_connect(self):
+        """After the first miss, tunnels start from pre-negotiated sockets"""
+        self.client = SOCKS5Client('localhost', self.mock_socks.port, pool_size=2)
+        first = self.client.connect('example.com', 80)
+        self.assertIsNotNone(first)
+        self._wait_for_warm(2)
+
+        second = self.client.connect('example.com', 80)
+        self.assertIsNotNone(second)
+        second.sendall(b'ping')
+        self.assertEqual(second.recv(4), b'ping')
+        self.assertEqual((self.client.pool_misses, self.client.pool_hits), (1, 1))
+        first.close()
+        second.close()
+
+    def test_stale_sockets_evicted(self):
+        """Sockets older than pool_max_age are never handed out"""
+        self.client = SOCKS5Client('localhost', self.mock_socks.port, pool_size=1, pool_max_age=0.1)
+        self.assertIsNone(self.client._take_warm())
+        self._wait_for_warm(1)
+        time.sleep(0.2)
+        self.assertIsNone(self.client._take_warm())
+        self.assertEqual(self.client.pool_hits, 0)
+
+    def test_close_stops_refill_thread(self):
+        """close() releases pooled sockets and joins the refill thread"""
+        self.client = SOCKS5Client('localhost', self.mock_socks.port, pool_size=1)
+        self.client._take_warm()
+        self._wait_for_warm(1)
+        self.client.close()
+        self.assertFalse(self.client._pool_thread.is_alive())
+        self.assertEqual(len(self.client._warm), 0)
+
+
+def banner_origin(mock, conn):
+    """Origin that speaks first, like SSH or SMTP servers"""
+    conn.sendall(b'220 ready\r\n')
+    conn.recv(1024)
+
+
+class TestAddressTypes(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        logging.disable(logging.CRITICAL)
+
+    def test_parse_authority_forms(self):
+        """Bracketed and bare IPv6 authorities keep the whole address"""
+        cases = {
+            'example.com:8080': ('example.com', 8080),
+            'example.com': ('example.com', 80),
+            '10.0.0.1:81': ('10.0.0.1', 81),
+            '[2001:db8::1]:8443': ('2001:db8::1', 8443),
+            '[2001:db8::1]': ('2001:db8::1', 80),
+            '2001:db8::1': ('2001:db8::1', 80),
+        }
+        for authority, expected in cases.items():
+            host_info = HostInfo.parse_authority(authority)
+            self.assertEqual((host_info.host, host_info.port), expected, authority)
+
+    def test_socks_address_encoding(self):
+        """Literal IPs are sent as ATYP 1/4, names as ATYP 3"""
+        self.assertEqual(socks_address('10.0.0.1'), b'\x01\x0a\x00\x00\x01')
+        self.assertEqual(socks_address('[::1]'), b'\x04' + bytes(15) + b'\x01')
+        self.assertEqual(socks_address('example.com'), b'\x03\x0bexample.com')
+
+    def test_connect_ipv6_literal_target(self):
+        """A bracketed IPv6 CONNECT target reaches the SOCKS server as ATYP 4"""
+        mock_socks = MockSOCKSServer(raw_echo_origin)
+        http_port = get_free_port()
+        proxy = SOCKStoHTTPProxy(socks_port=mock_socks.port, http_port=http_port)
+        proxy_thread = threading.Thread(target=proxy.start, daemon=True)
+        proxy_thread.start()
+        time.sleep(0.2)
+        try:
+            with socket.create_connection(('localhost', http_port), timeout=2.0) as client:
+                client.sendall(b'CONNECT [2001:db8::1]:443 HTTP/1.1\r\nHost: [2001:db8::1]:443\r\n\r\n')
+                self.assertIn(b'200', client.recv(1024))
+            self.assertEqual(mock_socks.connect_requests[0],
+                             b'\x05\x01\x00\x04' + ipaddress.ip_address('2001:db8::1').packed + b'\x01\xbb')
+        finally:
+            proxy.stop()
+            proxy_thread.join(timeout=2.0)
+            mock_socks.close()
+
+
+class TestTrafficCounters(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        logging.disable(logging.CRITICAL)
+
+    def _start(self, origin_handler, settings=None):
+        self.mock_socks = MockSOCKSServer(origin_handler)
+        self.http_port = get_free_port()
+        self.proxy = SOCKStoHTTPProxy(socks_port=self.mock_socks.port, http_port=self.http_port,
+                                      settings=settings)
+        self.proxy_thread = threading.Thread(target=self.proxy.start, daemon=True)
+        self.proxy_thread.start()
+        time.sleep(0.2)
+
+    def tearDown(self):
+        self.proxy.stop()
+        self.proxy_thread.join(timeout=2.0)
+        self.mock_socks.close()
+
+    def _wait_for(self, condition, timeout=2.0):
+        deadline = time.monotonic() + timeout
+        while not condition() and time.monotonic() < deadline:
+            time.sleep(0.02)
+        self.assertTrue(condition())
+
+    def test_tunnel_bytes_counted(self):
+        """CONNECT tunnels report exact bytes in both directions, in every relay mode"""
+        for relay_mode in ('copy', 'auto'):
+            with self.subTest(relay_mode=relay_mode):
+                self._start(raw_echo_origin, ProxySettings(relay_mode=relay_mode))
+                connect = b'CONNECT example.com:443 HTTP/1.1\r\nHost: example.com:443\r\n\r\n'
+                payload = b'x' * 100000
+                with socket.create_connection(('localhost', self.http_port), timeout=2.0) as client:
+                    client.sendall(connect)
+                    client.recv(1024)
+                    client.sendall(payload)
+                    received = 0
+                    while received < len(payload):
+                        received += len(client.recv(65536))
+
+                    snapshot = self.proxy.traffic_snapshot()
+                    self.assertEqual(len(snapshot), 1)
+                    self.assertEqual(snapshot[0]['target'], 'example.com:443')
+                    self.assertEqual(snapshot[0]['bytes_up'], len(connect) + len(payload))
+                    self.assertEqual(snapshot[0]['bytes_down'], len(payload))
+
+                # Closed connections stay in the totals
+                self._wait_for(lambda: not self.proxy.traffic_snapshot())
+                stats = self.proxy.stats()
+                self.assertEqual((stats['bytes_up'], stats['bytes_down']),
+                                 (len(connect) + len(payload), len(payload)))
+                self.tearDown()
+
+    def test_http_request_bytes_counted(self):
+        """Plain HTTP exchanges count the request and response bytes received"""
+        self._start(keep_alive_origin)
+        request = b'GET http://example.com/ HTTP/1.1\r\nHost: example.com\r\n\r\n'
+        with socket.create_connection(('localhost', self.http_port), timeout=2.0) as client:
+            client.sendall(request)
+            read_sized_response(client)
+            counters = self.proxy.traffic_snapshot()[0]
+        origin_response = b'HTTP/1.1 200 OK\r\nContent-Length: 5\r\nConnection: keep-alive\r\n\r\nhello'
+        self.assertEqual((counters['bytes_up'], counters['bytes_down']),
+                         (len(request), len(origin_response)))
+
+
+class TestConnectionRegistry(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        logging.disable(logging.CRITICAL)
+
+    def setUp(self):
+        self.mock_socks = MockSOCKSServer(raw_echo_origin)
+        self.http_port = get_free_port()
+        self.proxy = SOCKStoHTTPProxy(socks_port=self.mock_socks.port, http_port=self.http_port,
+                                      settings=ProxySettings(tunnel_idle_timeout=0.5))
+        self.proxy_thread = threading.Thread(target=self.proxy.start, daemon=True)
+        self.proxy_thread.start()
+        time.sleep(0.2)
+
+    def tearDown(self):
+        self.proxy.stop()
+        self.proxy_thread.join(timeout=2.0)
+        self.mock_socks.close()
+
+    def _open_tunnel(self):
+        client = socket.create_connection(('localhost', self.http_port), timeout=3.0)
+        client.sendall(b'CONNECT example.com:443 HTTP/1.1\r\nHost: example.com:443\r\n\r\n')
+        self.assertIn(b'200', client.recv(1024))
+        return client
+
+    def _wait_for(self, condition, timeout=2.0):
+        deadline = time.monotonic() + timeout
+        while not condition() and time.monotonic() < deadline:
+            time.sleep(0.02)
+        self.assertTrue(condition())
+
+    def test_idle_tunnel_reaped(self):
+        """A silent tunnel is closed after the idle timeout while a busy one survives"""
+        idle = self._open_tunnel()
+        busy = self._open_tunnel()
+        self._wait_for(lambda: [entry['state'] for entry in self.proxy.traffic_snapshot()] == ['tunnel'] * 2)
+
+        for _ in range(10):
+            busy.sendall(b'ping')
+            self.assertEqual(busy.recv(1024), b'ping')
+            time.sleep(0.1)
+
+        self.assertEqual(idle.recv(1024), b'')
+        self.assertEqual(self.proxy.stats()['connections_reaped'], 1)
+        self.assertEqual(len(self.proxy.traffic_snapshot()), 1)
+        busy.close()
+        idle.close()
+
+    def test_tunnel_reaped_after_registry_emptied(self):
+        """A tunnel arriving after every earlier deadline was handled is still reaped"""
+        with socket.create_connection(('localhost', self.http_port), timeout=3.0) as client:
+            client.sendall(b'CONNECT example.com:443 HTTP/1.1\r\nHost: example.com:443\r\n\r\n')
+            client.recv(1024)
+        self._wait_for(lambda: not self.proxy.traffic_snapshot())
+        # Let the reaper drain the heap and wait on an empty one
+        time.sleep(1.0)
+
+        idle = self._open_tunnel()
+        idle.settimeout(3.0)
+        self.assertEqual(idle.recv(1024), b'')
+        self.assertEqual(self.proxy.stats()['connections_reaped'], 1)
+        idle.close()
+
+    def test_closed_tunnel_unregistered(self):
+        """A tunnel closed by the client leaves the registry"""
+        with socket.create_connection(('localhost', self.http_port), timeout=3.0) as client:
+            client.sendall(b'CONNECT example.com:443 HTTP/1.1\r\nHost: example.com:443\r\n\r\n')
+            client.recv(1024)
+        self._wait_for(lambda: not self.proxy.traffic_snapshot())
+        self.assertEqual(self.proxy.stats()['connections_active'], 0)
+
+
+class TestAdmissionControl(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        logging.disable(logging.CRITICAL)
+
+    def _start(self, **settings):
+        self.mock_socks = MockSOCKSServer(keep_alive_origin)
+        self.http_port = get_free_port()
+        self.proxy = SOCKStoHTTPProxy(socks_port=self.mock_socks.port, http_port=self.http_port,
+                                      settings=ProxySettings(**settings))
+        self.proxy_thread = threading.Thread(target=self.proxy.start, daemon=True)
+        self.proxy_thread.start()
+        time.sleep(0.2)
+
+    def tearDown(self):
+        self.proxy.stop()
+        self.proxy_thread.join(timeout=2.0)
+        self.mock_socks.close()
+
+    def _connect(self, request=b'GET http://example.com/ HTTP/1.1\r\nHost: example.com\r\n\r\n'):
+        client = socket.create_connection(('localhost', self.http_port), timeout=3.0)
+        client.sendall(request)
+        return client
+
+    def test_queue_then_shed(self):
+        """Connections over the limit wait for a slot; those beyond the queue get 503 at once"""
+        self._start(max_connections=1, admission_queue_size=1)
+        holder = self._connect(b'CONNECT example.com:80 HTTP/1.1\r\nHost: example.com:80\r\n\r\n')
+        self.assertIn(b'200', holder.recv(1024))
+        waiting = self._connect()
+        time.sleep(0.2)
+        with self._connect() as shed:
+            response = read_http_response(shed)
+        self.assertTrue(response.startswith(b'HTTP/1.1 503'))
+        self.assertIn(b'Retry-After: 5\r\n', response)
+
+        holder.close()
+        response, _ = read_sized_response(waiting)
+        self.assertTrue(response.endswith(b'hello'))
+        waiting.close()
+        stats = self.proxy.stats()
+        self.assertEqual((stats['connections_queued'], stats['connections_shed']), (1, 1))
+
+    def test_queue_timeout(self):
+        """A queued connection that gets no slot in time is answered with 503"""
+        self._start(max_connections=1, admission_queue_timeout=0.3)
+        holder = self._connect(b'CONNECT example.com:80 HTTP/1.1\r\nHost: example.com:80\r\n\r\n')
+        holder.recv(1024)
+        with self._connect() as waiting:
+            self.assertTrue(read_http_response(waiting).startswith(b'HTTP/1.1 503'))
+        holder.close()
+        self.assertEqual(self.proxy.stats()['queue_timeouts'], 1)
+
+    def test_header_deadline(self):
+        """A client trickling its request head is cut off when the whole head is overdue"""
+        self._start(header_timeout=0.5)
+        with self._connect(b'GET http://example.com/ HTTP/1.1\r\n') as client:
+            started = time.monotonic()
+            for _ in range(3):
+                time.sleep(0.2)
+                try:
+                    client.sendall(b'X-Slow: 1\r\n')
+                except OSError:
+                    break
+            response = read_http_response(client)
+        self.assertTrue(response.startswith(b'HTTP/1.1 408'))
+        self.assertLess(time.monotonic() - started, 1.5)
+        deadline = time.monotonic() + 2.0
+        while self.proxy.stats()['header_timeouts'] == 0 and time.monotonic() < deadline:
+            time.sleep(0.02)
+        self.assertEqual(self.proxy.stats()['header_timeouts'], 1)
+
+
+class TestBandwidthShaping(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        logging.disable(logging.CRITICAL)
+
+    def _timed_consume(self, shaper, client, size, results, weight_key=None):
+        started = time.monotonic()
+        shaper.consume(client, size)
+        results[weight_key or client] = time.monotonic() - started
+
+    def test_client_rate_limit(self):
+        """A client is held to its rate once its burst is spent"""
+        shaper = BandwidthShaper(client_rate=1000000)
+        started = time.monotonic()
+        shaper.consume('10.0.0.1', 400000)
+        shaper.consume('10.0.0.1', 1)
+        self.assertAlmostEqual(time.monotonic() - started, 0.3, delta=0.15)
+        self.assertEqual(shaper.report()['10.0.0.1']['bytes_down'], 400001)
+
+        # Other clients have their own budget
+        started = time.monotonic()
+        shaper.consume('10.0.0.2', 16384)
+        self.assertLess(time.monotonic() - started, 0.05)
+
+    def test_interactive_client_not_starved(self):
+        """A small exchange waits one turn behind a bulk transfer, not for the whole transfer"""
+        shaper = BandwidthShaper(rate=1000000)
+        results = {}
+        bulk = threading.Thread(target=self._timed_consume, args=(shaper, 'bulk', 1000000, results))
+        bulk.start()
+        time.sleep(0.1)
+        self._timed_consume(shaper, 'interactive', 2000, results)
+        bulk.join()
+        self.assertLess(results['interactive'], 0.1)
+        self.assertGreater(results['bulk'], 0.7)
+
+    def test_weighted_turns(self):
+        """Concurrent transfers share the listener budget in proportion to their weights"""
+        shaper = BandwidthShaper(rate=2000000)
+        shaper.set_client('heavy', weight=3)
+        stop = threading.Event()
+
+        def transfer(client):
+            while not stop.is_set():
+                shaper.consume(client, 16384)
+
+        threads = [threading.Thread(target=transfer, args=(client,)) for client in ('heavy', 'light')]
+        for thread in threads:
+            thread.start()
+        # Compare the shares once the initial burst is spent
+        time.sleep(0.2)
+        before = shaper.report()
+        time.sleep(0.6)
+        after = shaper.report()
+        stop.set()
+        for thread in threads:
+            thread.join()
+        heavy, light = (after[client]['bytes_down'] - before[client]['bytes_down'] for client in ('heavy', 'light'))
+        self.assertAlmostEqual(heavy / light, 3, delta=0.6)
+
+    def test_tunnel_shaped_and_reported(self):
+        """Tunnel traffic follows limits changed while the proxy runs and is reported per client"""
+        mock_socks = MockSOCKSServer(raw_echo_origin)
+        http_port = get_free_port()
+        proxy = SOCKStoHTTPProxy(socks_port=mock_socks.port, http_port=http_port)
+        proxy_thread = threading.Thread(target=proxy.start, daemon=True)
+        proxy_thread.start()
+        time.sleep(0.2)
+        try:
+            proxy.shaper.set_client('127.0.0.1', rate=500000)
+            with socket.create_connection(('localhost', http_port), timeout=3.0) as client:
+                client.sendall(b'CONNECT example.com:443 HTTP/1.1\r\nHost: example.com:443\r\n\r\n')
+                client.recv(1024)
+                payload = b'x' * 200000
+                started = time.monotonic()
+                client.sendall(payload)
+                received = 0
+                while received < len(payload):
+                    received += len(client.recv(65536))
+                # Both directions draw on the same client budget
+                self.assertGreater(time.monotonic() - started, 0.5)
+
+                report = proxy.bandwidth_report()['127.0.0.1']
+                self.assertEqual((report['rate'], report['connections']), (500000, 1))
+                self.assertEqual(report['bytes_down'], len(payload))
+                self.assertGreater(report['throttled'], 0)
+        finally:
+            proxy.stop()
+            proxy_thread.join(timeout=2.0)
+            mock_socks.close()
+
+
+class TestRoutingRules(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        logging.disable(logging.CRITICAL)
+
+    def setUp(self):
+        self.mock_socks = MockSOCKSServer(keep_alive_origin)
+        self.http_port = get_free_port()
+        self.proxy = SOCKStoHTTPProxy(socks_port=self.mock_socks.port, http_port=self.http_port)
+        self.proxy_thread = threading.Thread(target=self.proxy.start, daemon=True)
+        self.proxy_thread.start()
+        time.sleep(0.2)
+
+    def tearDown(self):
+        self.proxy.stop()
+        self.proxy_thread.join(timeout=2.0)
+        self.mock_socks.close()
+
+    def test_direct_and_reject(self):
+        """Direct destinations bypass the SOCKS server, rejected ones get 403"""
+        origin = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        origin.bind(('127.0.0.1', 0))
+        origin.listen(1)
+
+        def serve():
+            conn, _ = origin.accept()
+            with conn:
+                head, _ = self.mock_socks.read_request(conn)
+                conn.sendall(b'HTTP/1.1 200 OK\r\nContent-Length: 6\r\n\r\ndirect')
+
+        server_thread = threading.Thread(target=serve, daemon=True)
+        server_thread.start()
+        self.proxy.rules.swap(RuleSet.parse('direct 127.0.0.0/8\nreject ads.example.net'))
+
+        origin_port = origin.getsockname()[1]
+        request = f'GET http://127.0.0.1:{origin_port}/ HTTP/1.1\r\nHost: 127.0.0.1:{origin_port}\r\n\r\n'
+        with socket.create_connection(('localhost', self.http_port), timeout=3.0) as client:
+            client.sendall(request.encode())
+            response, _ = read_sized_response(client)
+        self.assertTrue(response.endswith(b'direct'))
+        server_thread.join(timeout=2.0)
+        origin.close()
+
+        with socket.create_connection(('localhost', self.http_port), timeout=3.0) as client:
+            client.sendall(b'CONNECT pixel.ads.example.net:443 HTTP/1.1\r\nHost: pixel.ads.example.net:443\r\n\r\n')
+            self.assertTrue(read_http_response(client).startswith(b'HTTP/1.1 403'))
+
+        self.assertEqual(self.mock_socks.connections, 0)
+        self.assertEqual([entry['hits'] for entry in self.proxy.rules.report()], [1, 1, 0])
+        stats = self.proxy.stats()
+        self.assertEqual((stats['rule_hits:direct:127.0.0.0/8'], stats['rule_hits:reject:ads.example.net'],
+                          stats['rule_hits:tunnel:default']), (1, 1, 0))
+
+    def test_rule_change_applies_to_pooled_connections(self):
+        """An idle pooled tunnel does not carry requests the new rules reject"""
+        request = b'GET http://example.com/ HTTP/1.1\r\nHost: example.com\r\nProxy-Connection: close\r\n\r\n'
+        with socket.create_connection(('localhost', self.http_port), timeout=3.0) as client:
+            client.sendall(request)
+            # Read to the close, by which time the upstream connection is back in the pool
+            self.assertTrue(read_http_response(client).endswith(b'hello'))
+
+        self.proxy.rules.swap(RuleSet.parse('reject example.com'))
+        with socket.create_connection(('localhost', self.http_port), timeout=3.0) as client:
+            client.sendall(request)
+            self.assertTrue(read_http_response(client).startswith(b'HTTP/1.1 403'))
+        self.assertEqual(len(self.mock_socks.requests), 1)
+
+    def test_blocklist(self):
+        """Blocked destinations are answered locally: 403 for CONNECT, an empty 204 otherwise"""
+        self.proxy.blocklist = Blocklist.parse('0.0.0.0 tracker.example.com\n||ads.example.net^\n')
+
+        with socket.create_connection(('localhost', self.http_port), timeout=3.0) as client:
+            client.sendall(b'CONNECT pixel.ads.example.net:443 HTTP/1.1\r\nHost: pixel.ads.example.net:443\r\n\r\n')
+            self.assertTrue(read_http_response(client).startswith(b'HTTP/1.1 403'))
+
+        with socket.create_connection(('localhost', self.http_port), timeout=3.0) as client:
+            client.sendall(b'GET http://tracker.example.com/collect HTTP/1.1\r\nHost: tracker.example.com\r\n\r\n')
+            response = read_http_response(client)
+        self.assertTrue(response.startswith(b'HTTP/1.1 204'))
+        self.assertNotIn(b'Content-Length', response)
+
+        self.assertEqual(self.mock_socks.connections, 0)
+        stats = self.proxy.stats()
+        self.assertEqual(stats['requests_blocked'], 2)
+        self.assertEqual(stats['blocklist_entries'], 2)
+
+
+class TestNegativeCache(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        logging.disable(logging.CRITICAL)
+
+    def setUp(self):
+        self.mock_socks = MockSOCKSServer(keep_alive_origin)
+        # Host unreachable
+        self.mock_socks.reply = b'\x05\x04\x00\x01\x00\x00\x00\x00\x00\x00'
+        self.http_port = get_free_port()
+        self.proxy = SOCKStoHTTPProxy(socks_port=self.mock_socks.port, http_port=self.http_port)
+        self.proxy_thread = threading.Thread(target=self.proxy.start, daemon=True)
+        self.proxy_thread.start()
+        time.sleep(0.2)
+
+    def tearDown(self):
+        self.proxy.stop()
+        self.proxy_thread.join(timeout=2.0)
+        self.mock_socks.close()
+
+    def _connect(self, target):
+        with socket.create_connection(('localhost', self.http_port), timeout=3.0) as client:
+            client.sendall(f'CONNECT {target} HTTP/1.1\r\nHost: {target}\r\n\r\n'.encode())
+            return read_http_response(client)
+
+    def test_unreachable_target_fails_fast(self):
+        """A refused destination is answered locally until its entry expires"""
+        self.assertTrue(self._connect('gone.example.com:443').startswith(b'HTTP/1.1 502'))
+        self.assertTrue(self._connect('GONE.example.com:443').startswith(b'HTTP/1.1 502'))
+        self.assertEqual(self.mock_socks.connections, 1)
+        stats = self.proxy.stats()
+        self.assertEqual(stats['negative_cache_hits'], 1)
+        self.assertEqual(stats['negative_cache_entries'], 1)
+
+        # Another port of the same host is a different destination
+        self._connect('gone.example.com:8443')
+        self.assertEqual(self.mock_socks.connections, 2)
+
+    def test_ttl_expired_maps_to_gateway_timeout(self):
+        self.mock_socks.reply = b'\x05\x06\x00\x01\x00\x00\x00\x00\x00\x00'
+        self.assertTrue(self._connect('slow.example.com:443').startswith(b'HTTP/1.1 504'))
+        self.assertTrue(self._connect('slow.example.com:443').startswith(b'HTTP/1.1 504'))
+        self.assertEqual(self.mock_socks.connections, 1)
+
+    def test_ruleset_refusal_is_not_cached(self):
+        """Only replies about the destination itself are remembered"""
+        self.mock_socks.reply = b'\x05\x02\x00\x01\x00\x00\x00\x00\x00\x00'
+        self.assertTrue(self._connect('policy.example.com:443').startswith(b'HTTP/1.1 502'))
+        self._connect('policy.example.com:443')
+        self.assertEqual(self.mock_socks.connections, 2)
+
+    def test_expiry_and_size_cap(self):
+        cache = NegativeCache(ttl=0.2, max_entries=2, jitter=0.5)
+        for port in (1, 2, 3):
+            cache.add('example.com', port, SOCKSResponse.CONNECTION_REFUSED)
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get('example.com', 1))
+        self.assertEqual(cache.get('example.com', 3), SOCKSResponse.CONNECTION_REFUSED)
+
+        # Jittered expiry stays within ttl * (1 +- jitter)
+        time.sleep(0.35)
+        self.assertIsNone(cache.get('example.com', 2))
+        self.assertIsNone(cache.get('example.com', 3))
+        self.assertEqual(len(cache), 0)
+
+
+class TestTunnelHold(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        logging.disable(logging.CRITICAL)
+
+    def setUp(self):
+        self.mock_socks = None
+        self.socks_port = get_free_port()
+        self.http_port = get_free_port()
+        settings = ProxySettings(tunnel_hold_timeout=3.0, tunnel_probe_interval=0.05)
+        self.proxy = SOCKStoHTTPProxy(socks_port=self.socks_port, http_port=self.http_port, settings=settings)
+        self.proxy_thread = threading.Thread(target=self.proxy.start, daemon=True)
+        self.proxy_thread.start()
+        time.sleep(0.2)
+
+    def tearDown(self):
+        self.proxy.stop()
+        self.proxy_thread.join(timeout=2.0)
+        if self.mock_socks:
+            self.mock_socks.close()
+
+    def test_waiters_resume_together(self):
+        up = threading.Event()
+        probes = []
+        hold = TunnelHold(lambda: probes.append(1) or up.is_set(), max_waiting=2, probe_interval=0.05)
+        stop_event = threading.Event()
+        results = []
+        waiters = [threading.Thread(target=lambda: results.append(hold.wait(stop_event, hold.deadline())))
+                   for _ in range(2)]
+        for waiter in waiters:
+            waiter.start()
+        time.sleep(0.3)
+        self.assertEqual(len(hold), 2)
+        self.assertFalse(hold.wait(stop_event, hold.deadline()), "A full queue turns requests away")
+
+        up.set()
+        for waiter in waiters:
+            waiter.join(timeout=2.0)
+        self.assertEqual(results, [True, True])
+        # One probe per interval is shared by all waiters
+        self.assertLess(len(probes), 10)
+        self.assertEqual((hold.resumed, hold.rejected), (2, 1))
+
+        down = TunnelHold(lambda: False, probe_interval=0.05)
+        self.assertFalse(down.wait(stop_event, time.monotonic() + 0.2))
+        self.assertEqual(down.expired, 1)
+
+    def test_connect_held_until_socks_listener_returns(self):
+        """A CONNECT made while the tunnel is down completes once it is back"""
+        def reconnect():
+            time.sleep(0.5)
+            self.mock_socks = MockSOCKSServer(raw_echo_origin, port=self.socks_port)
+
+        threading.Thread(target=reconnect, daemon=True).start()
+        started = time.monotonic()
+        with socket.create_connection(('localhost', self.http_port), timeout=5.0) as client:
+            client.sendall(b'CONNECT example.com:443 HTTP/1.1\r\nHost: example.com:443\r\n\r\n')
+            self.assertTrue(read_response_head(client).startswith(b'HTTP/1.1 200'))
+            client.sendall(b'ping')
+            self.assertEqual(client.recv(64), b'ping')
+        self.assertGreaterEqual(time.monotonic() - started, 0.5)
+
+        stats = self.proxy.stats()
+        self.assertEqual((stats['tunnel_holds'], stats['tunnel_hold_resumed']), (1, 1))
+        self.assertEqual(stats['tunnel_waiting'], 0)
+
+    def test_hold_expires(self):
+        """Requests give up with 503 when the tunnel stays down past the deadline"""
+        self.proxy.tunnel_hold.timeout = 0.3
+        with socket.create_connection(('localhost', self.http_port), timeout=5.0) as client:
+            client.sendall(b'CONNECT example.com:443 HTTP/1.1\r\nHost: example.com:443\r\n\r\n')
+            self.assertTrue(read_http_response(client).startswith(b'HTTP/1.1 503'))
+        self.assertEqual(self.proxy.stats()['tunnel_hold_expired'], 1)
+
+    def test_non_idempotent_request_fails_fast(self):
+        with socket.create_connection(('localhost', self.http_port), timeout=5.0) as client:
+            client.sendall(b'POST http://example.com/ HTTP/1.1\r\nHost: example.com\r\n'
+                           b'Content-Length: 2\r\n\r\nhi')
+            self.assertTrue(read_http_response(client).startswith(b'HTTP/1.1 503'))
+        self.assertEqual(self.proxy.stats()['tunnel_holds'], 0)
+
+    def test_get_replayed_after_tunnel_drop(self):
+        """A GET whose tunnel dies before the response is sent again"""
+        def origin(server, conn):
+            head, _ = server.read_request(conn)
+            if server.connections == 1:
+                return  # The tunnel drops with the request in flight
+            conn.sendall(b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok')
+
+        self.mock_socks = MockSOCKSServer(origin, port=self.socks_port)
+        with socket.create_connection(('localhost', self.http_port), timeout=5.0) as client:
+            client.sendall(b'GET http://example.com/ HTTP/1.1\r\nHost: example.com\r\n\r\n')
+            response, _ = read_sized_response(client)
+        self.assertTrue(response.endswith(b'ok'))
+        self.assertEqual(len(self.mock_socks.requests), 2)
+        self.assertEqual(self.proxy.stats()['requests_replayed'], 1)
+
+    def test_get_not_replayed_after_response_timeout(self):
+        """A slow origin is not sent the request a second time"""
+        def origin(server, conn):
+            server.read_request(conn)
+            time.sleep(1.0)
+
+        self.proxy.settings.response_timeout = 0.3
+        self.mock_socks = MockSOCKSServer(origin, port=self.socks_port)
+        with socket.create_connection(('localhost', self.http_port), timeout=5.0) as client:
+            client.sendall(b'GET http://example.com/ HTTP/1.1\r\nHost: example.com\r\n\r\n')
+            self.assertFalse(read_http_response(client).startswith(b'HTTP/1.1 200'))
+        self.assertEqual(len(self.mock_socks.requests), 1)
+        self.assertEqual(self.proxy.stats()['requests_replayed'], 0)
+
+
+class TestInProcessChannels(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        logging.disable(logging.CRITICAL)
+
+    def setUp(self):
+        self.opened = []
+        self.threads = []
+        self.refused = set()
+        self.http_port = get_free_port()
+        # No SOCKS server listens on the port: every tunnel must come from open_channel
+        self.proxy = SOCKStoHTTPProxy(socks_port=get_free_port(), http_port=self.http_port,
+                                      open_channel=self._open_channel)
+        self.proxy_thread = threading.Thread(target=self.proxy.start, daemon=True)
+        self.proxy_thread.start()
+        time.sleep(0.2)
+
+    def tearDown(self):
+        self.proxy.stop()
+        self.proxy_thread.join(timeout=2.0)
+        for thread in self.threads:
+            thread.join(timeout=2.0)
+
+    def _open_channel(self, host, port, timeout):
+        """Stand-in for SSHClient.open_channel with an echoing destination"""
+        self.opened.append((host, port, timeout))
+        if (host, port) in self.refused:
+            raise ConnectionRefusedError(f"{host}:{port}")
+        local, remote = socket.socketpair()
+        thread = threading.Thread(target=raw_echo_origin, args=(None, remote), daemon=True)
+        self.threads.append(thread)
+        thread.start()
+        return local
+
+    def test_connect_through_channel(self):
+        """CONNECT tunnels relay into the channel without any SOCKS exchange"""
+        with socket.create_connection(('localhost', self.http_port), timeout=3.0) as client:
+            client.sendall(b'CONNECT example.com:443 HTTP/1.1\r\nHost: example.com:443\r\n\r\n')
+            self.assertTrue(read_response_head(client).startswith(b'HTTP/1.1 200'))
+            client.sendall(b'ping')
+            self.assertEqual(client.recv(64), b'ping')
+
+        self.assertEqual(self.opened, [('example.com', 443, self.proxy.settings.connect_timeout)])
+
+    def test_refused_channel_is_negatively_cached(self):
+        self.refused.add(('closed.example.com', 443))
+        for _ in range(2):
+            with socket.create_connection(('localhost', self.http_port), timeout=3.0) as client:
+                client.sendall(b'CONNECT closed.example.com:443 HTTP/1.1\r\nHost: closed.example.com:443\r\n\r\n')
+                self.assertTrue(read_http_response(client).startswith(b'HTTP/1.1 502'))
+        self.assertEqual(len(self.opened), 1)
+
+    def test_held_request_resumes_when_ssh_is_back(self):
+        """A request held while SSH is down waits for the connection, not for retries to succeed"""
+        ssh_up = threading.Event()
+
+        def open_channel(host, port, timeout):
+            if not ssh_up.is_set():
+                raise OSError("SSH tunnel is not connected")
+            return self._open_channel(host, port, timeout)
+
+        http_port = get_free_port()
+        proxy = SOCKStoHTTPProxy(socks_port=get_free_port(), http_port=http_port,
+                                 settings=ProxySettings(tunnel_hold_timeout=3.0, tunnel_probe_interval=0.05),
+                                 open_channel=open_channel, channel_ready=ssh_up.is_set)
+        proxy_thread = threading.Thread(target=proxy.start, daemon=True)
+        proxy_thread.start()
+        self.addCleanup(proxy_thread.join, 2.0)
+        self.addCleanup(proxy.stop)
+        time.sleep(0.2)
+
+        reconnect = threading.Timer(0.5, ssh_up.set)
+        reconnect.start()
+        with socket.create_connection(('localhost', http_port), timeout=5.0) as client:
+            client.sendall(b'CONNECT example.com:443 HTTP/1.1\r\nHost: example.com:443\r\n\r\n')
+            self.assertTrue(read_response_head(client).startswith(b'HTTP/1.1 200'))
+        reconnect.join()
+        # One hold for the one request, however many probes ran while it waited
+        self.assertEqual((proxy.tunnel_hold.held, proxy.tunnel_hold.resumed), (1, 1))
+
+
+@unittest.skipUnless(TRANSPARENT_SUPPORTED, "SO_ORIGINAL_DST not available")
+class TestTransparentMode(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        logging.disable(logging.CRITICAL)
+
+    def setUp(self):
+        self.mock_socks = MockSOCKSServer(raw_echo_origin)
+        self.http_port = get_free_port()
+        self.proxy = SOCKStoHTTPProxy(socks_port=self.mock_socks.port, http_port=self.http_port,
+                                      settings=ProxySettings(transparent=True))
+        self.proxy_thread = threading.Thread(target=self.proxy.start, daemon=True)
+        self.proxy_thread.start()
+        time.sleep(0.2)
+
+    def tearDown(self):
+        self.proxy.stop()
+        self.proxy_thread.join(timeout=2.0)
+        self.mock_socks.close()
+
+    def test_original_destination(self):
+        """The sockaddr netfilter reports is decoded for both address families"""
+        sock = MagicMock(family=socket.AF_INET)
+        sock.getsockopt.return_value = b'\x02\x00\x01\xbb\x0a\x01\x02\x03' + bytes(8)
+        self.assertEqual(original_destination(sock), HostInfo('10.1.2.3', 443))
+
+        sock = MagicMock(family=socket.AF_INET6)
+        sock.getsockopt.return_value = (b'\x0a\x00\x00\x50' + bytes(4) +
+                                        ipaddress.ip_address('2001:db8::1').packed + bytes(4))
+        self.assertEqual(original_destination(sock), HostInfo('2001:db8::1', 80))
+
+        sock.getsockopt.side_effect = OSError(2, 'No such file or directory')
+        self.assertIsNone(original_destination(sock))
+
+    def test_relays_redirected_connection(self):
+        """Bytes go straight to the original destination without any HTTP exchange"""
+        with patch('socks_to_http_proxy.original_destination', return_value=HostInfo('10.1.2.3', 5222)):
+            with socket.create_connection(('localhost', self.http_port), timeout=3.0) as client:
+                client.sendall(b'<stream:stream>')
+                self.assertEqual(client.recv(64), b'<stream:stream>')
+
+        self.assertEqual(self.mock_socks.connect_requests[-1][3:],
+                         b'\x01\x0a\x01\x02\x03\x14\x66')
+
+    def test_unredirected_connection_is_closed(self):
+        """A connection made to the listener directly is not relayed back into it"""
+        with socket.create_connection(('localhost', self.http_port), timeout=3.0) as client:
+            self.assertEqual(client.recv(64), b'')
+        self.assertEqual(self.mock_socks.connections, 0)
+
+
+class TestProxyMetrics(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        logging.disable(logging.CRITICAL)
+
+    def setUp(self):
+        self.mock_socks = MockSOCKSServer(keep_alive_origin)
+        self.http_port = get_free_port()
+        self.metrics_port = get_free_port()
+        self.proxy = SOCKStoHTTPProxy(socks_port=self.mock_socks.port, http_port=self.http_port,
+                                      settings=ProxySettings(metrics_port=self.metrics_port))
+        self.proxy_thread = threading.Thread(target=self.proxy.start, daemon=True)
+        self.proxy_thread.start()
+        time.sleep(0.2)
+
+    def tearDown(self):
+        self.proxy.stop()
+        self.proxy_thread.join(timeout=2.0)
+        self.mock_socks.close()
+
+    def test_scrape_covers_traffic_latency_and_errors(self):
+        """The metrics endpoint reports connections, bytes, connect latency and errors by type"""
+        with socket.create_connection(('localhost', self.http_port), timeout=3.0) as client:
+            client.sendall(b'GET http://example.com/ HTTP/1.1\r\nHost: example.com\r\n\r\n')
+            read_sized_response(client)
+        with socket.create_connection(('localhost', self.http_port), timeout=3.0) as client:
+            client.sendall(b'GET / HTTP/1.1\r\n\r\n')
+            read_http_response(client)
+
+        lines = requests.get(f'http://localhost:{self.metrics_port}/metrics', timeout=2.0).text.splitlines()
+        self.assertIn('socks_http_proxy_connections_accepted_total 2', lines)
+        self.assertIn('# TYPE socks_http_proxy_connections_active gauge', lines)
+        self.assertIn('socks_http_proxy_connect_seconds_count{route="tunnel"} 1', lines)
+        self.assertIn('socks_http_proxy_socks_handshake_seconds_count{socket="fresh"} 1', lines)
+        self.assertIn('socks_http_proxy_errors_total{type="bad_request"} 1', lines)
+        self.assertIn('socks_http_proxy_rule_hits_total{action="tunnel",pattern="default"} 1', lines)
+        self.assertTrue(any(line.startswith('socks_http_proxy_bytes_down_total ') for line in lines))
+
+
+def cache_origin(server, conn):
+    """Origin serving a fresh resource and an ETag-validated one"""
+    rest = b''
+    while True:
+        head, rest = server.read_request(conn, rest)
+        if head is None:
+            return
+        if head.startswith(b'GET /fresh'):
+            conn.sendall(b'HTTP/1.1 200 OK\r\nCache-Control: max-age=60\r\nContent-Length: 5\r\n\r\nfresh')
+        elif b'If-None-Match: "v1"' in head:
+            conn.sendall(b'HTTP/1.1 304 Not Modified\r\nETag: "v1"\r\n\r\n')
+        else:
+            conn.sendall(b'HTTP/1.1 200 OK\r\nCache-Control: no-cache\r\nETag: "v1"\r\n'
+                         b'Transfer-Encoding: chunked\r\n\r\n6\r\ntagged\r\n0\r\n\r\n')
+
+
+class TestResponseCaching(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        logging.disable(logging.CRITICAL)
+
+    def setUp(self):
+        self.mock_socks = MockSOCKSServer(cache_origin)
+        self.http_port = get_free_port()
+        self.proxy = SOCKStoHTTPProxy(socks_port=self.mock_socks.port, http_port=self.http_port,
+                                      settings=ProxySettings(cache_memory_size=1024 * 1024))
+        self.proxy_thread = threading.Thread(target=self.proxy.start, daemon=True)
+        self.proxy_thread.start()
+        time.sleep(0.2)
+
+    def tearDown(self):
+        self.proxy.stop()
+        self.proxy_thread.join(timeout=2.0)
+        self.mock_socks.close()
+
+    def _get(self, client, path):
+        client.sendall(f'GET http://example.com{path} HTTP/1.1\r\nHost: example.com\r\n\r\n'.encode())
+        response, _ = read_sized_response(client)
+        return response
+
+    def test_fresh_response_served_from_cache(self):
+        """A fresh stored response is answered without contacting the origin"""
+        with socket.create_connection(('localhost', self.http_port), timeout=2.0) as client:
+            self.assertTrue(self._get(client, '/fresh').endswith(b'fresh'))
+            cached = self._get(client, '/fresh')
+        self.assertTrue(cached.endswith(b'\r\n\r\nfresh'))
+        self.assertIn(b'Age: ', cached)
+        self.assertEqual(len(self.mock_socks.requests), 1)
+        self.assertEqual(self.proxy.stats()['cache_hits'], 1)
+
+    def test_revalidation_serves_stored_body(self):
+        """A no-cache response is revalidated with If-None-Match and served from the store on 304"""
+        with socket.create_connection(('localhost', self.http_port), timeout=2.0) as client:
+            self.assertTrue(self._get(client, '/tagged').endswith(b'tagged\r\n0\r\n\r\n'))
+            revalidated = self._get(client, '/tagged')
+        self.assertTrue(revalidated.startswith(b'HTTP/1.1 200 OK'))
+        self.assertTrue(revalidated.endswith(b'Content-Length: 6\r\nAge: 0\r\nConnection: keep-alive\r\n\r\ntagged'))
+        self.assertIn(b'If-None-Match: "v1"', self.mock_socks.requests[1])
+        self.assertEqual(self.proxy.stats()['cache_revalidations'], 1)
+
+    def test_unsafe_method_invalidates(self):
+        """A POST to a cached URI drops the stored response"""
+        with socket.create_connection(('localhost', self.http_port), timeout=2.0) as client:
+            self._get(client, '/fresh')
+            client.sendall(b'POST http://example.com/fresh HTTP/1.1\r\nHost: example.com\r\n'
+                           b'Content-Length: 0\r\n\r\n')
+            read_sized_response(client)
+            self._get(client, '/fresh')
+        self.assertEqual(len(self.mock_socks.requests), 3)
+
+
+def slow_origin(server, conn):
+    """Origin that takes a while to produce the response, as for a large artifact"""
+    rest = b''
+    while True:
+        head, rest = server.read_request(conn, rest)
+        if head is None:
+            return
+        time.sleep(0.3)
+        if head.startswith(b'GET /chunked'):
+            conn.sendall(b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n5\r\nhello\r\n')
+            time.sleep(0.2)
+            conn.sendall(b'6\r\n world\r\n0\r\n\r\n')
+        else:
+            conn.sendall(b'HTTP/1.1 200 OK\r\nContent-Length: 10\r\n\r\n01234')
+            time.sleep(0.2)
+            conn.sendall(b'56789')
+
+
+class TestCollapsedForwarding(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        logging.disable(logging.CRITICAL)
+
+    def setUp(self):
+        self.mock_socks = MockSOCKSServer(slow_origin)
+        self.http_port = get_free_port()
+        self.proxy = SOCKStoHTTPProxy(socks_port=self.mock_socks.port, http_port=self.http_port,
+                                      settings=ProxySettings(collapsed_forwarding=True))
+        self.proxy_thread = threading.Thread(target=self.proxy.start, daemon=True)
+        self.proxy_thread.start()
+        time.sleep(0.2)
+
+    def tearDown(self):
+        self.proxy.stop()
+        self.proxy_thread.join(timeout=2.0)
+        self.mock_socks.close()
+
+    def _fetch_concurrently(self, path, clients=4):
+        responses = [None] * clients
+
+        def fetch(index):
+            with socket.create_connection(('localhost', self.http_port), timeout=3.0) as client:
+                client.sendall(f'GET http://example.com{path} HTTP/1.1\r\nHost: example.com\r\n\r\n'.encode())
+                responses[index], _ = read_sized_response(client)
+
+        threads = [threading.Thread(target=fetch, args=(index,)) for index in range(clients)]
+        for thread in threads:
+            thread.start()
+            time.sleep(0.02)
+        for thread in threads:
+            thread.join(timeout=5.0)
+        return responses
+
+    def test_identical_gets_share_one_fetch(self):
+        """Concurrent identical GETs cause a single upstream request"""
+        responses = self._fetch_concurrently('/artifact')
+        for response in responses:
+            self.assertTrue(response.endswith(b'Content-Length: 10\r\nConnection: keep-alive\r\n\r\n0123456789'))
+        self.assertEqual(len(self.mock_socks.requests), 1)
+        stats = self.proxy.stats()
+        self.assertEqual((stats['collapsed_leaders'], stats['collapsed_followers']), (1, 3))
+
+    def test_chunked_body_fetched_separately(self):
+        """Responses without a Content-Length are not shared, so none is cut off past the buffer size"""
+        responses = self._fetch_concurrently('/chunked', clients=2)
+        for response in responses:
+            self.assertTrue(response.endswith(b'5\r\nhello\r\n6\r\n world\r\n0\r\n\r\n'))
+        self.assertEqual(len(self.mock_socks.requests), 2)
+
+    def test_leader_disconnect_keeps_followers_served(self):
+        """A leader's client leaving mid-body does not truncate the followers' responses"""
+        request = b'GET http://example.com/artifact HTTP/1.1\r\nHost: example.com\r\n\r\n'
+        leader = socket.create_connection(('localhost', self.http_port), timeout=3.0)
+        leader.sendall(request)
+        time.sleep(0.05)
+        with socket.create_connection(('localhost', self.http_port), timeout=3.0) as follower:
+            follower.sendall(request)
+            self.assertIn(b'200 OK', leader.recv(1024))
+            # Reset the connection so the proxy's next send to it fails
+            leader.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+            leader.close()
+            response, _ = read_sized_response(follower)
+        self.assertTrue(response.endswith(b'0123456789'))
+        self.assertEqual(len(self.mock_socks.requests), 1)
+
+
+class TestSOCKS5Handshake(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        logging.disable(logging.CRITICAL)
+
+    def setUp(self):
+        self.mock_socks = None
+
+    def tearDown(self):
+        if self.mock_socks is not None:
+            self.mock_socks.close()
+
+    def _connect(self, origin, reply=None, optimistic=True):
+        self.mock_socks = MockSOCKSServer(origin)
+        if reply is not None:
+            self.mock_socks.reply = reply
+        client = SOCKS5Client('localhost', self.mock_socks.port, optimistic=optimistic)
+        return client.connect('example.com', 25)
+
+    def test_bound_address_types(self):
+        """Replies with IPv4, domain and IPv6 bound addresses are consumed exactly"""
+        replies = [
+            b'\x05\x00\x00\x01' + bytes(4) + b'\x00\x50',
+            b'\x05\x00\x00\x03\x0bexample.com\x00\x50',
+            b'\x05\x00\x00\x04' + bytes(16) + b'\x00\x50',
+        ]
+        for optimistic in (True, False):
+            for reply in replies:
+                with self.subTest(optimistic=optimistic, atyp=reply[3]):
+                    sock = self._connect(raw_echo_origin, reply, optimistic)
+                    self.assertIsNotNone(sock)
+                    sock.sendall(b'ping')
+                    self.assertEqual(sock.recv(4), b'ping')
+                    sock.close()
+                    self.mock_socks.close()
+
+    def test_banner_after_reply_not_consumed(self):
+        """Bytes the target sends right after the reply stay in the socket"""
+        sock = self._connect(banner_origin)
+        self.assertIsNotNone(sock)
+        sock.settimeout(2.0)
+        self.assertEqual(sock.recv(64), b'220 ready\r\n')
+        sock.close()
+
+    def test_connect_failure_reply(self):
+        """A non-zero reply code fails the connection with the reply"""
+        for optimistic in (True, False):
+            with self.subTest(optimistic=optimistic):
+                with self.assertRaises(SOCKSReplyError) as raised:
+                    self._connect(raw_echo_origin, b'\x05\x05\x00\x01' + bytes(6), optimistic)
+                self.assertEqual(raised.exception.reply, SOCKSResponse.CONNECTION_REFUSED)
+                self.assertEqual(raised.exception.http_status(), (502, 'Bad Gateway'))
+                self.mock_socks.close()
+
+    def test_optimistic_handshake_single_round_trip(self):
+        """The optimistic client sends greeting and CONNECT before the first reply, the sequential one does not"""
+        for optimistic in (False, True):
+            with self.subTest(optimistic=optimistic):
+                server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                server.bind(('localhost', 0))
+                server.listen(1)
+                received = {}
+
+                def serve():
+                    conn, _ = server.accept()
+                    with conn:
+                        # Everything the client sends before it hears anything back
+                        time.sleep(0.2)
+                        conn.setblocking(False)
+                        try:
+                            received['before_reply'] = conn.recv(1024)
+                        except BlockingIOError:
+                            received['before_reply'] = b''
+                        conn.setblocking(True)
+                        conn.sendall(b'\x05\x00')
+                        if not optimistic:
+                            conn.recv(1024)
+                        conn.sendall(b'\x05\x00\x00\x01\x00\x00\x00\x00\x00\x00')
+                        conn.recv(1)
+
+                thread = threading.Thread(target=serve, daemon=True)
+                thread.start()
+                client = SOCKS5Client('localhost', server.getsockname()[1], optimistic=optimistic)
+                sock = client.connect('example.com', 80)
+                self.assertIsNotNone(sock)
+                sock.close()
+                thread.join(timeout=2.0)
+                server.close()
+
+                greeting = b'\x05\x01\x00'
+                connect = b'\x05\x01\x00\x03\x0bexample.com\x00\x50'
+                self.assertEqual(received['before_reply'], greeting + connect if optimistic else greeting)
+
+
+@unittest.skipUnless(REUSEPORT_SUPPORTED, "SO_REUSEPORT not available")
+class TestProxySupervisor(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        logging.disable(logging.CRITICAL)
+
+    def setUp(self):
+        self.mock_socks = MockSOCKSServer(keep_alive_origin)
+        self.http_port = get_free_port()
+        self.supervisor = ProxySupervisor(socks_port=self.mock_socks.port, http_port=self.http_port,
+                                          settings=ProxySettings(workers=2), stats_interval=0.1)
+        self.thread = threading.Thread(target=self.supervisor.start, daemon=True)
+        self.thread.start()
+        self._wait_for(lambda: self.supervisor.stats()['workers_alive'] == 2)
+
+    def tearDown(self):
+        self.supervisor.stop()
+        self.thread.join(timeout=10.0)
+        self.mock_socks.close()
+
+    def _wait_for(self, condition, timeout=5.0):
+        deadline = time.monotonic() + timeout
+        while not condition() and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertTrue(condition())
+
+    def _get(self):
+        deadline = time.monotonic() + 5.0
+        while True:
+            try:
+                with socket.create_connection(('localhost', self.http_port), timeout=2.0) as client:
+                    client.sendall(b'GET http://example.com/ HTTP/1.1\r\nHost: example.com\r\n'
+                                   b'Proxy-Connection: close\r\n\r\n')
+                    return read_http_response(client)
+            except ConnectionRefusedError:
+                # Workers bind the port shortly after they start
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.05)
+
+    def test_workers_share_port_and_stats_aggregate(self):
+        """Requests are served by the workers and counted in the supervisor totals"""
+        for _ in range(6):
+            self.assertTrue(self._get().endswith(b'hello'))
+        self._wait_for(lambda: self.supervisor.stats().get('connections_accepted') == 6)
+
+    def test_dead_worker_restarted(self):
+        """A killed worker is replaced and its counters are kept"""
+        self.assertTrue(self._get().endswith(b'hello'))
+        self._wait_for(lambda: self.supervisor.stats().get('connections_accepted') == 1)
+        os.kill(self.supervisor.processes[0].pid, signal.SIGKILL)
+        self._wait_for(lambda: self.supervisor.stats()['worker_restarts'] == 1)
+        self._wait_for(lambda: self.supervisor.stats()['workers_alive'] == 2)
+        self.assertTrue(self._get().endswith(b'hello'))
+        self._wait_for(lambda: self.supervisor.stats().get('connections_accepted') == 2)
+
+
+class TestCommandLine(unittest.TestCase):
+    def test_asyncio_engine_refuses_threaded_options(self):
+        """Options the asyncio engine would ignore are rejected instead"""
+        self.assertEqual(parse_args(['--engine', 'asyncio', '--backlog', '64']).backlog, 64)
+        with patch('sys.stderr'):
+            for argv in (['--blocklist', 'hosts'], ['--rules-file', 'rules'], ['--workers', '2'],
+                         ['--no-socks-optimistic']):
+                with self.subTest(argv=argv):
+                    with self.assertRaises(SystemExit):
+                        parse_args(['--engine', 'asyncio'] + argv)
+        self.assertEqual(parse_args(['--blocklist', 'hosts']).blocklist, ['hosts'])
+
+
+class TestAsyncSOCKStoHTTPProxy(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        logging.disable(logging.CRITICAL)
+
+    def setUp(self):
+        self.host = 'localhost'
+        self.socks_port = get_free_port()
+        self.http_port = get_free_port()
+
+        self.mock_socks_server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.mock_socks_server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.mock_socks_server.bind((self.host, self.socks_port))
+        self.mock_socks_server.listen(5)
+        self.mock_socks_server.settimeout(2.0)
+
+        self.proxy = AsyncSOCKStoHTTPProxy(
+            socks_host=self.host,
+            socks_port=self.socks_port,
+            http_host=self.host,
+            http_port=self.http_port
+        )
+        self.proxy_thread = threading.Thread(target=self.proxy.start, daemon=True)
+        self.proxy_thread.start()
+        time.sleep(0.2)
+
+    def tearDown(self):
+        self.proxy.stop()
+        self.proxy_thread.join(timeout=2.0)
+        self.mock_socks_server.close()
+
+    def _mock_socks_echo(self):
+        """Accept one SOCKS client, complete the handshake and echo data back"""
+        try:
+            conn, _ = self.mock_socks_server.accept()
+            conn.settimeout(2.0)
+            conn.recv(3)
+            conn.send(b'\x05\x00')
+            conn.recv(1024)
+            conn.send(b'\x05\x00\x00\x01\x00\x00\x00\x00\x00\x00')
+            while True:
+                data = conn.recv(1024)
+                if not data:
+                    break
+                conn.sendall(data)
+            conn.close()
+        except Exception as e:
+            logging.error(f"Mock SOCKS handler error: {e}")
+
+    def test_connect_tunnel(self):
+        """CONNECT tunnels relay data both ways on the asyncio engine"""
+        socks_thread = threading.Thread(target=self._mock_socks_echo, daemon=True)
+        socks_thread.start()
+
+        with socket.create_connection((self.host, self.http_port), timeout=2.0) as client:
+            client.sendall(b'CONNECT example.com:443 HTTP/1.1\r\nHost: example.com:443\r\n\r\n')
+            response = client.recv(1024)
+            self.assertIn(b'200 Connection Established', response)
+
+            client.sendall(b'ping')
+            self.assertEqual(client.recv(1024), b'ping')
+
+        socks_thread.join(timeout=2.0)
+
+    def test_regular_request_forwarded(self):
+        """Plain HTTP requests are forwarded to the SOCKS upstream"""
+        socks_thread = threading.Thread(target=self._mock_socks_echo, daemon=True)
+        socks_thread.start()
+
+        request = b'GET / HTTP/1.1\r\nHost: example.com\r\n\r\n'
+        with socket.create_connection((self.host, self.http_port), timeout=2.0) as client:
+            client.sendall(request)
+            self.assertEqual(client.recv(1024), request)
+
+        socks_thread.join(timeout=2.0)
+
+    def test_stop_ends_start(self):
+        """stop() unblocks start() from another thread"""
+        self.proxy.stop()
+        self.proxy_thread.join(timeout=2.0)
+        self.assertFalse(self.proxy_thread.is_alive())
+
+
+class TestDataForwarder(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        logging.disable(logging.CRITICAL)
+
+    def _tcp_pair(self):
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as listener:
+            listener.bind(('127.0.0.1', 0))
+            listener.listen(1)
+            client = socket.create_connection(listener.getsockname())
+            server, _ = listener.accept()
+        return client, server
+
+    def _relay_payload(self, use_splice: bool, buffer_pool=None, **options):
+        """Push a payload through a forwarder and return what arrives"""
+        payload = os.urandom(1024 * 1024)
+        src_writer, src = self._tcp_pair()
+        dst, dst_reader = self._tcp_pair()
+        forwarder = DataForwarder(src, dst, "test", buffer_size=65536, use_splice=use_splice,
+                                  buffer_pool=buffer_pool, **options)
+        forwarder.start()
+
+        def feed():
+            src_writer.sendall(payload)
+            src_writer.close()
+
+        feeder = threading.Thread(target=feed, daemon=True)
+        feeder.start()
+
+        received = bytearray()
+        dst_reader.settimeout(5.0)
+        while len(received) < len(payload):
+            chunk = dst_reader.recv(65536)
+            if not chunk:
+                break
+            received += chunk
+
+        feeder.join(timeout=2.0)
+        forwarder.thread.join(timeout=2.0)
+        for sock in (src, dst, dst_reader):
+            sock.close()
+        return payload, bytes(received), forwarder
+
+    def test_copy_relay(self):
+        """Copy mode delivers the payload unchanged"""
+        payload, received, _ = self._relay_payload(use_splice=False)
+        self.assertEqual(received, payload)
+
+    def test_copy_relay_reuses_pooled_buffer(self):
+        """Forwarders return their buffer to the pool and later ones reuse it"""
+        pool = BufferPool(buffer_size=16384, max_idle=4)
+        for _ in range(3):
+            payload, received, _ = self._relay_payload(use_splice=False, buffer_pool=pool)
+            self.assertEqual(received, payload)
+        self.assertEqual(pool.stats(), {'buffers_allocated': 1, 'buffers_reused': 2,
+                                        'buffers_in_use': 0, 'buffers_idle': 1})
+
+    def test_body_relay_reuses_pooled_buffer(self):
+        """Bodies relayed by a reader, early bytes included, arrive whole through one pooled buffer"""
+        pool = BufferPool(buffer_size=16384, max_idle=4)
+        payload = os.urandom(100000)
+        chunked = b'%x\r\n%s\r\n0\r\n\r\n' % (len(payload), payload)
+        src_writer, src = self._tcp_pair()
+        dst, dst_reader = self._tcp_pair()
+        reader = SocketReader(src, initial=payload[:100], buffer_pool=pool)
+        feeder = threading.Thread(target=lambda: src_writer.sendall(payload[100:] + chunked), daemon=True)
+        feeder.start()
+        received = bytearray()
+
+        def drain():
+            dst_reader.settimeout(5.0)
+            while len(received) < len(payload) + len(chunked):
+                chunk = dst_reader.recv(65536)
+                if not chunk:
+                    break
+                received.extend(chunk)
+
+        drainer = threading.Thread(target=drain, daemon=True)
+        drainer.start()
+        sunk = bytearray()
+        self.assertTrue(reader.relay_body(dst, BodyFraming.LENGTH, len(payload)))
+        self.assertTrue(reader.relay_body(dst, BodyFraming.CHUNKED, sink=sunk.extend))
+        drainer.join(timeout=5.0)
+        for sock in (src_writer, src, dst, dst_reader):
+            sock.close()
+        self.assertEqual(bytes(received), payload + chunked)
+        self.assertEqual(bytes(sunk), payload)
+        self.assertEqual(pool.stats(), {'buffers_allocated': 1, 'buffers_reused': 1,
+                                        'buffers_in_use': 0, 'buffers_idle': 1})
+
+    @unittest.skipUnless(SPLICE_SUPPORTED, "os.splice is Linux only")
+    def test_splice_relay(self):
+        """Splice mode delivers the payload unchanged and stops at EOF"""
+        payload, received, forwarder = self._relay_payload(use_splice=True)
+        self.assertEqual(received, payload)
+        self.assertFalse(forwarder.thread.is_alive())
+
+    def test_relay_budget_is_returned(self):
+        """Reservations cover at most one buffer per forwarder and are all released"""
+        for use_splice in (False, True) if SPLICE_SUPPORTED else (False,):
+            with self.subTest(use_splice=use_splice):
+                budget = RelayBudget(1024 * 1024)
+                payload, received, _ = self._relay_payload(use_splice, budget=budget)
+                self.assertEqual(received, payload)
+                self.assertEqual(budget.in_flight, 0)
+                self.assertLessEqual(budget.peak, 65536)
+
+    def test_relay_budget_waits_for_room(self):
+        budget = RelayBudget(100)
+        stop_event = threading.Event()
+        self.assertTrue(budget.reserve(80, stop_event))
+        reserved = threading.Event()
+        waiter = threading.Thread(target=lambda: budget.reserve(80, stop_event) and reserved.set())
+        waiter.start()
+        self.assertFalse(reserved.wait(0.2))
+        budget.release(80)
+        self.assertTrue(reserved.wait(2.0))
+        waiter.join()
+        self.assertEqual(budget.stats()['relay_budget_waits'], 1)
+
+        # A reservation larger than the cap still succeeds when nothing else is in flight
+        budget.release(80)
+        self.assertTrue(budget.reserve(500, stop_event))
+        budget.close()
+        self.assertFalse(budget.reserve(1, stop_event))
+
+    @unittest.skipUnless(SEND_QUEUE_SUPPORTED, "SIOCOUTQ is Linux only")
+    def test_high_watermark_pauses_reading(self):
+        """A forwarder stops reading while its receiver lets the destination queue fill up"""
+        src_writer, src = socket.socketpair()
+        dst, dst_reader = socket.socketpair()
+        budget = RelayBudget()
+        relayed = []
+        forwarder = DataForwarder(src, dst, "test", buffer_size=8192, on_data=relayed.append,
+                                  budget=budget, high_watermark=32768, low_watermark=8192)
+        forwarder.start()
+        payload = os.urandom(1024 * 1024)
+        feeder = threading.Thread(target=src_writer.sendall, args=(payload,), daemon=True)
+        feeder.start()
+
+        time.sleep(0.5)
+        self.assertLess(sum(relayed), 65536)
+        self.assertGreaterEqual(send_queue_size(dst), 32768)
+        self.assertGreaterEqual(budget.watermark_pauses, 1)
+
+        received = bytearray()
+        dst_reader.settimeout(5.0)
+        while len(received) < len(payload):
+            received += dst_reader.recv(65536)
+        self.assertEqual(bytes(received), payload)
+
+        feeder.join(timeout=2.0)
+        forwarder.stop_event.set()
+        forwarder.thread.join(timeout=2.0)
+        for sock in (src_writer, src, dst, dst_reader):
+            sock.close()
+
+
 def get_free_port() -> int:
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
         sock.bind(('', 0))